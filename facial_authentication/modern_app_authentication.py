@@ -16,8 +16,12 @@ from src.configuration.app_authentication_config import _AppConfiguration
 import src.utility.gui_window_utility as window_utility
 from src.processor.image_processor import ImageProcessor
 from src.processor.face_processor import FaceProcessor
+from src.processor.command_scheduler import CommandFanOut
 from src.network_comms.socket_handler import SocketHandler
 from src.network_comms.database_handler import DatabaseHandler
+from src.network_comms.metrics_http_server import MetricsHttpServer
+from src.utility import pipeline_metrics
+from src.processor import rsid_backend
 
 # Import modernized components
 from src.GUI_authentication.modern_components.modern_image_feedback import ModernImageFeedback
@@ -252,25 +256,15 @@ class ModernAuthenticationApplication(ttk_modern.Frame):
         # ---Generate unique station ID---
         self.station_id = self.generate_station_id()
         LOGGER.info(f"Station ID: {self.station_id}")
+        pipeline_metrics.get_registry().set_label("station_id", self.station_id)
         
         # ---Processor creation---
-        self.socket_handler = SocketHandler()
-        self.image_processor = ImageProcessor(
-            self.feedback_livestream_image_q, 
-            self.feedback_livestream_detections_q, 
-            self.config
-        )
-        self.face_processor = FaceProcessor(
-            self,
-            self.cmd_request_q, 
-            self.ready_status_q,
-            self.feedback_msg_q, 
-            self.faces_detected_feedback_q,
-            self.feedback_livestream_detections_q, 
-            self.config,
-            FaceProcessor.MODE_AUTHENTICATION, 
-            self.socket_handler
+        self.socket_handler = SocketHandler(
+            outbox_path=self.config.attendance_outbox_path,
+            outbox_size=self.config.attendance_outbox_size,
+            event_max_age_seconds=self.config.attendance_event_max_age_seconds
         )
+        self.init_camera_processors()
         
         # ---Initialize modern UI components---
         self.init_single_column_scrollable_ui()
@@ -293,6 +287,53 @@ class ModernAuthenticationApplication(ttk_modern.Frame):
         # ---START CAMERA MONITORING (after full initialization)---
         self.after(3000, self._start_camera_monitoring)  # Start after 3 seconds
 
+    def init_camera_processors(self):
+        """
+        One image processor and face processor pair per camera. The first camera is the one shown in the GUI and the
+        one enrolments run on, the others authenticate in the background and share the gallery, the matchers and
+        the socket handler with it.
+        """
+        cameras = self.config.get_cameras()
+        LOGGER.info(f"Cameras: {[camera.PORT for camera in cameras]}")
+        # Commands requested on the GUI go to every camera that runs them
+        camera_request_qs = [self.cmd_request_q] if len(cameras) == 1 else [queue.Queue() for _ in cameras]
+        # Secondary cameras are not shown, their ready status is not the one of the GUI buttons and their messages do
+        # not go to the status bar of the camera shown, they are logged with their camera
+        self.secondary_ready_status_q = queue.Queue()
+        self.secondary_feedback_msg_qs = []
+
+        self.camera_processors = []
+        for index, camera in enumerate(cameras):
+            primary = index == 0
+            detections_q = self.feedback_livestream_detections_q if primary else queue.Queue()
+            feedback_msg_q = self.feedback_msg_q if primary else queue.Queue()
+            if not primary:
+                self.secondary_feedback_msg_qs.append((camera.camera_id or camera.PORT, feedback_msg_q))
+            # Metrics of each camera carry its camera label
+            with pipeline_metrics.labelled(**({"camera": camera.camera_id} if camera.camera_id else {})):
+                image_processor = ImageProcessor(
+                    self.feedback_livestream_image_q if primary else queue.Queue(),
+                    detections_q,
+                    camera
+                )
+                face_processor = FaceProcessor(
+                    self,
+                    camera_request_qs[index],
+                    self.ready_status_q if primary else self.secondary_ready_status_q,
+                    feedback_msg_q,
+                    self.faces_detected_feedback_q if primary else queue.Queue(),
+                    detections_q,
+                    camera,
+                    FaceProcessor.MODE_AUTHENTICATION,
+                    self.socket_handler
+                )
+            self.camera_processors.append((image_processor, face_processor))
+
+        self.image_processor, self.face_processor = self.camera_processors[0]
+        self.command_fan_out = None
+        if len(cameras) > 1:
+            self.command_fan_out = CommandFanOut(self.cmd_request_q, camera_request_qs)
+
     def setup_modern_theme(self):
         """Setup modern dark theme"""
         try:
@@ -339,6 +380,9 @@ class ModernAuthenticationApplication(ttk_modern.Frame):
     
     def _start_camera_monitoring(self):
         """Start camera disconnect monitoring"""
+        if rsid_backend.is_simulated():
+            LOGGER.info("Simulated device, camera disconnect monitoring not started")
+            return
         try:
             self.camera_monitor.start_monitoring()
             LOGGER.info("🔍 Camera disconnect monitoring started - app will shutdown if camera disconnected")
@@ -926,20 +970,45 @@ class ModernAuthenticationApplication(ttk_modern.Frame):
 
     def begin_processors(self):
         """Start all processors"""
+        self.begin_metrics_server()
         self.begin_web_socket_server()
         time.sleep(self.START_DELAY)
         self.begin_image_processing()
         self.begin_face_processing()
 
     def begin_image_processing(self):
-        self.image_processor.start()
+        for image_processor, _ in self.camera_processors:
+            image_processor.start()
 
     def begin_face_processing(self):
-        self.face_processor.start()
+        if self.command_fan_out is not None:
+            self.command_fan_out.start()
+            threading.Thread(target=self.drain_secondary_ready_status_q, daemon=True).start()
+            for camera_label, feedback_msg_q in self.secondary_feedback_msg_qs:
+                threading.Thread(
+                    target=self.log_secondary_feedback, args=(camera_label, feedback_msg_q), daemon=True
+                ).start()
+        for _, face_processor in self.camera_processors:
+            face_processor.start()
+
+    def drain_secondary_ready_status_q(self):
+        while True:
+            self.secondary_ready_status_q.get()
+
+    def log_secondary_feedback(self, camera_label, feedback_msg_q):
+        while True:
+            feedback = feedback_msg_q.get()
+            LOGGER.face_rec(f'Camera {camera_label}: {feedback["msg"]}')
 
     def begin_web_socket_server(self):
         self.socket_handler.start()
 
+    def begin_metrics_server(self):
+        if not self.config.metrics_http_enabled:
+            return
+        self.metrics_server = MetricsHttpServer(port=self.config.metrics_http_port)
+        self.metrics_server.start()
+
     def init_modern_window_properties(self):
         """Initialize modern window properties"""
         self.parent.title(f'ENVIS Face Recognition - {self.station_id}')
@@ -1,4 +1,5 @@
 import threading
+import time
 import tkinter as tk
 from tkinter import ttk
 import ttkbootstrap as ttk_modern
@@ -6,6 +7,7 @@ from ttkbootstrap.constants import *
 import queue
 from PIL import Image, ImageTk, ImageDraw, ImageFilter
 import src.logger.custom_logger as custom_logger
+from src.utility import pipeline_metrics
 
 LOGGER = custom_logger.get_logger()
 
@@ -39,8 +41,18 @@ class ModernImageFeedback(ttk_modern.Frame):
         self.aspect_ratio = 300 / 450  # 0.667 (portrait)
         
         # Display settings optimized for 400px app width (leave margins for UI)
-        self.display_width = 280   # Optimized for 400px app width with margins
-        self.display_height = 420  # Maintains aspect ratio (280 * 1.5)
+        self.display_width = self.config.display_size_x or 280   # Optimized for 400px app width with margins
+        self.display_height = self.config.display_size_y or 420  # Maintains aspect ratio (280 * 1.5)
+
+        # Time taken by the GUI thread to put the last frame on screen
+        self.last_blit_ms = 0.0
+
+        # Frame pipeline metrics
+        self.metrics = pipeline_metrics.get_registry()
+        self.display_meter = self.metrics.meter('display_frames', 'Frames put on screen by the GUI')
+        self.blit_histogram = self.metrics.histogram('display_blit_ms', 'Time spent by the GUI thread displaying a frame')
+        self.queue_lag_histogram = self.metrics.histogram('display_queue_lag_ms', 'Time between frame capture and display')
+        self.dropped_counter = self.metrics.counter('display_frames_dropped', 'Frames skipped because a newer frame was queued')
         
         # Animation state
         self.pulse_alpha = 0
@@ -202,6 +214,21 @@ class ModernImageFeedback(ttk_modern.Frame):
         # )
         # self.process_time_label.pack(side=RIGHT)
 
+    def blit_image(self, pil_image):
+        """Display an image that is already at display size (prepared by the image processor's display pipeline)"""
+        start_time = time.perf_counter()
+
+        if (isinstance(self.livestream_image, ImageTk.PhotoImage)
+                and (self.livestream_image.width(), self.livestream_image.height()) == pil_image.size):
+            # Reuse the existing Tk image, only the pixels are copied over
+            self.livestream_image.paste(pil_image)
+        else:
+            self.livestream_image = ImageTk.PhotoImage(pil_image)
+            self.lbl_image.configure(image=self.livestream_image, text="")
+
+        self.last_blit_ms = (time.perf_counter() - start_time) * 1000
+        self.blit_histogram.observe(self.last_blit_ms)
+
     def resize_and_display_image(self, pil_image):
         """Resize image optimized for 400px app width (280px display)"""
         try:
@@ -279,6 +306,14 @@ class ModernImageFeedback(ttk_modern.Frame):
         try:
             while True:
                 image_from_queue = self.feedback_livestream_image_q.get_nowait()
+
+                # Skip straight to the newest frame, anything older is stale by now
+                while True:
+                    try:
+                        image_from_queue = self.feedback_livestream_image_q.get_nowait()
+                        self.dropped_counter.inc()
+                    except queue.Empty:
+                        break
                 
                 if isinstance(image_from_queue, ImageTk.PhotoImage):
                     # Already a PhotoImage - use directly (fallback)
@@ -286,13 +321,22 @@ class ModernImageFeedback(ttk_modern.Frame):
                     self.lbl_image.configure(image=image_from_queue, text="")
                     
                 elif isinstance(image_from_queue, Image.Image):
-                    # PIL Image - resize and convert
-                    self.resize_and_display_image(image_from_queue)
+                    if image_from_queue.size == (self.display_width, self.display_height):
+                        # Already letterboxed to display size - just blit
+                        self.blit_image(image_from_queue)
+                    else:
+                        # PIL Image - resize and convert
+                        self.resize_and_display_image(image_from_queue)
                     
                 else:
                     LOGGER.warning(f"Unknown image type received: {type(image_from_queue)}")
                     continue
 
+                self.display_meter.mark()
+                capture_time = getattr(image_from_queue, 'info', {}).get('capture_time')
+                if capture_time is not None:
+                    self.queue_lag_histogram.observe_since(capture_time)
+
                 # Trigger the image set event
                 self.event_generate("<<ON_IMAGE_FEEDBACK_SET>>")
                 
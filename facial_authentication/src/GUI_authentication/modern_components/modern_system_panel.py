@@ -8,6 +8,7 @@ import time
 import psutil
 import socket
 import src.logger.custom_logger as custom_logger
+from src.utility import pipeline_metrics
 
 LOGGER = custom_logger.get_logger()
 
@@ -45,7 +46,10 @@ class ModernSystemPanel(ttk_modern.Frame):
         
         # Component references
         self.system_status_items = {}
-        self.performance_bars = {}  # Keep this for compatibility even if not used
+        self.performance_bars = {}
+
+        # Frame pipeline metrics fed by the image/face processors and the image feedback
+        self.metrics = pipeline_metrics.get_registry()
         
         self.init_modern_ui()
         self.start_monitoring()
@@ -59,9 +63,8 @@ class ModernSystemPanel(ttk_modern.Frame):
         # System Information Section
         self.init_system_info_section(main_container)
         
-        # PERFORMANCE SECTION DISABLED
-        # Uncomment the line below to re-enable performance metrics
-        # self.init_performance_section(main_container)
+        # Performance Section
+        self.init_performance_section(main_container)
         
         # Daily Statistics Section
         self.init_daily_stats_section(main_container)
@@ -97,11 +100,23 @@ class ModernSystemPanel(ttk_modern.Frame):
             LOGGER.error(f"Failed to get system info: {e}")
 
     def init_performance_section(self, parent):
-        """Initialize performance metrics section - DISABLED"""
-        # This method is kept for compatibility but won't be called
-        # You can remove this entire method if you want
-        LOGGER.info("Performance section is disabled")
-        pass
+        """Initialize performance metrics section"""
+        performance_container = self.create_section_container(parent)
+
+        # (label, metric name, unit)
+        performance_metrics = [
+            ("Capture", "capture_frames", "fps"),
+            ("Display", "display_frames", "fps"),
+            ("Detection", "face_detect_ms", "ms"),
+            ("Overlay", "overlay_ms", "ms"),
+            ("Resize", "display_resize_ms", "ms"),
+            ("Queue Lag", "display_queue_lag_ms", "ms"),
+            ("Dropped", "display_frames_dropped", "frames"),
+            ("Auth Attempt", "auth_attempt_ms", "ms")
+        ]
+
+        for label, key, unit in performance_metrics:
+            self.create_performance_metric(performance_container, label, key, unit)
 
     def init_daily_stats_section(self, parent):
         """Initialize daily statistics section"""
@@ -205,10 +220,47 @@ class ModernSystemPanel(ttk_modern.Frame):
         self.system_status_items[key] = value_widget
 
     def create_performance_metric(self, parent, label, key, unit):
-        """Create a performance metric with progress bar - DISABLED"""
-        # This method is kept for compatibility but won't be used
-        LOGGER.debug(f"Performance metric creation disabled for: {label}")
-        pass
+        """Create a performance metric row"""
+        item_frame = tk.Frame(parent, bg=MODERN_COLORS['surface'])
+        item_frame.pack(fill=X, padx=10, pady=2)
+
+        label_widget = tk.Label(
+            item_frame,
+            text=f"{label}:",
+            font=('Segoe UI', 8),
+            bg=MODERN_COLORS['surface'],
+            fg=MODERN_COLORS['text_secondary'],
+            anchor='w'
+        )
+        label_widget.pack(side=LEFT)
+
+        value_widget = tk.Label(
+            item_frame,
+            text="--",
+            font=('Segoe UI', 8, 'bold'),
+            bg=MODERN_COLORS['surface'],
+            fg=MODERN_COLORS['text_primary'],
+            anchor='e'
+        )
+        value_widget.pack(side=RIGHT)
+
+        self.performance_bars[key] = {
+            'value': value_widget,
+            'unit': unit
+        }
+
+    @staticmethod
+    def format_performance_value(metric_snapshot, unit):
+        """Format a metric snapshot for display"""
+        if metric_snapshot is None:
+            return "--"
+        if unit == "fps":
+            return f"{metric_snapshot['rate']:.1f} fps"
+        if unit == "ms":
+            if metric_snapshot['count'] == 0:
+                return "--"
+            return f"{metric_snapshot['p50_ms']:.1f} / {metric_snapshot['p95_ms']:.1f} ms"
+        return f"{metric_snapshot} {unit}"
 
     def create_stat_card(self, parent, icon, value, label, row, column, color):
         """Create a statistics card"""
@@ -329,10 +381,19 @@ class ModernSystemPanel(ttk_modern.Frame):
             LOGGER.debug(f"Error updating system info: {e}")
 
     def update_performance_metrics(self):
-        """Update performance metrics - DISABLED"""
-        # Performance monitoring is disabled
-        LOGGER.debug("Performance metrics update is disabled")
-        pass
+        """Update performance metrics, latencies are shown as p50 / p95"""
+        try:
+            metrics_snapshot = self.metrics.snapshot()["metrics"]
+            for key, performance_item in self.performance_bars.items():
+                value = metrics_snapshot.get(key)
+                if value is None:
+                    # Multi-camera station: the metrics of the first camera, the one shown in the GUI
+                    value = next((value for name, value in metrics_snapshot.items() if name.startswith(key + '{')), None)
+                performance_item['value'].configure(
+                    text=self.format_performance_value(value, performance_item['unit'])
+                )
+        except Exception as e:
+            LOGGER.debug(f"Error updating performance metrics: {e}")
 
     def update_status_indicator(self, key, status):
         """Update a specific status indicator"""
@@ -363,14 +424,13 @@ class ModernSystemPanel(ttk_modern.Frame):
         # Update display (you would need to store references to update the cards)
 
     def start_monitoring(self):
-        """Start system monitoring - Performance monitoring disabled"""
+        """Start system monitoring"""
         def monitoring_loop():
             while True:
                 try:
                     # Schedule UI updates on main thread
                     self.after_idle(self.update_system_info)
-                    # Performance metrics update is disabled
-                    # self.after_idle(self.update_performance_metrics)
+                    self.after_idle(self.update_performance_metrics)
                     
                     # Update status indicators based on actual system state
                     
@@ -431,15 +491,15 @@ class ModernSystemPanel(ttk_modern.Frame):
         self.after(3000, lambda: notification_frame.destroy())
 
     def get_system_summary(self):
-        """Get system summary for external monitoring - Performance data excluded"""
+        """Get system summary for external monitoring"""
         try:
             uptime = datetime.now() - self.start_time
             
             return {
                 'uptime_seconds': int(uptime.total_seconds()),
                 'daily_stats': self.daily_stats.copy(),
+                'performance': self.metrics.snapshot()["metrics"],
                 'timestamp': datetime.now().isoformat()
-                # Performance metrics removed: 'cpu_usage', 'memory_usage'
             }
         except Exception as e:
             LOGGER.error(f"Error getting system summary: {e}")
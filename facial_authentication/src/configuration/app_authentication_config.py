@@ -1,10 +1,14 @@
 from pathlib import Path
 import serial.tools.list_ports
-import sys
 import src.logger.custom_logger as custom_logger
+from src.processor import rsid_backend
 LOGGER = custom_logger.get_logger()
 
 
+class CameraConfigurationError(Exception):
+	pass
+
+
 class _AppConfiguration:
 	def __init__(self):
 		# TODO: target properties for PSMS etc page:
@@ -15,7 +19,19 @@ class _AppConfiguration:
 
 		# TODO: Replace below with configurations retrieved from DB
 		config = {
-			"PORT": _AppConfiguration.get_camera_port(),
+			# "device" (rsid_py and the F455) or "simulated" (src/simulator/rsid_py.py, settings in rsid_simulator)
+			"device_backend": "device",
+			# Simulator settings overriding its DEFAULT_SETTINGS, e.g. {"auth_seconds": 0.8, "serial_error_rate": 0.01}
+			"rsid_simulator": {},
+
+			# Cameras run by this station, each with its own capture and authentication pipeline. Empty runs every F455
+			# found on the system, e.g. [{"serial_number": "...", "direction": "in"}, {"port": "COM4", "direction": "out"}]
+			#   port or serial_number: the device, a serial number is looked up among the connected devices
+			#   direction: attendance reported for the faces authenticated, "in" (ETC_IN) or "out" (ETC_OUT)
+			#   preview_camera_number: camera number of the device preview, -1 auto detects (single camera only, required
+			#   for every camera when there are several)
+			"cameras": [],
+			"camera_direction_default": "out",
 
 			# The min required score authenticating faces must hit to get a match
 			"min_auth_score_threshold": 1000, #2600
@@ -29,6 +45,121 @@ class _AppConfiguration:
 			"image_feedback_size_x": 400,
 			"image_feedback_size_y": 600,
 
+			# Letterbox frames to the display size in a single pass on the image processor thread
+			"display_pipeline_enabled": True,
+			# The camera display size inside the GUI, must match the GUI camera frame
+			"display_size_x": 280,
+			"display_size_y": 420,
+
+			# Frame pipeline metrics exported over HTTP (/metrics and /metrics.json)
+			"metrics_http_enabled": True,
+			"metrics_http_port": 9997,
+
+			# Attendance events sent to the PSMS page are kept until it acknowledges them, and sent again when it
+			# reconnects (e.g. the page reloaded) unless older than attendance_event_max_age_seconds. Only a page that
+			# sends {"type": "hello", "ack": true} gets them again, a page that does not acknowledge only gets live events
+			"attendance_outbox_path": "./write/attendance_outbox.jsonl",
+			"attendance_outbox_size": 200,
+			"attendance_event_max_age_seconds": 120,
+
+			# Authentication pacing, in seconds: step back notice and countdown at startup, time a result stays on
+			# screen, and pause after it before the next person is authenticated
+			"auth_startup_delay_seconds": 5,
+			"auth_startup_countdown_seconds": 5,
+			"auth_result_display_seconds": 1.0,
+			"auth_cooldown_seconds": 0.3,
+			# Pipelined matching: the device extracts the next person while up to auth_pipeline_max_pending faceprints
+			# wait for a matcher (0 matches on the device thread). A result is replaced by the next one after at least
+			# auth_result_min_display_seconds
+			"auth_pipeline_max_pending": 4,
+			"auth_pipeline_matcher_workers": 1,
+			"auth_result_min_display_seconds": 0.5,
+			# An extraction is cancelled once its face leaves the frame or after this many seconds (None: no deadline)
+			"auth_extraction_deadline_seconds": 5.0,
+
+			# Enrolment keeps the best of this many captures, chosen on the host by scoring the captures against each
+			# other (1 enrols the first successful capture)
+			"enroll_best_out_of": 3,
+			# Mean cosine similarity the chosen capture must have with the other captures, lower means they are
+			# unlikely to be the same face
+			"enroll_min_consistency": 0.7,
+			# Similarity to another employee's faceprint from which the face is considered already enrolled (None: no check)
+			"enroll_duplicate_similarity": 0.8,
+
+			# Device session: reconnection backoff after a serial error, in seconds, and attempts and seconds before
+			# the device is reported unreachable
+			"device_reconnect_initial_delay": 0.5,
+			"device_reconnect_max_delay": 10.0,
+			"device_max_connect_attempts": 10,
+			"device_connect_timeout": 30.0,
+
+			# Device config written to the F455 when it runs another one (rsid_py enum member names),
+			# overrides the "default" profile of device_config_manager.py
+			"device_config": {
+				"camera_rotation": "Rotation_0_Deg",
+				"security_level": "Medium",
+				"algo_flow": "All",
+				"face_selection_policy": "Single"
+			},
+			# Config last applied per device serial number is kept while connected to the device. Set a path (e.g.
+			# "./write/device_config_cache.json") to also keep it across restarts: the device config is then not
+			# queried at start, a device reset or swapped while the app was stopped keeps its config until a reconnect
+			"device_config_cache_path": None,
+			# Query the config back after writing it
+			"device_config_verify_after_write": False,
+
+			# Frame pipeline run on every camera frame:
+			#   "face" (face presence), "face_gesture" (face presence and gestures),
+			#   "gesture", "gesture_time", "gesture_pop", "gesture_nonpop", "gesture_array"
+			"frame_pipeline_variant": "face",
+			# Stages of the variant to skip, e.g. ["overlay"]
+			"frame_pipeline_disabled_stages": [],
+
+			# Gesture detection: "tracking" (video mode around the face) or "static" (full frame, every frame)
+			"gesture_engine": "tracking",
+			"gesture_roi_enabled": True,
+			# Skip gesture inference unless a face is present and not yet accepted
+			"gesture_only_while_auth_pending": True,
+			# Sliding gesture vote ("ring" vote of the face_gesture variant): frames voted over, and fraction of them a
+			# gesture must hold to be published. None keeps the default window of 10 frames. Variants with a window of
+			# their own (gesture_pop, gesture_nonpop, gesture_array) keep it
+			"gesture_vote_window": None,
+			"gesture_vote_quorum": 0.6,
+
+			# Host-side face detector: "mediapipe", "yunet" (OpenCV DNN), "haar" or "stub" (always reports a face)
+			"face_detector_backend": "mediapipe",
+			"face_detector_min_confidence": 0.5,
+			# Frames are downscaled to this width before detection (yunet and haar only)
+			"face_detector_input_width": 320,
+			"face_detector_yunet_model_path": "./model/face_detection_yunet_2022mar.onnx",
+
+			# Follow detected faces across frames, an accepted face is not re-authenticated until it leaves the frame
+			"face_tracker_enabled": True,
+			"face_tracker_iou_threshold": 0.3,
+			# Frames without a matching detection before a face is considered gone
+			"face_tracker_max_missed_frames": 15,
+
+			# Only signal the face processor for faces likely to pass the device checks
+			"face_quality_gate_enabled": True,
+			# Minimum face box width, relative to the frame width
+			"face_quality_min_width_ratio": 0.18,
+			# Maximum distance of the face centre from the frame centre, relative to the frame size
+			"face_quality_max_center_offset": 0.25,
+			# Minimum variance of the Laplacian over the face, lower is blurrier
+			"face_quality_min_sharpness": 50.0,
+			# Maximum nose offset from the middle of the eyes, relative to the eye distance
+			"face_quality_max_yaw": 0.3,
+
+			# Camera frame source: "live" (F455 preview) or "file" (replay a recording made with frame_record_path)
+			"frame_source": "live",
+			"frame_source_path": "./write/recordings/session.npz",
+			# "real" replays at the recorded pace, "max" delivers frames back to back
+			"frame_source_speed": "real",
+			"frame_source_loop": True,
+			# Set a path to record the incoming camera frames for later replay, None to disable
+			"frame_record_path": None,
+			"frame_record_max_frames": 600,
+
 			# Turn on to resize GUI to fit PSMS etc page standards
 			"gui_resize_to_fit_enabled": True,
 
@@ -37,6 +168,10 @@ class _AppConfiguration:
 			"debug_toggle_border_color_enabled": False,
 		}
 		# Dynamic calculation
+		rsid_backend.select(config["device_backend"], config["rsid_simulator"])
+		config["PORT"] = _AppConfiguration.get_camera_port()
+		config["camera_id"] = None
+		config["etc_direction"] = config["camera_direction_default"]
 		config["fps_in_millisecond"] = int(1000/config["frames_per_second"])
 		if config.get("gui_resize_to_fit_enabled"):
 			config.update({
@@ -55,6 +190,49 @@ class _AppConfiguration:
 			print(f'_AppConfiguration Warning: {name} config does not exist, defaulting to None')
 			return None
 
+	def get_cameras(self):
+		"""Configuration of each camera pipeline, the first one drives the GUI display and commands"""
+		camera_settings = list(self.config["cameras"] or [])
+		if not camera_settings:
+			ports = _AppConfiguration.get_camera_ports()
+			# Without a device a single pipeline is kept, its device session reports the device unreachable
+			camera_settings = [{"port": port} for port in ports] or [{"port": self.config["PORT"]}]
+
+		# The preview cannot be told apart from the serial port: with -1 every pipeline would auto detect the same
+		# camera, and authenticate the faces standing at another door
+		if len(camera_settings) > 1 and not rsid_backend.is_simulated():
+			missing = [
+				settings.get("serial_number") or settings.get("port") for settings in camera_settings
+				if settings.get("preview_camera_number") in (None, -1)
+			]
+			if missing:
+				message = (
+					f'{len(camera_settings)} cameras but no preview_camera_number set for {missing}, list them in the '
+					f'"cameras" config with the camera number of their preview'
+				)
+				LOGGER.error(message)
+				raise CameraConfigurationError(message)
+
+		cameras = []
+		for index, settings in enumerate(camera_settings):
+			port = settings.get("port")
+			if port is None and settings.get("serial_number") is not None:
+				port = _AppConfiguration.get_camera_port_by_serial_number(settings["serial_number"])
+			camera_config = {
+				"PORT": port,
+				# Metrics, feed channels and face tracks are only told apart when there is more than one camera
+				"camera_id": str(index + 1) if len(camera_settings) > 1 else None,
+				"camera_serial_number": settings.get("serial_number"),
+				"preview_camera_number": settings.get("preview_camera_number"),
+				"etc_direction": settings.get("direction") or self.config["camera_direction_default"]
+			}
+			if index > 0:
+				# Only the first camera is shown in the GUI
+				camera_config["frame_pipeline_disabled_stages"] = \
+					list(self.config["frame_pipeline_disabled_stages"] or []) + ["overlay", "display"]
+			cameras.append(_CameraConfiguration(self, camera_config))
+		return cameras
+
 	@staticmethod
 	def __debug_camera_info():
 		import json
@@ -80,8 +258,28 @@ class _AppConfiguration:
 		with open("log/device/device_tracing.json", "w", encoding='utf-8') as json_file:
 			json.dump(dump_data, json_file, ensure_ascii=False, indent=4, default=str)
 
+	@staticmethod
+	def get_camera_ports():
+		"""Serial ports of every F455 connected"""
+		if rsid_backend.is_simulated():
+			from src.simulator.rsid_py import SIMULATED_PORT
+			return [SIMULATED_PORT]
+		return [port.device for port in serial.tools.list_ports.comports() if 'USB VID:PID=2AAD:6373' in port.hwid]
+
+	@staticmethod
+	def get_camera_port_by_serial_number(serial_number):
+		for port in serial.tools.list_ports.comports():
+			if 'USB VID:PID=2AAD:6373' in port.hwid and port.serial_number == serial_number:
+				return port.device
+		LOGGER.error(f'Camera with serial number {serial_number} not detected on the system!')
+		return None
+
 	@staticmethod
 	def get_camera_port():
+		if rsid_backend.is_simulated():
+			from src.simulator.rsid_py import SIMULATED_PORT
+			return SIMULATED_PORT
+
 		_AppConfiguration.__debug_camera_info()
 
 		ports = serial.tools.list_ports.comports()
@@ -90,8 +288,21 @@ class _AppConfiguration:
 			if 'USB VID:PID=2AAD:6373' in port.hwid:
 				com_port = port.device
 
+		# The device session keeps trying to connect, and reports the device unreachable, instead of exiting here
 		if com_port is None:
-			LOGGER.error("No Intel F455 camera device detected on the system! Program exiting.")
-			sys.exit()
+			LOGGER.error('No Intel F455 camera device detected on the system! Set "device_backend": "simulated" to run without one.')
 
 		return com_port
+
+
+class _CameraConfiguration:
+	"""App configuration seen by the processors of one camera, the camera settings override the app ones"""
+
+	def __init__(self, app_config, camera_config):
+		self.app_config = app_config
+		self.camera_config = camera_config
+
+	def __getattr__(self, name):
+		if name in self.camera_config:
+			return self.camera_config[name]
+		return getattr(self.app_config, name)
@@ -56,6 +56,26 @@ class DatabaseHandler:
         except requests.exceptions.RequestException as e:
             raise requests.exceptions.RequestException(e)
 
+    @staticmethod
+    def add_faceprints(fp_dicts):
+        """
+        Save several faceprints over one kept-alive connection.
+        :return: the number of leading faceprints saved, the first rejected one and the ones after it were not sent
+        """
+        saved = 0
+        with requests.Session() as session:
+            for fp_dict in fp_dicts:
+                try:
+                    response = session.post(DatabaseHandler.ADD_FACEPRINT_URL, json=fp_dict, verify=False, headers={"x-api-key":"OA7A1kuHiI"})
+                    response.raise_for_status()
+                except requests.exceptions.RequestException as e:
+                    if not saved:
+                        raise requests.exceptions.RequestException(e)
+                    LOGGER.error(f'Saving faceprint of {fp_dict.get("employee_id")} failed: {e}')
+                    break
+                saved += 1
+        return saved
+
     @staticmethod
     def ping():
         try:
@@ -0,0 +1,65 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import src.logger.custom_logger as custom_logger
+from src.utility import pipeline_metrics
+
+LOGGER = custom_logger.get_logger()
+
+
+class MetricsHttpServer(threading.Thread):
+    """
+    Exposes the frame pipeline metrics over HTTP so degraded stations can be spotted remotely.
+        GET /metrics        Prometheus text format
+        GET /metrics.json   JSON snapshot, same data as the system panel performance section
+    """
+    HOST = '0.0.0.0'
+    PORT = 9997
+
+    def __init__(self, host=HOST, port=PORT, registry=None):
+        LOGGER.info("MetricsHttpServer init...")
+        super().__init__(daemon=True)
+        self.host = host
+        self.port = port
+        self.registry = registry or pipeline_metrics.get_registry()
+        self.http_server = None
+        LOGGER.info("MetricsHttpServer init complete.")
+
+    def run(self):
+        registry = self.registry
+
+        class _MetricsRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body = registry.to_prometheus().encode('utf-8')
+                    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+                elif self.path == '/metrics.json':
+                    body = json.dumps(registry.snapshot(), default=str).encode('utf-8')
+                    content_type = 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Scrapes are frequent, keep them out of the info log
+                LOGGER.debug(f'Metrics request from {self.address_string()}: {format % args}')
+
+        try:
+            self.http_server = ThreadingHTTPServer((self.host, self.port), _MetricsRequestHandler)
+        except OSError as e:
+            LOGGER.error(f'Unable to start metrics HTTP server on {self.host}:{self.port}: {e}')
+            return
+
+        LOGGER.info(f'Metrics HTTP server ready to serve on {self.host}:{self.port}')
+        self.http_server.serve_forever()
+
+    def stop(self):
+        if self.http_server is not None:
+            self.http_server.shutdown()
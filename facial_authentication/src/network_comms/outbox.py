@@ -0,0 +1,183 @@
+import itertools
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import src.logger.custom_logger as custom_logger
+from src.utility import pipeline_metrics
+
+LOGGER = custom_logger.get_logger()
+
+
+class Outbox:
+    """
+    Records waiting to be sent to a server, journaled to disk until the server accepted them.
+
+    put() appends the record to the journal, flush() sends the pending records in batches of batch_size. A record
+    leaves the journal only once the server accepted it, so an unreachable server or a crash loses nothing: the
+    records left are sent when the outbox is opened again, in the order they were put.
+
+    Records delivered some other way, e.g. pushed to websocket clients that acknowledge them, are taken out with ack()
+    instead of flush(). Record IDs are never reused, they can serve as sequence numbers.
+    """
+
+    def __init__(self, path, send_batch, batch_size=20, name='outbox', journal_flush_seconds=None):
+        """
+        :param path: journal file, created if missing
+        :param send_batch: send_batch(records) -> number of leading records the server accepted, raises if the server
+            could not be reached. None if the records are only taken out with ack()
+        :param name: prefix of the outbox metrics
+        :param journal_flush_seconds: None writes the journal through on every change. Otherwise changes are buffered
+            and written, and the journal compacted, by a background thread this often: put() and ack() then never wait
+            on the disk, e.g. on an event loop, and a crash loses at most the last journal_flush_seconds of changes
+        """
+        self.path = Path(path)
+        self.send_batch = send_batch
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        # Flushes run one at a time, records put meanwhile wait for the next flush
+        self.flush_lock = threading.Lock()
+        self.pending = OrderedDict()
+        self.next_id = 0
+        # Lines in the journal file, compacted once the pending records are at most half of them
+        self.journal_entries = 0
+
+        self.metrics = pipeline_metrics.get_registry(scoped=False)
+        self.sent_counter = self.metrics.counter(f'{name}_sent', 'Records accepted by the server')
+        self.failure_counter = self.metrics.counter(f'{name}_send_failures', 'Batches that could not be sent, or only in part')
+        self.batch_histogram = self.metrics.histogram(f'{name}_batch_ms', 'Time spent sending a batch of records')
+        self.metrics.gauge(f'{name}_pending', 'Records waiting to be sent', lambda: len(self.pending))
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.load()
+        self.journal = open(self.path, 'a', encoding='utf-8')
+
+        self.journal_flush_seconds = journal_flush_seconds
+        self.closed = threading.Event()
+        if journal_flush_seconds is not None:
+            threading.Thread(target=self.run_journal_flusher, daemon=True).start()
+
+    def load(self):
+        """Pending records of the journal: every record put minus the ones acknowledged"""
+        if not self.path.exists():
+            return
+        with open(self.path, encoding='utf-8') as journal:
+            for line in journal:
+                self.journal_entries += 1
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Last line cut short by a crash
+                    continue
+                if "ack" in entry:
+                    for record_id in entry["ack"]:
+                        self.pending.pop(record_id, None)
+                elif "next_id" in entry:
+                    self.next_id = max(self.next_id, entry["next_id"])
+                else:
+                    self.pending[entry["id"]] = entry["record"]
+                    self.next_id = max(self.next_id, entry["id"] + 1)
+        if self.pending:
+            LOGGER.info(f'{len(self.pending)} record(s) left in {self.path} from the last run')
+
+    def __len__(self):
+        return len(self.pending)
+
+    def put(self, record):
+        with self.lock:
+            record_id = self.next_id
+            self.next_id += 1
+            self.pending[record_id] = record
+            self.write({"id": record_id, "record": record})
+        return record_id
+
+    def items(self):
+        """(record_id, record) of the pending records, in the order they were put"""
+        with self.lock:
+            return list(self.pending.items())
+
+    def ack(self, record_ids):
+        """Take out records the server accepted, returns the IDs that were still pending"""
+        acked = self.remove(record_ids)
+        self.sent_counter.inc(len(acked))
+        return acked
+
+    def discard(self, record_ids):
+        """Take out records that will not be sent, e.g. too old to be of use. Returns the IDs that were still pending"""
+        return self.remove(record_ids)
+
+    def remove(self, record_ids):
+        with self.lock:
+            removed = [record_id for record_id in record_ids if self.pending.pop(record_id, None) is not None]
+            if removed:
+                self.write({"ack": removed})
+        if self.journal_flush_seconds is None:
+            self.compact()
+        return removed
+
+    def write(self, entry):
+        self.journal.write(json.dumps(entry) + '\n')
+        self.journal_entries += 1
+        if self.journal_flush_seconds is None:
+            self.journal.flush()
+
+    def run_journal_flusher(self):
+        while not self.closed.wait(self.journal_flush_seconds):
+            with self.lock:
+                self.journal.flush()
+            self.compact()
+
+    def flush(self):
+        """Send the pending records, stops at the first batch the server did not take. Returns the records sent"""
+        sent = 0
+        with self.flush_lock:
+            while True:
+                with self.lock:
+                    batch = list(itertools.islice(self.pending.items(), self.batch_size))
+                if not batch:
+                    break
+                batch_start_time = time.perf_counter()
+                try:
+                    accepted = self.send_batch([record for _, record in batch])
+                except Exception as e:
+                    self.failure_counter.inc()
+                    LOGGER.error(f'Sending {len(batch)} record(s) from {self.path} failed, kept for later: {e}')
+                    break
+                self.batch_histogram.observe_since(batch_start_time)
+                acked = self.ack([record_id for record_id, _ in batch[:accepted]])
+                sent += len(acked)
+                if accepted < len(batch):
+                    self.failure_counter.inc()
+                    break
+            self.compact()
+        return sent
+
+    def compact(self):
+        """
+        Rewrite the journal as the records still pending, so it does not grow forever while some record is always
+        pending, e.g. events nobody acknowledges until they expire. Done once they are at most half of the journal, so
+        the rewrites cost no more than the changes that made them necessary
+        """
+        with self.lock:
+            live_entries = len(self.pending) + 1
+            if self.journal_entries <= 1 or self.journal_entries < 2 * live_entries:
+                return
+            self.journal.close()
+            # Written aside and swapped in, a crash during the rewrite leaves the previous journal
+            compacted_path = self.path.with_name(self.path.name + '.compact')
+            with open(compacted_path, 'w', encoding='utf-8') as journal:
+                # IDs carry on from there after a restart
+                journal.write(json.dumps({"next_id": self.next_id}) + '\n')
+                for record_id, record in self.pending.items():
+                    journal.write(json.dumps({"id": record_id, "record": record}) + '\n')
+            os.replace(compacted_path, self.path)
+            self.journal = open(self.path, 'a', encoding='utf-8')
+            self.journal_entries = live_entries
+
+    def close(self):
+        self.closed.set()
+        with self.lock:
+            self.journal.close()
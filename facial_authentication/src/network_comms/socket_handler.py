@@ -1,31 +1,99 @@
+import argparse
 import asyncio, random
 import websockets
 import json
 import time
 import threading
-import requests
-import datetime
-import os
 import socket
+import sys
+from pathlib import Path
 
 import src.logger.custom_logger as custom_logger
+from src.network_comms.outbox import Outbox
+from src.utility import pipeline_metrics
 
 LOGGER = custom_logger.get_logger()
 
 
+class _ClientConnection:
+	"""Connected browser client and the messages waiting to be sent to it"""
+
+	def __init__(self, websocket, queue_size):
+		self.websocket = websocket
+		# (time the broadcast was requested, event sequence number, JSON message)
+		self.outbound_q = asyncio.Queue(maxsize=queue_size)
+		# Events from this one on are broadcast to the client, the ones before are replayed if it asks for them
+		self.first_live_seq = 0
+
+
 class SocketHandler(threading.Thread):
 	HOST = 'localhost'
 	PORT = 9998
-
-	def __init__(self):
+	# Messages a client may fall behind by before it is disconnected, it can reconnect and catch up from there
+	CLIENT_QUEUE_SIZE = 32
+	# Bytes buffered by the websocket of a client before a send waits, the outbound queue absorbs the bursts instead
+	WRITE_LIMIT = 2 ** 12
+	# Seconds between pings of a client, and for its pong to come back before the connection is considered dead
+	PING_INTERVAL = 20
+	PING_TIMEOUT = 20
+	# Attendance events not acknowledged by a client yet, replayed to the clients that acknowledge events
+	OUTBOX_PATH = './write/attendance_outbox.jsonl'
+	OUTBOX_SIZE = 200
+	# The outbox journal is written in the background this often, never on the event loop
+	OUTBOX_FLUSH_SECONDS = 0.2
+	EVENT_MAX_AGE_SECONDS = 120
+
+	def __init__(
+			self, host=HOST, port=PORT, client_queue_size=CLIENT_QUEUE_SIZE, ping_interval=PING_INTERVAL,
+			ping_timeout=PING_TIMEOUT, outbox_path=OUTBOX_PATH, outbox_size=OUTBOX_SIZE,
+			event_max_age_seconds=EVENT_MAX_AGE_SECONDS
+	):
 		LOGGER.info("SockerHandler init...")
 		super().__init__()
+		self.host = host
+		self.port = port
+		self.client_queue_size = client_queue_size
+		self.ping_interval = ping_interval
+		self.ping_timeout = ping_timeout
+		self.outbox_size = outbox_size
+		self.event_max_age_seconds = event_max_age_seconds
+		self.event_outbox = Outbox(
+			outbox_path, send_batch=None, name='attendance_outbox', journal_flush_seconds=SocketHandler.OUTBOX_FLUSH_SECONDS
+		)
+		# Last event handed to the connected clients by the dispatcher
+		self.dispatched_seq = self.event_outbox.next_id - 1
 		self.websockets_list = []
 
 		self.async_broadcast_msg_q = None
 		self.async_event_loop = None
-		self.connected_clients = set()
+		# websocket -> _ClientConnection
+		self.connected_clients = {}
 		self.client_handler_func = self.client_handler_3
+		self.server_ready = threading.Event()
+
+		self.metrics = pipeline_metrics.get_registry(scoped=False)
+		self.sent_counter = self.metrics.counter('websocket_messages_sent', 'Messages sent to the browser clients')
+		self.slow_client_counter = self.metrics.counter(
+			'websocket_slow_clients_dropped', 'Clients disconnected for falling behind the broadcasts'
+		)
+		self.delivery_histogram = self.metrics.histogram(
+			'websocket_delivery_ms', 'Time from a broadcast request to its delivery to a client'
+		)
+		self.connection_counter = self.metrics.counter('websocket_connections', 'Clients connected since startup')
+		self.ping_timeout_counter = self.metrics.counter(
+			'websocket_ping_timeouts', 'Clients disconnected for not answering a ping'
+		)
+		self.ping_histogram = self.metrics.histogram('websocket_ping_ms', 'Round trip time of the pings to the clients')
+		self.metrics.gauge('websocket_clients', 'Connected browser clients', lambda: len(self.connected_clients))
+		self.replay_counter = self.metrics.counter(
+			'attendance_events_replayed', 'Unacknowledged events sent to a client that connected after them'
+		)
+		self.expired_counter = self.metrics.counter(
+			'attendance_events_expired', 'Events given up on, too old or pushed out of a full outbox'
+		)
+		self.ack_histogram = self.metrics.histogram(
+			'attendance_event_ack_ms', 'Time from an attendance event to its acknowledgement by a client'
+		)
 
 		LOGGER.info("SocketHandler complete.")
 
@@ -51,21 +119,49 @@ class SocketHandler(threading.Thread):
 				self.websockets_list.remove(websocket)
 
 	def broadcast_to_clients(self, employee_id, attendance):
-		async def _broadcast_to_clients():
-			# If there are clients connected on browser
-			if len(self.connected_clients) != 0:
-				await self.async_broadcast_msg_q.put(
-					{
-						"type": "result",
-						"user": employee_id,
-						"pin": "04AB1A2A313180",
-						"attendance": attendance
-					}
-				)
-
-		# Start the coroutine function on THIS thread
-		# 	BUT using the main event loop of the socket_handler's thread
-		asyncio.run_coroutine_threadsafe(_broadcast_to_clients(), self.async_event_loop)
+		message = {
+			"type": "result",
+			"user": employee_id,
+			"pin": "04AB1A2A313180",
+			"attendance": attendance
+		}
+		# Hand the message over to the event loop of the socket_handler's thread, the dispatcher takes it from there
+		self.async_event_loop.call_soon_threadsafe(self.publish, message)
+
+	def publish(self, message):
+		"""
+		Queue a message for every connected client, called on the event loop. The message is kept in the event outbox
+		under a new sequence number until a client acknowledges it, so clients connecting later still get it.
+		"""
+		self.expire_events(reserve=1)
+		record = dict(message, timestamp=time.time())
+		seq = self.event_outbox.put(record)
+		self.async_broadcast_msg_q.put_nowait((time.perf_counter(), seq, dict(record, seq=seq)))
+
+	def expire_events(self, reserve=0):
+		"""Give up on the events older than event_max_age_seconds, and on the oldest ones past outbox_size - reserve"""
+		oldest_timestamp = time.time() - self.event_max_age_seconds
+		pending = self.event_outbox.items()
+		overflow = len(pending) + reserve - self.outbox_size
+		expired = [seq for seq, record in pending if record["timestamp"] < oldest_timestamp]
+		if len(expired) < overflow:
+			LOGGER.warning(f'Attendance outbox full, dropping {overflow - len(expired)} unacknowledged event(s)')
+			expired = [seq for seq, _ in pending[:overflow]]
+		if expired:
+			self.event_outbox.discard(expired)
+			self.expired_counter.inc(len(expired))
+			LOGGER.info(f'{len(expired)} attendance event(s) expired before a client acknowledged them')
+
+	def is_event_pending(self, seq):
+		record = self.event_outbox.pending.get(seq)
+		return record is not None and time.time() - record["timestamp"] <= self.event_max_age_seconds
+
+	def ack_event(self, seq):
+		record = self.event_outbox.pending.get(seq)
+		if not self.event_outbox.ack([seq]):
+			LOGGER.debug(f'Event {seq} acknowledged already or expired')
+			return
+		self.ack_histogram.observe((time.time() - record["timestamp"]) * 1000)
 
 	async def client_handler_1(self, websocket, path, extra_argument):
 		LOGGER.debug(
@@ -100,126 +196,151 @@ class SocketHandler(threading.Thread):
 		}
 		await websocket.send(json.dumps(response_dict))
 
-	async def producer(self):
-		return await self.async_broadcast_msg_q.get()
-
-	async def poll_and_broadcast_msg(self):
-		# Outer loop to perform continuous polling for new msg
+	async def dispatch_broadcasts(self):
+		"""
+		Single consumer of the broadcast queue: each message is serialised once and copied to the outbound queue of
+		every client, the clients' senders then deliver it concurrently. A client whose queue is full is not keeping
+		up, it is disconnected rather than holding back the others or buffering without bound.
+		"""
 		while True:
-			# try:
-			message = await self.producer()
-			user = message.get("user")
-			pin = message.get("pin")
+			enqueued_at, seq, message = await self.async_broadcast_msg_q.get()
+			payload = json.dumps(message)
+			self.dispatched_seq = seq
 
-			LOGGER.info(f'Broadcasting to {len(self.connected_clients)} client(s)---> user: {user}, pin: {pin}')
-
-			# Inner loop to ensure msg is broad-casted to all connect clients
-			for client in self.connected_clients.copy():
-				LOGGER.info(f'Sending msg to [{client.id}] ')
-				try:
-					await client.send(json.dumps(message))
-					LOGGER.info(f'Message sent.')
-				# If client is disconnected, remove them from list
-				except websockets.exceptions.ConnectionClosed:
-					LOGGER.info(f'[{client.id}] websockets.exceptions.ConnectionClosed: Removing disconnected client.')
-					self.connected_clients.remove(client)
-
-	def init_client_heartbeat_checker(self):
-		def _check_client_heartbeat(delay=59):
-			time.sleep(delay)
-			LOGGER.debug(f'Checking client heartbeat...')
-			if len(self.connected_clients) >= 1:
-				LOGGER.info("Connected")
-				#file_directory = "X:/Sharedfolders/Personnel Matters/Miscellaneous/ENVIS/ETCStations/Plant2R" 
-				#file_path = os.path.join(file_directory, "Status.txt")
-				send_to_aws = False
-				if send_to_aws:
-					host_name = socket.gethostname()
-					ip = socket.gethostbyname(socket.gethostname())
-					ping_date = str(datetime.datetime.now().date())
-					timestamp = str(datetime.datetime.now().time())
-					stn = "etc_stn0"
-					entry_name = stn + "_" + ping_date + "_" + timestamp
-					aws_url = 'https://yi7tqdi8fe.execute-api.ap-southeast-1.amazonaws.com/items'
-					aws_data = {"id":entry_name,"hostname":host_name,"ip":ip,"ping_date":ping_date,"stn":stn, "timestamp":timestamp}
-					#aws_data = {"id":"12","hostname":'N1-H2PWMN3-01',"ip":'10.32.80.59',"ping_date":"2024-02-26 17:45:0000","stn":"etc_stn0"}
-					print(aws_data)
-					#AWS Put request
-					print("Sending second post request")
-					headers = {'User-Agent':'PostmanRuntime/7.36.3','Accept':'*/*','Accept-Encoding':'gzip, deflate, br','Content-Type':'application/json'}
-					response = requests.post(aws_url, json=aws_data,headers=headers,verify=False)
-					print(response.status_code)
-
-				# try:
-				# 	print("Sending first get request")
-				# 	result = requests.get("http://n1-1022-011232.stengggrp.local/microapi/post/N1-1022-011168")
-				# 	LOGGER.info(f"{result=}")
-                    
-				# except Exception as e: 
-				# 	LOGGER.error(e)
-				'''
-				if time.time() % 15 == 0:
-					time.sleep(2)
-					LOGGER.info(f"Hello world!")
-					try:
-						result = requests.get("http://titan-rpt.staero.sg:5000/microapi/post/N1-1022-011168")
-						LOGGER.info(f"{result=}")
-					except Exception as e: 
-						LOGGER.error(e)
-					#with open(file_path, "a") as file:
-						#file.write(str(datetime.datetime.now()) + "\n")
-				'''
-			asyncio.run_coroutine_threadsafe(_check_heartbeat(), self.async_event_loop)
-
-		async def _check_heartbeat():
-			for client in self.connected_clients.copy():
-				LOGGER.debug(f'Sending PING to [{client.id}] ')
+			LOGGER.info(f'Broadcasting to {len(self.connected_clients)} client(s)---> user: {message.get("user")}')
+			for client in list(self.connected_clients.values()):
 				try:
-					await client.send(json.dumps({
-						"type": "ping"
-					}))
-				# If client is disconnected, remove them from list
-				except websockets.exceptions.ConnectionClosed:
-					LOGGER.debug(f'[{client.id}] websockets.exceptions.ConnectionClosed: Removing disconnected client.')
-					self.connected_clients.remove(client)
-			LOGGER.info(f'Active clients connection: {len(self.connected_clients)}')
-
-		_check_client_heartbeat(0)
+					client.outbound_q.put_nowait((enqueued_at, seq, payload))
+				except asyncio.QueueFull:
+					self.drop_slow_client(client)
+
+	def drop_slow_client(self, client):
+		websocket = client.websocket
+		if self.connected_clients.pop(websocket, None) is None:
+			return
+		self.slow_client_counter.inc()
+		LOGGER.warning(f'Client[{websocket.id}] is {client.outbound_q.qsize()} messages behind, disconnecting it')
+		# 1013: try again later, the client reconnects with an empty queue
+		asyncio.ensure_future(websocket.close(code=1013, reason='Too slow'))
+
+	async def send_to_client(self, client):
+		"""
+		Sender of one client, a slow send only delays the messages of that client. An event is sent only while it is
+		pending: once a client acknowledged it, it is never sent again, to this client or any other.
+		"""
 		while True:
-			_check_client_heartbeat()
-
-	def spawn_client_heartbeat_checker_thread(self):
-		LOGGER.debug(f'Starting client heartbeat checker')
-		threading.Thread(target=lambda: self.init_client_heartbeat_checker(), daemon=True).start()
+			enqueued_at, seq, payload = await client.outbound_q.get()
+			if not self.is_event_pending(seq):
+				continue
+			await client.websocket.send(payload)
+			self.sent_counter.inc()
+			self.delivery_histogram.observe_since(enqueued_at)
+
+	async def receive_from_client(self, client):
+		"""
+		Read what the client sends. Also makes its close frame seen as soon as it arrives, unread messages would pile
+		up until the websocket stops reading the connection.
+			{"type": "hello", "ack": true}      the client acknowledges the events, it gets the ones it missed
+			{"type": "ack", "seq": <event seq>}  the client handled the event, it is not sent again
+		"""
+		async for message in client.websocket:
+			try:
+				request = json.loads(message)
+			except ValueError:
+				request = None
+			if isinstance(request, dict) and request.get("type") == "ack" and isinstance(request.get("seq"), int):
+				self.ack_event(request["seq"])
+			elif isinstance(request, dict) and request.get("type") == "hello" and request.get("ack") is True:
+				await self.replay_events(client)
+			else:
+				LOGGER.debug(f'[{client.websocket.id}] Ignoring message from client: {message}')
+
+	async def replay_events(self, client):
+		"""
+		Send the pending events published before the client connected, e.g. during a reload of the page. Only to
+		clients that acknowledge events: a page that does not would be sent the same results again on every reload.
+		"""
+		self.expire_events()
+		replay = [(seq, record) for seq, record in self.event_outbox.items() if seq < client.first_live_seq]
+		if not replay:
+			return
+		self.replay_counter.inc(len(replay))
+		LOGGER.info(f'Replaying {len(replay)} unacknowledged attendance event(s) to Client[{client.websocket.id}]')
+		for seq, record in replay:
+			if self.is_event_pending(seq):
+				await client.websocket.send(json.dumps(dict(record, seq=seq)))
+
+	async def keep_alive(self, client):
+		"""Ping the client every ping_interval, a client that does not answer within ping_timeout is closed"""
+		websocket = client.websocket
+		while True:
+			await asyncio.sleep(self.ping_interval)
+			ping_start_time = time.perf_counter()
+			pong_waiter = await websocket.ping()
+			try:
+				await asyncio.wait_for(pong_waiter, self.ping_timeout)
+			except asyncio.TimeoutError:
+				self.ping_timeout_counter.inc()
+				LOGGER.warning(f'Client[{websocket.id}] did not answer a ping within {self.ping_timeout} s, disconnecting it')
+				# 1011 as the websockets keepalive, the handler removes the client without waiting for the close
+				asyncio.ensure_future(websocket.close(code=1011, reason='keepalive ping timeout'))
+				return
+			self.ping_histogram.observe_since(ping_start_time)
 
 	async def client_handler_3(self, websocket, path, extra_argument):
 		LOGGER.info(
 			f'Client[{websocket.id}] connected from {websocket.origin}, IP: {websocket.remote_address[0]}, extra_argument: {extra_argument}')
-		self.connected_clients.add(websocket)
+		client = _ClientConnection(websocket, self.client_queue_size)
+		client.first_live_seq = self.dispatched_seq + 1
+		self.connected_clients[websocket] = client
+		self.connection_counter.inc()
 		LOGGER.info(f'Current client connection in memory: {len(self.connected_clients)}')
 
-		await self.poll_and_broadcast_msg()
+		# The client is removed as soon as one of them ends: connection closed, send failed or ping unanswered
+		tasks = [
+			asyncio.ensure_future(self.send_to_client(client)),
+			asyncio.ensure_future(self.receive_from_client(client)),
+			asyncio.ensure_future(self.keep_alive(client))
+		]
+		try:
+			done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+			for task in done:
+				error = task.exception()
+				# If client is disconnected, remove them from list
+				if error is None or isinstance(error, websockets.exceptions.ConnectionClosed):
+					LOGGER.info(f'[{websocket.id}] Connection closed: Removing disconnected client.')
+				else:
+					LOGGER.error(f'[{websocket.id}] Client connection failed, removing it: {error}')
+		finally:
+			if self.connected_clients.get(websocket) is client:
+				del self.connected_clients[websocket]
+			LOGGER.info(f'Current client connection in memory: {len(self.connected_clients)}')
+			for task in tasks:
+				task.cancel()
+			await asyncio.gather(*tasks, return_exceptions=True)
 
 	async def start_server(self):
 		LOGGER.info('Web socket server started')
-		# asyncio.create_task(SocketHandler.consumer())
 		self.async_broadcast_msg_q = asyncio.Queue()
 		self.async_event_loop = asyncio.get_event_loop()
 		LOGGER.debug(f'async_event_loop active settings: {self.async_event_loop}')
 
-		self.spawn_client_heartbeat_checker_thread()
-
-		LOGGER.info(f'Web socket server ready to serve')
+		asyncio.ensure_future(self.dispatch_broadcasts())
 
 		async with websockets.serve(
 				lambda websocket, path: self.client_handler_func(websocket, path, "hej"),
-				SocketHandler.HOST,
-				SocketHandler.PORT
+				self.host,
+				self.port,
+				write_limit=SocketHandler.WRITE_LIMIT,
+				# Pinged by keep_alive() instead, which also measures the round trip
+				ping_interval=None
 		):
+			LOGGER.info(f'Web socket server ready to serve')
+			self.server_ready.set()
 			await asyncio.Future()  # run forever
 
 	def run(self):
-		asyncio.run(self.start_server(), debug=True)
+		asyncio.run(self.start_server(), debug=False)
 
 
 def mimic_facial_recognition_process(socket_handler):
@@ -236,7 +357,7 @@ def mimic_facial_recognition_process(socket_handler):
 			LOGGER.debug('Trying to put message...')
 			if len(socket_handler.connected_clients) != 0:
 				LOGGER.debug('Putting message...')
-				await socket_handler.async_broadcast_msg_q.put(
+				socket_handler.publish(
 					{
 						"status": "OK",
 						"values": {
@@ -257,7 +378,247 @@ def mimic_facial_recognition_process(socket_handler):
 	asyncio.run_coroutine_threadsafe(_mimic_facial_recognition_process(), socket_handler.async_event_loop)
 
 
+def _load_test_clients(url, clients, stalled_clients, messages, result_q, stop_event):
+	"""Browser clients of the load test, run in their own process so they do not compete with the server for the GIL"""
+	async def _client(index):
+		received = []
+		# A small receive buffer so a stalled client backs up into the server quickly
+		sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+		sock.connect((SocketHandler.HOST, int(url.rsplit(':', 1)[1])))
+		sock.setblocking(False)
+		async with websockets.connect(url, sock=sock, close_timeout=1) as websocket:
+			if index < stalled_clients:
+				# Never reads, e.g. a browser tab frozen by the OS
+				websocket.transport.pause_reading()
+				while not stop_event.is_set():
+					await asyncio.sleep(0.1)
+				return received
+			try:
+				async for payload in websocket:
+					user = json.loads(payload)["user"]
+					received.append((user, time.perf_counter()))
+					if user == messages - 1:
+						break
+			except websockets.exceptions.ConnectionClosed:
+				pass
+		return received
+
+	async def _run():
+		return await asyncio.gather(*(_client(index) for index in range(clients)))
+
+	result_q.put(asyncio.run(_run()))
+
+
+def _start_test_server(**kwargs):
+	with socket.socket() as sock:
+		sock.bind((SocketHandler.HOST, 0))
+		port = sock.getsockname()[1]
+	socket_handler = SocketHandler(port=port, **kwargs)
+	socket_handler.daemon = True
+	socket_handler.start()
+	socket_handler.server_ready.wait()
+	return socket_handler, f'ws://{SocketHandler.HOST}:{port}'
+
+
+def load_test(clients, stalled_clients, messages, interval, ping_interval, ping_timeout, max_p99_ms):
+	"""
+	Delivery latency of the broadcasts to many clients, a few of them stalled, and how fast the clients are let go.
+	Returns True if every responsive client got every broadcast within max_p99_ms at the 99th percentile, and every
+	stalled client was disconnected
+	"""
+	import multiprocessing
+	import tempfile
+	import numpy as np
+
+	# The clients do not acknowledge the results, the outbox keeps them all
+	socket_handler, url = _start_test_server(
+		ping_interval=ping_interval, ping_timeout=ping_timeout,
+		outbox_path=Path(tempfile.mkdtemp()) / 'attendance_outbox.jsonl', outbox_size=messages
+	)
+
+	result_q = multiprocessing.Queue()
+	stop_event = multiprocessing.Event()
+	client_process = multiprocessing.Process(
+		target=_load_test_clients,
+		args=(url, clients, stalled_clients, messages, result_q, stop_event)
+	)
+	client_process.start()
+	while len(socket_handler.connected_clients) < clients:
+		time.sleep(0.1)
+	# Loopback buffers would absorb megabytes before a stalled client holds up its sender, emulate a slow link
+	for websocket in list(socket_handler.connected_clients):
+		websocket.transport.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+
+	# Results come from the face processor thread, like here
+	published_at = {}
+	start = time.perf_counter()
+	for index in range(messages):
+		published_at[index] = time.perf_counter()
+		socket_handler.broadcast_to_clients(index, "in")
+		time.sleep(interval)
+	publish_seconds = time.perf_counter() - start
+	time.sleep(1)
+	stop_event.set()
+	results = result_q.get()
+	# The clients have closed their connections
+	closed_at = time.perf_counter()
+	while socket_handler.connected_clients:
+		time.sleep(0.001)
+	removal_seconds = time.perf_counter() - closed_at
+	client_process.join()
+
+	responsive = results[stalled_clients:]
+	latencies_ms = [
+		(received_at - published_at[index]) * 1000 for received in responsive for index, received_at in received
+	]
+	delivered = sum(len(received) for received in responsive)
+	print(f'{clients} clients ({stalled_clients} stalled), {messages} messages over {publish_seconds:.1f} s')
+	print(f'Delivered {delivered}/{messages * len(responsive)} messages to the responsive clients')
+	if latencies_ms:
+		print(
+			f'Delivery latency ms: p50 {np.percentile(latencies_ms, 50):.1f}, p95 {np.percentile(latencies_ms, 95):.1f}, '
+			f'p99 {np.percentile(latencies_ms, 99):.1f}, max {max(latencies_ms):.1f}'
+		)
+	print(
+		f'Stalled clients disconnected: {socket_handler.slow_client_counter.value} falling behind, '
+		f'{socket_handler.ping_timeout_counter.value} not answering a ping'
+	)
+	ping = socket_handler.ping_histogram.snapshot()
+	print(f'Ping round trip ms: p50 {ping["p50_ms"]}, p95 {ping["p95_ms"]} ({ping["count"]} pings)')
+	print(f'Closed connections removed within {removal_seconds * 1000:.0f} ms')
+
+	dropped_clients = socket_handler.slow_client_counter.value + socket_handler.ping_timeout_counter.value
+	p99_ms = np.percentile(latencies_ms, 99) if latencies_ms else None
+	failures = []
+	if delivered != messages * len(responsive):
+		failures.append(f'{messages * len(responsive) - delivered} messages not delivered to the responsive clients')
+	if p99_ms is not None and p99_ms > max_p99_ms:
+		failures.append(f'p99 delivery latency {p99_ms:.1f} ms over {max_p99_ms} ms')
+	if dropped_clients != stalled_clients:
+		# A run shorter than the ping interval, with too few messages to fill a stalled client's queue, lets them be
+		failures.append(f'{dropped_clients} clients disconnected for {stalled_clients} stalled')
+	if removal_seconds > 1.0:
+		failures.append(f'closed connections removed after {removal_seconds:.1f} s')
+	for description in failures:
+		print(f'FAIL, {description}')
+	if not failures:
+		print(f'Load test checks passed, p99 delivery latency under {max_p99_ms} ms')
+	return not failures
+
+
+def replay_test(events, max_age_seconds):
+	"""
+	The PSMS page reloading while results come in, and the station restarting: the results the page missed reach it
+	when it reconnects, the ones it acknowledged never come again, and a page that does not acknowledge them is not
+	replayed any. Returns True if all of it held
+	"""
+	import tempfile
+
+	outbox_path = Path(tempfile.mkdtemp()) / 'attendance_outbox.jsonl'
+	socket_handler, url = _start_test_server(outbox_path=outbox_path, event_max_age_seconds=max_age_seconds)
+	received = []
+
+	def _publish(socket_handler):
+		for index in range(events):
+			socket_handler.broadcast_to_clients(80200000 + index, "in")
+		time.sleep(0.2)
+
+	async def _page(url, publish_to=None, acknowledge=True, idle_seconds=1.0):
+		"""
+		Page open until no result came for idle_seconds, acknowledging every result unless it is a page that does not
+		know how to. Returns the seqs received
+		"""
+		seqs = []
+		async with websockets.connect(url) as websocket:
+			if acknowledge:
+				await websocket.send(json.dumps({"type": "hello", "ack": True}))
+			if publish_to is not None:
+				await asyncio.get_event_loop().run_in_executor(None, _publish, publish_to)
+			try:
+				while True:
+					event = json.loads(await asyncio.wait_for(websocket.recv(), idle_seconds))
+					seqs.append(event["seq"])
+					if acknowledge:
+						await websocket.send(json.dumps({"type": "ack", "seq": event["seq"]}))
+			except asyncio.TimeoutError:
+				pass
+		if acknowledge:
+			received.extend(seqs)
+		return seqs
+
+	live = asyncio.run(_page(url, publish_to=socket_handler))
+	# Page reloading
+	_publish(socket_handler)
+	not_acknowledging = asyncio.run(_page(url, acknowledge=False))
+	after_reload = asyncio.run(_page(url))
+	again = asyncio.run(_page(url))
+
+	# Results waiting for the page when the station restarts, once the journal is written
+	_publish(socket_handler)
+	time.sleep(SocketHandler.OUTBOX_FLUSH_SECONDS * 2)
+	restarted_handler, restarted_url = _start_test_server(outbox_path=outbox_path, event_max_age_seconds=max_age_seconds)
+	after_restart = asyncio.run(_page(restarted_url))
+
+	# Results the page comes back for too late
+	_publish(restarted_handler)
+	time.sleep(max_age_seconds + 0.5)
+	too_late = asyncio.run(_page(restarted_url))
+
+	checks = [
+		(f'Page connected: {len(live)}/{events} results received', len(live) == events),
+		(
+			f'Page reloading, not acknowledging results: {len(not_acknowledging)} results received after the reload',
+			not not_acknowledging
+		),
+		(f'Page reloading: {len(after_reload)}/{events} results received after the reload', len(after_reload) == events),
+		(f'Page reloaded again: {len(again)} results received', not again),
+		(
+			f'Station restarted: {len(after_restart)}/{events} results received, seq {min(after_restart, default=None)} on',
+			len(after_restart) == events and min(after_restart) == 2 * events
+		),
+		(f'Page back after the max age: {len(too_late)} results received', not too_late),
+		(
+			f'Acknowledged results received twice: {len(received) - len(set(received))}',
+			len(received) == len(set(received))
+		),
+	]
+	print(f'{events} results per step, max age {max_age_seconds} s')
+	for line, passed in checks:
+		print(f'{"ok  " if passed else "FAIL"} {line}')
+	return all(passed for _, passed in checks)
+
+
 def main():
+	parser = argparse.ArgumentParser(description='Websocket server the PSMS page receives the authentication results from')
+	parser.add_argument(
+		'--load-test', type=int, metavar='CLIENTS',
+		help='measure the broadcast delivery to CLIENTS simulated browser clients instead of serving random results'
+	)
+	parser.add_argument(
+		'--replay-test', type=int, metavar='EVENTS',
+		help='check the results missed by a reloading page or during a restart are replayed, and no more'
+	)
+	parser.add_argument('--max-age', type=float, default=2.0, help='replay test event max age in seconds')
+	parser.add_argument('--stalled', type=int, default=5, help='load test clients that never read')
+	parser.add_argument('--messages', type=int, default=1500, help='load test broadcasts')
+	parser.add_argument('--interval', type=float, default=0.02, help='seconds between load test broadcasts')
+	parser.add_argument('--ping-interval', type=float, default=SocketHandler.PING_INTERVAL, help='seconds between pings')
+	parser.add_argument('--ping-timeout', type=float, default=SocketHandler.PING_TIMEOUT, help='seconds to wait for a pong')
+	parser.add_argument(
+		'--max-p99-ms', type=float, default=500.0, help='load test 99th percentile delivery latency to stay under'
+	)
+	args = parser.parse_args()
+
+	if args.load_test:
+		passed = load_test(
+			args.load_test, args.stalled, args.messages, args.interval, args.ping_interval, args.ping_timeout,
+			args.max_p99_ms
+		)
+		sys.exit(0 if passed else 1)
+	if args.replay_test:
+		sys.exit(0 if replay_test(args.replay_test, args.max_age) else 1)
+
 	socket_handler = SocketHandler()
 	socket_handler.start()
 	threading.Thread(target=lambda: mimic_facial_recognition_process(socket_handler)).start()
@@ -0,0 +1,630 @@
+import argparse
+import queue
+import random
+import sys
+import threading
+import time
+
+import src.logger.custom_logger as custom_logger
+from src.utility import pipeline_metrics
+from src.processor.match_pipeline import MatchPipeline
+
+LOGGER = custom_logger.get_logger()
+
+# Authentication states
+IDLE = 'idle'
+FACE_PRESENT = 'face_present'
+EXTRACTING = 'extracting'
+MATCHING = 'matching'
+RESULT_DISPLAY = 'result_display'
+COOLDOWN = 'cooldown'
+AUTH_STATES = [IDLE, FACE_PRESENT, EXTRACTING, MATCHING, RESULT_DISPLAY, COOLDOWN]
+
+# Events driving the state machine
+EVENT_FACE_PRESENT = 'face_present'
+EVENT_FACE_LOST = 'face_lost'
+EVENT_ALREADY_AUTHENTICATED = 'already_authenticated'
+EVENT_EXTRACTION_STARTED = 'extraction_started'
+EVENT_FACEPRINT_EXTRACTED = 'faceprint_extracted'
+EVENT_EXTRACTION_REJECTED = 'extraction_rejected'
+EVENT_EXTRACTION_ENDED = 'extraction_ended'
+EVENT_MATCH_DONE = 'match_done'
+EVENT_MATCH_QUEUED = 'match_queued'
+EVENT_TIMER = 'timer'
+
+# Reasons an extraction in progress is abandoned
+ABANDON_FACE_LOST = 'face_lost'
+ABANDON_DEADLINE = 'deadline'
+ABANDON_PREEMPTED = 'preempted'
+
+# States the flow can be left in when another command preempts it, no attempt is in progress
+PREEMPTION_STATES = (IDLE, COOLDOWN)
+
+TRANSITIONS = {
+    IDLE: {
+        EVENT_FACE_PRESENT: FACE_PRESENT
+    },
+    FACE_PRESENT: {
+        EVENT_EXTRACTION_STARTED: EXTRACTING,
+        EVENT_ALREADY_AUTHENTICATED: COOLDOWN,
+        EVENT_FACE_LOST: IDLE
+    },
+    EXTRACTING: {
+        EVENT_FACEPRINT_EXTRACTED: MATCHING,
+        EVENT_EXTRACTION_REJECTED: RESULT_DISPLAY,
+        # Extraction returned without a faceprint, e.g. the face was lost
+        EVENT_EXTRACTION_ENDED: IDLE
+    },
+    MATCHING: {
+        EVENT_MATCH_DONE: RESULT_DISPLAY,
+        # Pipelined matching: the result is shown by the match pipeline, the device moves on to the next person
+        EVENT_MATCH_QUEUED: COOLDOWN
+    },
+    RESULT_DISPLAY: {
+        EVENT_TIMER: COOLDOWN
+    },
+    COOLDOWN: {
+        EVENT_TIMER: IDLE
+    }
+}
+
+
+class AuthResult:
+    """Outcome of one authentication attempt, filled in as it goes through the states"""
+
+    def __init__(self, device_status=None, faceprint=None, device_success=False):
+        self.device_status = device_status      # rsid_py.AuthenticateStatus reported with the faceprint
+        self.faceprint = faceprint
+        self.device_success = device_success    # Valid face (no spoof, pose or device error)
+        self.employee_id = None                 # Best gallery match, None if no match
+        self.score = None
+        self.track_id = None                    # Tracked face the attempt was made for
+        self.sequence = None                    # Submission order in the match pipeline
+        self.submitted_at = None
+        self.error = None                       # Matching failed, e.g. the device session dropped: neither accepted
+                                                # nor rejected, the face gets another attempt
+
+    def is_accepted(self):
+        return self.device_success and self.employee_id is not None
+
+    def __repr__(self):
+        return f'AuthResult(device_status={self.device_status}, employee_id={self.employee_id}, score={self.score})'
+
+
+class AuthStateMachine:
+    """
+    Authentication states and their transitions, driven by events posted from any thread.
+    States with a duration (result display, cooldown) are left on a timer instead of a sleep, events that have no
+    transition in the current state are ignored.
+    """
+
+    def __init__(self, state_durations=None):
+        """:param state_durations: seconds spent in the timed states, e.g. {RESULT_DISPLAY: 1.0, COOLDOWN: 0.3}"""
+        self.state_durations = state_durations or {}
+        self.state = None
+        self.state_entered_at = None
+        self.deadline = None
+        self.events = queue.Queue()
+        self.state_handlers = {}
+
+        self.metrics = pipeline_metrics.get_registry()
+        self.state_histograms = {
+            state: self.metrics.histogram(f'auth_state_{state}_ms', f'Time spent in the {state} authentication state')
+            for state in AUTH_STATES
+        }
+        self.metrics.gauge('auth_state', 'Current authentication state', lambda: self.state)
+
+    def on_enter(self, state, handler):
+        """handler(payload) runs on the state machine thread whenever the state is entered"""
+        self.state_handlers[state] = handler
+
+    def post(self, event, payload=None):
+        self.events.put((event, payload))
+
+    def enter(self, state, payload=None):
+        now = time.perf_counter()
+        if self.state is not None:
+            self.state_histograms[self.state].observe_since(self.state_entered_at)
+            LOGGER.debug(f'Authentication state: {self.state} -> {state}')
+        self.state = state
+        self.state_entered_at = now
+        duration = self.state_durations.get(state)
+        self.deadline = now + duration if duration is not None else None
+
+        handler = self.state_handlers.get(state)
+        if handler is not None:
+            handler(payload)
+
+    def dispatch(self, event, payload=None):
+        next_state = TRANSITIONS[self.state].get(event)
+        if next_state is None:
+            return False
+        self.enter(next_state, payload)
+        return True
+
+    def next_event(self, timeout=None):
+        """
+        Next posted event, or the timer event once the deadline of a timed state has passed.
+        :return: (event, payload), (None, None) if the timeout expired first
+        """
+        if self.deadline is not None:
+            remaining = max(self.deadline - time.perf_counter(), 0)
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            if self.deadline is not None and time.perf_counter() >= self.deadline:
+                return EVENT_TIMER, None
+            return None, None
+
+    def run_step(self, timeout=None):
+        event, payload = self.next_event(timeout)
+        if event is not None:
+            self.dispatch(event, payload)
+
+
+class AuthenticationFlow:
+    """
+    Runs authentication attempts through the state machine:
+        IDLE -> FACE_PRESENT -> EXTRACTING -> MATCHING -> RESULT_DISPLAY -> COOLDOWN -> IDLE
+    An extraction is abandoned, cancelled on the device if cancel_extraction is given, once the face it was started
+    for leaves or its deadline passes, so a person walking away does not hold the device until it gives up.
+    With max_pending_matches set, MATCHING only hands the faceprint over to a MatchPipeline and goes to COOLDOWN:
+    the device extracts the next person while the previous one is matched and shown.
+    The device and the UI are reached through the callables given, so the flow runs the same on a simulated device.
+    """
+
+    def __init__(
+            self, is_face_present, extract, match, show_result, clear_result,
+            is_already_authenticated=None, display_seconds=1.0, cooldown_seconds=0.3, on_tick=None, tick_seconds=1.0,
+            max_pending_matches=0, matcher_workers=1, min_display_seconds=0.5,
+            cancel_extraction=None, extraction_deadline_seconds=None, is_attempt_face_present=None, watchdog_seconds=0.1,
+            matcher_pool=None
+    ):
+        """
+        :param is_face_present: is_face_present() -> bool, someone is in front of the camera
+        :param extract: extract(on_extracted) runs a device extraction, on_extracted(AuthResult) is called with the result
+        :param match: match(AuthResult) -> AuthResult with employee_id and score set
+        :param show_result: show_result(AuthResult) when the result display starts
+        :param clear_result: clear_result(AuthResult) when the result display ends
+        :param is_already_authenticated: is_already_authenticated() -> bool, the face present was already accepted
+        :param on_tick: on_tick() called at least every tick_seconds, for periodic housekeeping
+        :param max_pending_matches: 0 to match and show on the device thread, else size of the match pipeline queue
+        :param cancel_extraction: cancel_extraction() makes extract() return early, called from another thread
+        :param extraction_deadline_seconds: time an extraction may take before it is abandoned, None for no deadline
+        :param is_attempt_face_present: is_attempt_face_present() -> bool, the face the extraction was started for
+            is still in the frame, is_face_present by default
+        :param watchdog_seconds: how often the face of the extraction in progress and its deadline are checked
+        :param matcher_pool: MatcherPool shared with the flows of the other cameras, instead of matcher_workers
+        """
+        self.is_face_present = is_face_present
+        self.extract = extract
+        self.match = match
+        self.show_result = show_result
+        self.clear_result = clear_result
+        self.is_already_authenticated = is_already_authenticated
+        self.on_tick = on_tick
+        self.tick_seconds = tick_seconds
+        self.stop_event = threading.Event()
+        self.displayed_result = None
+        self.match_pipeline = None
+        if max_pending_matches:
+            self.match_pipeline = MatchPipeline(
+                match, self.show_pipelined_result, clear_result, max_pending=max_pending_matches,
+                workers=matcher_workers, display_seconds=display_seconds, min_display_seconds=min_display_seconds,
+                matcher_pool=matcher_pool
+            )
+        self.cancel_extraction = cancel_extraction
+        self.extraction_deadline_seconds = extraction_deadline_seconds
+        self.is_attempt_face_present = is_attempt_face_present or is_face_present
+        self.watchdog_seconds = watchdog_seconds
+        # Extraction in progress, watched from a watchdog thread
+        self.attempt_lock = threading.Lock()
+        self.attempt_id = 0
+        self.attempt_active = False
+        self.abandon_reason = None
+        self.abandon_requested_at = None
+        self.attempt_check = threading.Event()
+
+        # Pipelined: the person just extracted is still in front of the camera waiting for their result, the next
+        # extraction waits for the face to leave
+        self.awaiting_face_change = False
+
+        self.machine = AuthStateMachine({RESULT_DISPLAY: display_seconds, COOLDOWN: cooldown_seconds})
+        self.machine.on_enter(IDLE, self.on_idle)
+        self.machine.on_enter(FACE_PRESENT, self.on_face_present)
+        self.machine.on_enter(EXTRACTING, self.on_extracting)
+        self.machine.on_enter(MATCHING, self.on_matching)
+        self.machine.on_enter(RESULT_DISPLAY, self.on_result_display)
+        self.machine.on_enter(COOLDOWN, self.on_cooldown)
+
+        self.results_counter = self.machine.metrics.counter('auth_results_displayed', 'Authentication results shown to people')
+        self.abandoned_counters = {
+            reason: self.machine.metrics.counter(f'auth_abandoned_{reason}', f'Extractions abandoned ({reason})')
+            for reason in (ABANDON_FACE_LOST, ABANDON_DEADLINE, ABANDON_PREEMPTED)
+        }
+        self.abandoned_attempt_histogram = self.machine.metrics.histogram(
+            'auth_abandoned_attempt_ms', 'Duration of abandoned extractions, from their start to the return to idle'
+        )
+        self.cancel_latency_histogram = self.machine.metrics.histogram(
+            'auth_cancel_latency_ms', 'Time from abandoning an extraction to the device returning'
+        )
+
+    def on_face_feed(self, face_present):
+        """Subscriber of the face feed channel, runs on the image processor thread"""
+        if not face_present:
+            self.awaiting_face_change = False
+            # Wake the watchdog up, the extraction in progress may be for the face that just left
+            self.attempt_check.set()
+        self.machine.post(EVENT_FACE_PRESENT if face_present else EVENT_FACE_LOST)
+
+    def on_idle(self, _):
+        # Someone may have stayed in front of the camera through the result display and cooldown
+        if self.is_face_present() and not self.awaiting_face_change:
+            self.machine.post(EVENT_FACE_PRESENT)
+
+    def on_face_present(self, _):
+        if self.awaiting_face_change:
+            self.machine.post(EVENT_ALREADY_AUTHENTICATED)
+        elif self.is_already_authenticated is not None and self.is_already_authenticated():
+            self.machine.post(EVENT_ALREADY_AUTHENTICATED)
+        else:
+            self.machine.post(EVENT_EXTRACTION_STARTED)
+
+    def on_extracted(self, result):
+        # Results without a faceprint were never shown, the attempt just ends (see EVENT_EXTRACTION_ENDED)
+        if result.faceprint is None or self.abandon_reason is not None:
+            return
+        if self.match_pipeline is not None:
+            # Rejected faces are queued too, their result must not overtake the previous person's
+            self.machine.post(EVENT_FACEPRINT_EXTRACTED, result)
+            return
+        self.machine.post(EVENT_FACEPRINT_EXTRACTED if result.device_success else EVENT_EXTRACTION_REJECTED, result)
+
+    def on_extracting(self, _):
+        attempt_start_time = time.perf_counter()
+        with self.attempt_lock:
+            self.attempt_id += 1
+            self.attempt_active = True
+            self.abandon_reason = None
+            self.attempt_check.clear()
+        threading.Thread(target=self.watch_attempt, args=(self.attempt_id, attempt_start_time), daemon=True).start()
+        try:
+            self.extract(self.on_extracted)
+        except Exception as e:
+            LOGGER.error(f'Faceprint extraction failed: {e}')
+        finally:
+            with self.attempt_lock:
+                self.attempt_active = False
+                abandon_reason = self.abandon_reason
+            self.attempt_check.set()
+            if abandon_reason is not None:
+                self.abandoned_attempt_histogram.observe_since(attempt_start_time)
+                self.cancel_latency_histogram.observe_since(self.abandon_requested_at)
+            self.machine.post(EVENT_EXTRACTION_ENDED)
+
+    def watch_attempt(self, attempt_id, attempt_start_time):
+        """Watchdog of one extraction, abandons it once its face has left or its deadline has passed"""
+        deadline = None
+        if self.extraction_deadline_seconds is not None:
+            deadline = attempt_start_time + self.extraction_deadline_seconds
+        while True:
+            timeout = self.watchdog_seconds
+            if deadline is not None:
+                timeout = min(timeout, max(deadline - time.perf_counter(), 0))
+            self.attempt_check.wait(timeout)
+            self.attempt_check.clear()
+            with self.attempt_lock:
+                if not self.attempt_active or self.attempt_id != attempt_id:
+                    return
+            if deadline is not None and time.perf_counter() >= deadline:
+                self.abandon_attempt(attempt_id, ABANDON_DEADLINE)
+                return
+            if not self.is_attempt_face_present():
+                self.abandon_attempt(attempt_id, ABANDON_FACE_LOST)
+                return
+
+    def abandon_attempt(self, attempt_id, reason):
+        with self.attempt_lock:
+            if not self.attempt_active or self.attempt_id != attempt_id or self.abandon_reason is not None:
+                return
+            self.abandon_reason = reason
+            self.abandon_requested_at = time.perf_counter()
+        LOGGER.face_rec(f'Abandoning the authentication attempt: {reason}')
+        self.abandoned_counters[reason].inc()
+        if self.cancel_extraction is not None:
+            try:
+                self.cancel_extraction()
+            except Exception as e:
+                LOGGER.error(f'Unable to cancel the extraction: {e}')
+
+    def on_matching(self, result):
+        if self.match_pipeline is not None:
+            self.awaiting_face_change = self.is_face_present()
+            self.match_pipeline.submit(result)
+            self.machine.post(EVENT_MATCH_QUEUED)
+            return
+        try:
+            result = self.match(result)
+        except Exception as e:
+            LOGGER.error(f'Faceprint matching failed: {e}')
+            result.error = e
+        self.machine.post(EVENT_MATCH_DONE, result)
+
+    def on_result_display(self, result):
+        self.results_counter.inc()
+        self.show_result(result)
+        self.displayed_result = result
+
+    def show_pipelined_result(self, result):
+        self.results_counter.inc()
+        self.show_result(result)
+        if result.error is not None:
+            # The person extracted is still waiting for their result, the next attempt is theirs
+            self.awaiting_face_change = False
+            if self.is_face_present():
+                self.machine.post(EVENT_FACE_PRESENT)
+
+    def on_cooldown(self, _):
+        # Also entered straight from FACE_PRESENT for an already accepted face, with nothing displayed
+        if self.displayed_result is not None:
+            self.clear_result(self.displayed_result)
+            self.displayed_result = None
+
+    def run(self, should_yield=None):
+        """
+        Authenticate until stopped.
+        :param should_yield: should_yield() -> bool, checked between attempts, run() returns once it holds and can be
+            called again to resume
+        """
+        if self.match_pipeline is not None and not self.match_pipeline.threads:
+            self.match_pipeline.start()
+        self.machine.enter(IDLE)
+        while not self.stop_event.is_set():
+            if should_yield is not None and self.machine.state in PREEMPTION_STATES and should_yield():
+                LOGGER.face_rec('Authentication preempted')
+                return
+            if self.on_tick is not None:
+                self.on_tick()
+            self.machine.run_step(self.tick_seconds)
+
+    def request_yield(self, cancel_attempt=False):
+        """Wake run() up to check should_yield(), abandoning the extraction in progress if cancel_attempt"""
+        if cancel_attempt:
+            self.abandon_attempt(self.attempt_id, ABANDON_PREEMPTED)
+        self.machine.post(None)
+
+    def stop(self):
+        self.stop_event.set()
+        self.machine.post(None)
+        if self.match_pipeline is not None:
+            self.match_pipeline.stop()
+
+
+class SimulatedAuthScene:
+    """
+    People queueing in front of a simulated device, for throughput benchmarks.
+    Each person steps in, waits for their result, reads it for leave_seconds and leaves, the next one steps in
+    gap_seconds later. With wait_for_result off, people walk through: they leave once their faceprint is extracted.
+    A walk_away_rate share of the people leave walk_away_seconds into their extraction, the device then keeps looking
+    for a face until device_timeout_seconds unless the extraction is cancelled.
+    All durations are multiplied by time_scale so a benchmark runs faster than real time.
+    """
+
+    def __init__(
+            self, people, extract_seconds=0.8, match_seconds=0.02, leave_seconds=0.5, gap_seconds=0.5,
+            time_scale=0.1, on_face_feed=None, wait_for_result=True, walk_away_rate=0.0, walk_away_seconds=0.3,
+            device_timeout_seconds=5.0, seed=0
+    ):
+        self.people = people
+        self.extract_seconds = extract_seconds * time_scale
+        self.match_seconds = match_seconds * time_scale
+        self.leave_seconds = leave_seconds * time_scale
+        self.gap_seconds = gap_seconds * time_scale
+        self.time_scale = time_scale
+        self.on_face_feed = on_face_feed
+        self.wait_for_result = wait_for_result
+        self.walk_away_seconds = walk_away_seconds * time_scale
+        self.device_timeout_seconds = device_timeout_seconds * time_scale
+        rng = random.Random(seed)
+        self.walks_away = [rng.random() < walk_away_rate for _ in range(people)]
+        self.expected_results = people - sum(self.walks_away)
+
+        self.face_present = False
+        self.cancelled = threading.Event()
+        self.result_shown = threading.Event()
+        self.extracted = threading.Event()
+        self.all_results_shown = threading.Event()
+        self.done = threading.Event()
+        self.start_time = None
+        self.result_times = []
+
+    def set_face_present(self, face_present):
+        self.face_present = face_present
+        if self.on_face_feed is not None:
+            self.on_face_feed(face_present)
+
+    def run(self):
+        self.start_time = time.perf_counter()
+        for walks_away in self.walks_away:
+            time.sleep(self.gap_seconds)
+            self.result_shown.clear()
+            self.extracted.clear()
+            self.set_face_present(True)
+            if walks_away:
+                time.sleep(self.walk_away_seconds)
+                self.set_face_present(False)
+                continue
+            (self.result_shown if self.wait_for_result else self.extracted).wait()
+            time.sleep(self.leave_seconds)
+            self.set_face_present(False)
+        self.all_results_shown.wait(timeout=60 * self.time_scale)
+        self.done.set()
+
+    def is_face_present(self):
+        return self.face_present
+
+    def extract(self, on_extracted):
+        self.cancelled.clear()
+        start_time = time.perf_counter()
+        while not self.cancelled.wait(0.005):
+            elapsed = time.perf_counter() - start_time
+            if elapsed >= self.extract_seconds and self.face_present:
+                on_extracted(AuthResult('Success', object(), True))
+                self.extracted.set()
+                return
+            if elapsed >= self.device_timeout_seconds:
+                # The device gave up looking for a face
+                return
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def match(self, result):
+        time.sleep(self.match_seconds)
+        result.employee_id, result.score = 'employee', 4000
+        return result
+
+    def show_result(self, result):
+        self.result_times.append(time.perf_counter())
+        self.result_shown.set()
+        if len(self.result_times) >= self.expected_results:
+            self.all_results_shown.set()
+
+    def get_people_per_minute(self):
+        if not self.result_times:
+            return 0.0
+        simulated_seconds = (self.result_times[-1] - self.start_time) / self.time_scale
+        return 60.0 * len(self.result_times) / simulated_seconds
+
+
+def run_sleep_paced_loop(scene):
+    """Authentication loop paced by sleeps, as FaceProcessor.face_authenticate() was"""
+    def on_extracted(result):
+        scene.show_result(scene.match(result))
+        time.sleep(1.0 * scene.time_scale)      # on_fp_auth_result()
+
+    while not scene.done.is_set():
+        if scene.is_face_present():
+            scene.extract(on_extracted)
+            time.sleep(0.5 * scene.time_scale)  # perform_authentication()
+        time.sleep(0.5 * scene.time_scale)      # Feed file poll
+
+
+def run_flow(people, args, max_pending_matches=0, wait_for_result=True, walk_away_rate=0.0, cancellable=False):
+    """
+    Run people through an AuthenticationFlow on a simulated device.
+    :return: people per minute, the durations of the abandoned extractions in simulated ms, and the number of people
+        whose result was never shown
+    """
+    scene = SimulatedAuthScene(
+        people, match_seconds=args.match_seconds, time_scale=args.time_scale, wait_for_result=wait_for_result,
+        walk_away_rate=walk_away_rate
+    )
+    flow = AuthenticationFlow(
+        scene.is_face_present, scene.extract, scene.match, scene.show_result, lambda result: None,
+        display_seconds=args.display_seconds * args.time_scale, cooldown_seconds=args.cooldown_seconds * args.time_scale,
+        max_pending_matches=max_pending_matches, min_display_seconds=args.min_display_seconds * args.time_scale,
+        cancel_extraction=scene.cancel if cancellable else None,
+        extraction_deadline_seconds=args.extraction_deadline_seconds * args.time_scale if cancellable else None,
+        watchdog_seconds=0.1 * args.time_scale
+    )
+    # Metrics of this run only
+    flow.abandoned_attempt_histogram = pipeline_metrics.Histogram('auth_abandoned_attempt_ms')
+    scene.on_face_feed = flow.on_face_feed
+    threading.Thread(target=flow.run, daemon=True).start()
+    scene.run()
+    flow.stop()
+    abandoned_ms = [value / args.time_scale for value in flow.abandoned_attempt_histogram._recent]
+    return scene.get_people_per_minute(), abandoned_ms, scene.expected_results - len(scene.result_times)
+
+
+def main():
+    # People per minute with the sleep-paced loop and with the state machine, on a simulated device
+    parser = argparse.ArgumentParser(description='Authentication throughput on a simulated device')
+    parser.add_argument('--people', type=int, default=30)
+    parser.add_argument('--display-seconds', type=float, default=1.0)
+    parser.add_argument('--min-display-seconds', type=float, default=0.5)
+    parser.add_argument('--cooldown-seconds', type=float, default=0.3)
+    parser.add_argument('--match-seconds', type=float, default=0.3, help='host-side gallery matching time')
+    parser.add_argument('--max-pending-matches', type=int, default=4)
+    parser.add_argument('--walk-away-rate', type=float, default=0.3, help='share of people leaving mid-extraction')
+    parser.add_argument('--extraction-deadline-seconds', type=float, default=3.0)
+    parser.add_argument('--time-scale', type=float, default=0.1, help='simulated seconds per real second')
+    args = parser.parse_args()
+
+    failures = []
+
+    def check(passed, description):
+        if not passed:
+            failures.append(description)
+
+    def run_checked_flow(people, *flow_args, **flow_kwargs):
+        people_per_minute, abandoned_ms, missing_results = run_flow(people, *flow_args, **flow_kwargs)
+        check(not missing_results, f'{missing_results} of {people} results never shown ({flow_kwargs})')
+        return people_per_minute, abandoned_ms
+
+    scene = SimulatedAuthScene(args.people, match_seconds=args.match_seconds, time_scale=args.time_scale)
+    threading.Thread(target=run_sleep_paced_loop, args=(scene,), daemon=True).start()
+    scene.run()
+    sleep_paced_rate = scene.get_people_per_minute()
+    print(f'sleep-paced loop: {sleep_paced_rate:.1f} people/minute')
+
+    state_machine_rate = run_checked_flow(args.people, args)[0]
+    print(f'state machine:    {state_machine_rate:.1f} people/minute '
+          f'(display {args.display_seconds}s, cooldown {args.cooldown_seconds}s, matching {args.match_seconds}s)')
+    check(state_machine_rate > sleep_paced_rate,
+          f'state machine {state_machine_rate:.1f} people/minute, not above the sleep-paced loop {sleep_paced_rate:.1f}')
+
+    # Serial against pipelined matching for queues of 1 to 10 people, waiting for their result or walking through.
+    # Pipelining must not cost a single person anything, and must let a queue through faster
+    print('people  serial  pipelined  serial (walk-through)  pipelined (walk-through)')
+    for people in range(1, 11):
+        rates = [
+            run_checked_flow(people, args, max_pending_matches, wait_for_result)[0]
+            for wait_for_result in (True, False) for max_pending_matches in (0, args.max_pending_matches)
+        ]
+        print(f'{people:6d}  {rates[0]:6.1f}  {rates[1]:9.1f}  {rates[2]:21.1f}  {rates[3]:24.1f}')
+        for serial_rate, pipelined_rate, mode in ((rates[0], rates[1], 'waiting'), (rates[2], rates[3], 'walk-through')):
+            if people == 1:
+                check(pipelined_rate >= 0.95 * serial_rate,
+                      f'1 person ({mode}): pipelined {pipelined_rate:.1f} people/minute against serial {serial_rate:.1f}')
+            else:
+                check(pipelined_rate > serial_rate,
+                      f'{people} people ({mode}): pipelined {pipelined_rate:.1f} people/minute, not above serial {serial_rate:.1f}')
+
+    # People walking away mid-extraction, with the device left to give up and with cancellation
+    print(f'{args.walk_away_rate:.0%} of {args.people} people walking away mid-extraction:')
+    abandoned_runs = {}
+    for cancellable in (False, True):
+        people_per_minute, abandoned_ms = run_checked_flow(
+            args.people, args, args.max_pending_matches, walk_away_rate=args.walk_away_rate, cancellable=cancellable
+        )
+        abandoned_ms.sort()
+        abandoned_runs[cancellable] = people_per_minute, abandoned_ms
+        if not abandoned_ms:
+            print(f'  {"cancelled" if cancellable else "no cancel"}: {people_per_minute:.1f} people/minute, no abandoned attempts')
+            continue
+
+        def percentile(percent):
+            return abandoned_ms[min(len(abandoned_ms) - 1, int(round(percent / 100.0 * (len(abandoned_ms) - 1))))]
+
+        print(f'  {"cancelled" if cancellable else "no cancel"}: {people_per_minute:.1f} people/minute, '
+              f'{len(abandoned_ms)} abandoned attempts, p50 {percentile(50):.0f} ms, p95 {percentile(95):.0f} ms, '
+              f'max {abandoned_ms[-1]:.0f} ms')
+    (uncancelled_rate, uncancelled_ms), (cancelled_rate, cancelled_ms) = abandoned_runs[False], abandoned_runs[True]
+    check(cancelled_rate >= 0.95 * uncancelled_rate,
+          f'cancellation lowered throughput: {cancelled_rate:.1f} against {uncancelled_rate:.1f} people/minute')
+    if cancelled_ms and uncancelled_ms:
+        check(cancelled_ms[-1] < uncancelled_ms[0],
+              f'cancelled extractions held the device up to {cancelled_ms[-1]:.0f} ms, '
+              f'not less than uncancelled ones ({uncancelled_ms[0]:.0f} ms)')
+
+    if failures:
+        for description in failures:
+            print(f'FAIL, {description}')
+        sys.exit(1)
+    print('Throughput checks passed')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,447 @@
+"""
+Offline bulk enrolment: new hires are enrolled from their photos instead of one by one in front of the camera.
+
+    python -m src.processor.bulk_enrolment enrol ./new_hires        # <employee_id>.jpg, or <employee_id>/*.jpg
+    python -m src.processor.bulk_enrolment enrol ./new_hires.csv    # employee_id,image_path rows
+    python -m src.processor.bulk_enrolment simulate                 # synthetic photos on the simulated device
+
+Faceprints are extracted by a pool of worker processes, each with its own device session (one per F455 connected, or
+any number of simulated devices). The best photo of each employee is kept, and employees whose face is already in the
+gallery (or enrolled earlier in the run) are skipped. Enrolled faceprints go through an outbox that uploads them in
+batches while extraction goes on. Progress is kept in the state directory: running the same command again resumes,
+skipping the employees already enrolled or found duplicate and uploading what the last run could not.
+"""
+import argparse
+import csv
+import json
+import math
+import multiprocessing
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+
+import src.logger.custom_logger as custom_logger
+from src.processor import rsid_backend
+from src.processor.gallery import Gallery, normalize_features
+from src.processor.enrolment_selection import select_enrolment_capture
+from src.network_comms.outbox import Outbox
+
+LOGGER = custom_logger.get_logger()
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+# Largest image buffer the device takes for enrolment, bigger photos are scaled down
+MAX_IMAGE_BYTES = 900 * 1024
+# Length of the faceprint feature vectors
+FEATURES_SIZE = 259
+
+# Progress of an employee. Enrolled and duplicate employees are skipped when a run is resumed, the others are retried
+STATUS_ENROLLED = 'enrolled'
+STATUS_DUPLICATE = 'duplicate'
+STATUS_INCONSISTENT = 'inconsistent'
+STATUS_FAILED = 'failed'
+FINAL_STATUSES = {STATUS_ENROLLED, STATUS_DUPLICATE}
+
+
+def read_entries(source):
+    """
+    Employees to enrol and their photos, [(employee_id, [image_path, ...])].
+    source is a CSV manifest with employee_id and image_path columns (paths relative to the manifest), or a directory
+    of <employee_id>.<ext> photos and <employee_id>/ sub-directories of photos.
+    """
+    source = Path(source)
+    entries = {}
+    if source.is_file():
+        with open(source, newline='', encoding='utf-8') as manifest:
+            for row in csv.DictReader(manifest):
+                entries.setdefault(row["employee_id"].strip(), []).append(str(source.parent / row["image_path"].strip()))
+    else:
+        for path in sorted(source.iterdir()):
+            if path.is_dir():
+                images = [str(image) for image in sorted(path.iterdir()) if image.suffix.lower() in IMAGE_EXTENSIONS]
+                if images:
+                    entries.setdefault(path.name, []).extend(images)
+            elif path.suffix.lower() in IMAGE_EXTENSIONS:
+                entries.setdefault(path.stem, []).append(str(path))
+    return list(entries.items())
+
+
+def resize_if_big(image):
+    """Scale a BGR image down to the size the device takes for enrolment"""
+    height, width, channels = image.shape
+    image_size = width * height * channels
+    if image_size > MAX_IMAGE_BYTES:
+        scale = math.sqrt(MAX_IMAGE_BYTES / image_size)
+        image = cv2.resize(image, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return image
+
+
+class BulkProgress:
+    """Last status of each employee of the bulk enrolment, journaled so an interrupted run can be resumed"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.statuses = {}
+        if self.path.exists():
+            with open(self.path, encoding='utf-8') as journal:
+                for line in journal:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.statuses[entry["employee_id"]] = entry["status"]
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.journal = open(self.path, 'a', encoding='utf-8')
+
+    def record(self, employee_id, status, detail=None):
+        self.statuses[employee_id] = status
+        self.journal.write(json.dumps({"employee_id": employee_id, "status": status, "detail": detail}) + '\n')
+        self.journal.flush()
+
+    def close(self):
+        self.journal.close()
+
+
+# Device session of an extraction worker process
+_authenticator = None
+
+
+def init_extraction_worker(backend, simulator_settings, port_q):
+    global _authenticator
+    rsid_backend.select(backend, simulator_settings)
+    _authenticator = rsid_backend.get_rsid().FaceAuthenticator(port_q.get())
+
+
+def extract_employee(employee_id, image_paths):
+    """
+    Faceprints of each photo of an employee, runs in an extraction worker process.
+    :return: (employee_id, captures, errors, seconds), a capture being the faceprint fields of a photo
+    """
+    start = time.perf_counter()
+    captures = []
+    errors = []
+    for image_path in image_paths:
+        image = cv2.imread(image_path)
+        if image is None:
+            errors.append(f'{Path(image_path).name}: unreadable image')
+            continue
+        image = resize_if_big(image)
+        height, width, _ = image.shape
+        try:
+            status, faceprints = _authenticator.enroll_image_feature_extraction(employee_id, image.flatten(), width, height)
+        except Exception as e:
+            errors.append(f'{Path(image_path).name}: {e}')
+            continue
+        if faceprints is None or 'Success' not in str(status):
+            errors.append(f'{Path(image_path).name}: {status}')
+            continue
+        captures.append({
+            "image": Path(image_path).name,
+            "version": faceprints.version,
+            "features_type": faceprints.features_type,
+            "flags": faceprints.flags,
+            "features": list(faceprints.features)
+        })
+    return employee_id, captures, errors, time.perf_counter() - start
+
+
+def faceprints_from_records(records):
+    """Gallery of DB faceprint records, only the enrolment descriptors are needed to find duplicates"""
+    faceprints = {}
+    for record in records:
+        faceprints.setdefault(record["employee_id"], []).append(
+            SimpleNamespace(enroll_descriptor=record["enroll_descriptor"])
+        )
+    return faceprints
+
+
+def fetch_gallery_from_db():
+    from src.network_comms.database_handler import DatabaseHandler
+    return faceprints_from_records(DatabaseHandler.get_faceprints().json().get("faceprint_records"))
+
+
+def upload_to_db(fp_dicts):
+    from src.network_comms.database_handler import DatabaseHandler
+    return DatabaseHandler.add_faceprints(fp_dicts)
+
+
+def run_bulk_enrolment(
+        entries, state_dir, fetch_gallery, send_batch, workers=1, backend=None, simulator_settings=None, ports=None,
+        duplicate_similarity=0.8, min_consistency=0.7, batch_size=20, upload_interval_seconds=1.0, stop_after=None
+):
+    """
+    Enrol the employees of entries, resuming from the progress kept in state_dir.
+    :param fetch_gallery: fetch_gallery() -> {employee_id: [faceprints]} enrolled before this run
+    :param send_batch: send_batch(fp_dicts) -> number of leading faceprints saved, None keeps them in the outbox
+    :param ports: device port of each worker, workers are capped to the number of ports
+    :param stop_after: stop after this many employees, to try out resuming
+    :return: report dict
+    """
+    state_dir = Path(state_dir)
+    run_start_time = time.perf_counter()
+    progress = BulkProgress(state_dir / 'progress.jsonl')
+    outbox = Outbox(
+        state_dir / 'outbox.jsonl', send_batch or (lambda records: 0), batch_size, name='bulk_enrolment_outbox'
+    )
+    todo = [(employee_id, paths) for employee_id, paths in entries if progress.statuses.get(employee_id) not in FINAL_STATUSES]
+    skipped = len(entries) - len(todo)
+    if stop_after is not None:
+        todo = todo[:stop_after]
+
+    # Faces already enrolled: the gallery, and the enrolments of an earlier run still waiting in the outbox. The
+    # enrolments of this run are added as they come, into rows reserved for them
+    gallery = Gallery()
+    gallery.load(fetch_gallery)
+    gallery_ids, gallery_features = gallery.get_features()
+    pending_records = list(outbox.pending.values())
+    known_ids = list(gallery_ids) + [record["employee_id"] for record in pending_records]
+    known_features = np.zeros((len(known_ids) + len(todo), FEATURES_SIZE), dtype=np.float32)
+    if len(gallery_ids):
+        known_features[:len(gallery_ids)] = gallery_features
+    if pending_records:
+        known_features[len(gallery_ids):len(known_ids)] = normalize_features(
+            [record["enroll_descriptor"] for record in pending_records]
+        )
+
+    uploading = threading.Event()
+    uploading.set()
+    uploaded = []
+
+    def _upload():
+        while uploading.is_set():
+            time.sleep(upload_interval_seconds)
+            if send_batch is not None:
+                uploaded.append(outbox.flush())
+
+    uploader = threading.Thread(target=_upload, name='bulk-enrolment-upload', daemon=True)
+    uploader.start()
+
+    ports = ports or [None]
+    workers = max(1, min(workers, len(ports)))
+    port_q = multiprocessing.Queue()
+    for index in range(workers):
+        port_q.put(ports[index % len(ports)])
+
+    counts = {status: 0 for status in (STATUS_ENROLLED, STATUS_DUPLICATE, STATUS_INCONSISTENT, STATUS_FAILED)}
+    extraction_seconds = []
+    images = 0
+    with ProcessPoolExecutor(
+            workers, initializer=init_extraction_worker, initargs=(backend, simulator_settings, port_q)
+    ) as executor:
+        futures = [executor.submit(extract_employee, employee_id, paths) for employee_id, paths in todo]
+        for future in as_completed(futures):
+            employee_id, captures, errors, seconds = future.result()
+            extraction_seconds.append(seconds)
+            images += len(captures) + len(errors)
+            if not captures:
+                LOGGER.warning(f'Bulk enrolment of {employee_id} failed: {errors}')
+                progress.record(employee_id, STATUS_FAILED, errors)
+                counts[STATUS_FAILED] += 1
+                continue
+
+            selection = select_enrolment_capture(
+                [capture["features"] for capture in captures], known_ids, known_features[:len(known_ids)], employee_id
+            )
+            if selection.gallery_similarity is not None and selection.gallery_similarity >= duplicate_similarity:
+                LOGGER.warning(f'{employee_id} not enrolled, already enrolled as {selection.gallery_employee_id}')
+                progress.record(employee_id, STATUS_DUPLICATE, selection.gallery_employee_id)
+                counts[STATUS_DUPLICATE] += 1
+                continue
+            if len(captures) > 1 and selection.best_consistency < min_consistency:
+                LOGGER.warning(f'{employee_id} not enrolled, the photos do not match each other: {selection}')
+                progress.record(employee_id, STATUS_INCONSISTENT, selection.best_consistency)
+                counts[STATUS_INCONSISTENT] += 1
+                continue
+
+            capture = captures[selection.best_index]
+            # Same record as an enrolment at the station
+            outbox.put({
+                "employee_id": employee_id,
+                "version": capture["version"],
+                "features_type": capture["features_type"],
+                "flags": capture["flags"],
+                "adaptive_descriptor_nomask": capture["features"],
+                "adaptive_descriptor_withmask": [0] * FEATURES_SIZE,
+                "enroll_descriptor": capture["features"]
+            })
+            progress.record(employee_id, STATUS_ENROLLED, capture["image"])
+            counts[STATUS_ENROLLED] += 1
+            known_features[len(known_ids)] = normalize_features([capture["features"]])[0]
+            known_ids.append(employee_id)
+    extraction_elapsed = time.perf_counter() - run_start_time
+
+    uploading.clear()
+    uploader.join()
+    if send_batch is not None:
+        uploaded.append(outbox.flush())
+    elapsed = time.perf_counter() - run_start_time
+    progress.close()
+    outbox.close()
+
+    return {
+        "employees": len(entries),
+        "skipped": skipped,
+        "processed": len(todo),
+        "counts": counts,
+        "images": images,
+        "workers": workers,
+        "uploaded": sum(uploaded),
+        "pending_upload": len(outbox),
+        "extraction_seconds": extraction_elapsed,
+        "elapsed_seconds": elapsed,
+        "employee_extract_p50_ms": float(np.percentile(extraction_seconds, 50) * 1000) if extraction_seconds else 0.0
+    }
+
+
+def print_report(report):
+    counts = report["counts"]
+    minutes = report["extraction_seconds"] / 60
+    print(
+        f'{report["employees"]} employees: {report["skipped"]} done in an earlier run, {report["processed"]} processed '
+        f'with {report["workers"]} worker(s) from {report["images"]} photo(s)'
+    )
+    print(
+        f'  enrolled {counts[STATUS_ENROLLED]}, duplicate {counts[STATUS_DUPLICATE]}, '
+        f'inconsistent photos {counts[STATUS_INCONSISTENT]}, failed {counts[STATUS_FAILED]}'
+    )
+    print(
+        f'  {report["processed"] / minutes if minutes else 0.0:.1f} employees/minute, '
+        f'extraction p50 {report["employee_extract_p50_ms"]:.0f} ms per employee, '
+        f'{report["uploaded"]} uploaded, {report["pending_upload"]} waiting to be uploaded, '
+        f'{report["elapsed_seconds"]:.1f} s in total'
+    )
+
+
+def simulate(args):
+    # Synthetic new hires on simulated devices: some have several photos, some are already in the gallery or share a
+    # photo with another new hire, and a few photos show no face
+    from src.simulator import rsid_py
+
+    work_dir = Path(tempfile.mkdtemp(prefix='bulk_enrolment_'))
+    photo_dir = work_dir / 'photos'
+    photo_dir.mkdir()
+    rng = np.random.default_rng(0)
+    staff_seeds = list(range(args.employees))
+    for index in range(args.employees):
+        employee_id = f'N{index:04d}'
+        draw = rng.random()
+        if draw < 0.05:
+            # Already enrolled staff photographed again
+            seeds = [int(rng.choice(staff_seeds))]
+        elif draw < 0.08 and index:
+            # Same photo as an earlier new hire
+            seeds = [10000 + index - 1]
+        else:
+            seeds = [10000 + index] * (1 if draw < 0.7 else 3)
+        photos = [rsid_py.face_photo(seed, rng) for seed in seeds]
+        if rng.random() < 0.03:
+            photos = [np.zeros_like(photos[0])]
+        if len(photos) == 1:
+            cv2.imwrite(str(photo_dir / f'{employee_id}.jpg'), photos[0])
+        else:
+            (photo_dir / employee_id).mkdir()
+            for photo_index, photo in enumerate(photos):
+                cv2.imwrite(str(photo_dir / employee_id / f'{photo_index}.jpg'), photo)
+
+    gallery_records = []
+    for seed in staff_seeds:
+        features = rsid_py.identity_features(rsid_py.image_identity(rsid_py.face_photo(seed)))
+        gallery_records.append({"employee_id": f'S{seed:04d}', "enroll_descriptor": features})
+
+    simulator_settings = {
+        "enroll_image_seconds": args.extract_seconds,
+        "enroll_status_mix": {"Success": 0.97, "FaceIsNotFrontal": 0.03},
+        "capture_noise": [0.1, 0.5]
+    }
+    uploaded = []
+
+    def _send_batch(fp_dicts):
+        # One request per faceprint over a kept-alive connection
+        time.sleep(0.02 * len(fp_dicts))
+        uploaded.extend(fp_dict["employee_id"] for fp_dict in fp_dicts)
+        return len(fp_dicts)
+
+    entries = read_entries(photo_dir)
+    print(f'{len(entries)} new hires in {photo_dir}, {len(gallery_records)} employees in the gallery\n')
+    for workers in args.workers:
+        print(f'--- {workers} worker(s)')
+        print_report(run_bulk_enrolment(
+            entries, work_dir / f'state_{workers}', lambda: faceprints_from_records(gallery_records), _send_batch,
+            workers=workers, backend=rsid_backend.BACKEND_SIMULATED, simulator_settings=simulator_settings,
+            ports=[rsid_py.SIMULATED_PORT] * workers
+        ))
+
+    # Interrupted half way, then resumed: nobody is enrolled or uploaded twice
+    del uploaded[:]
+    workers = args.workers[-1]
+    state_dir = work_dir / 'state_resumed'
+    for stop_after in (len(entries) // 2, None):
+        print(f'--- {workers} worker(s), ' + ('interrupted' if stop_after else 'resumed'))
+        print_report(run_bulk_enrolment(
+            entries, state_dir, lambda: faceprints_from_records(gallery_records), _send_batch,
+            workers=workers, backend=rsid_backend.BACKEND_SIMULATED, simulator_settings=simulator_settings,
+            ports=[rsid_py.SIMULATED_PORT] * workers, stop_after=stop_after
+        ))
+    if len(uploaded) != len(set(uploaded)):
+        print(f'FAIL, {len(uploaded) - len(set(uploaded))} employees uploaded twice over the two runs')
+        sys.exit(1)
+    print(f'\n{len(uploaded)} employees uploaded once each over the two runs')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Enrol employees from their photos')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    enrol_parser = subparsers.add_parser('enrol', help='enrol a photo directory or CSV manifest')
+    enrol_parser.add_argument('source', help='directory of <employee_id>.jpg / <employee_id>/*.jpg, or CSV manifest')
+    enrol_parser.add_argument('--state-dir', default='./write/bulk_enrolment', help='progress and upload outbox, to resume')
+    enrol_parser.add_argument('--workers', type=int, default=4, help='extraction processes, capped to the devices connected')
+    enrol_parser.add_argument('--gallery-file', help='faceprint_records JSON to check duplicates against, instead of the DB')
+    enrol_parser.add_argument('--no-upload', action='store_true', help='keep the faceprints in the outbox')
+    enrol_parser.add_argument('--duplicate-similarity', type=float, default=0.8)
+    enrol_parser.add_argument('--min-consistency', type=float, default=0.7)
+    enrol_parser.add_argument('--batch-size', type=int, default=20)
+
+    simulate_parser = subparsers.add_parser('simulate', help='synthetic new hires on simulated devices')
+    simulate_parser.add_argument('--employees', type=int, default=60)
+    simulate_parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8])
+    simulate_parser.add_argument('--extract-seconds', type=float, default=0.6, help='device time per photo')
+
+    args = parser.parse_args()
+    if args.command == 'simulate':
+        simulate(args)
+        return
+
+    if args.gallery_file:
+        with open(args.gallery_file, encoding='utf-8') as gallery_file:
+            records = json.load(gallery_file)["faceprint_records"]
+        fetch_gallery = lambda: faceprints_from_records(records)
+    else:
+        fetch_gallery = fetch_gallery_from_db
+
+    backend = rsid_backend.get_backend()
+    if rsid_backend.is_simulated():
+        from src.simulator.rsid_py import SIMULATED_PORT
+        ports = [SIMULATED_PORT] * args.workers
+    else:
+        from src.configuration.app_authentication_config import _AppConfiguration
+        ports = _AppConfiguration.get_camera_ports()
+        if not ports:
+            LOGGER.error('No Intel F455 camera device detected on the system! Set RSID_BACKEND=simulated to try it out.')
+            return
+
+    print_report(run_bulk_enrolment(
+        read_entries(args.source), args.state_dir, fetch_gallery, None if args.no_upload else upload_to_db,
+        workers=args.workers, backend=backend, ports=ports, duplicate_similarity=args.duplicate_similarity,
+        min_consistency=args.min_consistency, batch_size=args.batch_size
+    ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+import heapq
+import itertools
+import sys
+import threading
+import time
+
+import src.logger.custom_logger as custom_logger
+from src.utility import pipeline_metrics
+
+LOGGER = custom_logger.get_logger()
+
+# Lower runs first
+PRIORITY_QUIT = 0
+PRIORITY_ENROL = 1
+PRIORITY_RESYNC = 2
+PRIORITY_AUTHENTICATE = 3
+
+
+class Command:
+    """Face processor command, requested by the GUI as a {"command": name, ...} dict"""
+    name = None
+    priority = None
+    # A pending command of the same type makes a new request redundant
+    coalesce = False
+
+    def __init__(self):
+        self.enqueued_at = time.perf_counter()
+
+    def __repr__(self):
+        return f'{type(self).__name__}()'
+
+
+class QuitCommand(Command):
+    name = 'quit'
+    priority = PRIORITY_QUIT
+
+
+class EnrolCommand(Command):
+    name = 'enrol'
+    priority = PRIORITY_ENROL
+
+    def __init__(self, employee_id=None):
+        super().__init__()
+        self.employee_id = employee_id
+
+    def __repr__(self):
+        return f'EnrolCommand(employee_id={self.employee_id})'
+
+
+class RemoveAllUsersCommand(Command):
+    name = 'd'
+    priority = PRIORITY_ENROL
+
+
+class ResyncCommand(Command):
+    name = 'resync'
+    priority = PRIORITY_RESYNC
+    coalesce = True
+
+
+class AuthenticateCommand(Command):
+    name = 'authenticate'
+    priority = PRIORITY_AUTHENTICATE
+    coalesce = True
+
+
+COMMAND_TYPES = {
+    command_type.name: command_type
+    for command_type in (QuitCommand, EnrolCommand, RemoveAllUsersCommand, ResyncCommand, AuthenticateCommand)
+}
+
+
+def parse_command(request):
+    """Command of a GUI request dict, None if the command is unknown"""
+    if isinstance(request, Command):
+        return request
+    command_type = COMMAND_TYPES.get(request.get("command"))
+    if command_type is None:
+        LOGGER.error(f'Invoking cmd request failed. No such command "{request.get("command")}" exists.')
+        return None
+    if command_type is EnrolCommand:
+        return EnrolCommand(request.get("employee_id"))
+    return command_type()
+
+
+class CommandScheduler:
+    """
+    Runs the face processor commands by priority: quit > enrol > resync > authenticate.
+
+    The GUI keeps putting request dicts on cmd_request_q, a feeder thread turns them into typed commands as soon as
+    they arrive, so commands queue up by priority even while a long command (the authentication loop) is running.
+    Long commands poll has_preempting_command() at their preemption points and return to let it run.
+    """
+
+    def __init__(self, request_q=None, on_preempt=None):
+        """
+        :param request_q: queue of GUI request dicts (or Command objects), fed into the scheduler
+        :param on_preempt: on_preempt(command) when a command arrives that preempts the running one
+        """
+        self.request_q = request_q
+        self.on_preempt = on_preempt
+        self.heap = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.running = None
+        self.feeder = None
+
+        self.metrics = pipeline_metrics.get_registry()
+        self.wait_histograms = {
+            name: self.metrics.histogram(f'command_{name}_queue_wait_ms', f'Time a "{name}" command waited to run')
+            for name in COMMAND_TYPES
+        }
+        self.coalesced_counter = self.metrics.counter('commands_coalesced', 'Requests dropped as the same command was pending')
+        self.preempt_counter = self.metrics.counter('commands_preempting', 'Commands that preempted a running command')
+        self.metrics.gauge('command_queue_depth', 'Commands waiting to run', lambda: len(self.heap))
+
+    def start(self):
+        if self.request_q is not None and self.feeder is None:
+            self.feeder = threading.Thread(target=self.feed, name='command-feeder', daemon=True)
+            self.feeder.start()
+
+    def feed(self):
+        while True:
+            self.put(self.request_q.get())
+
+    def put(self, request):
+        """Queue a command or a GUI request dict, never blocks"""
+        command = parse_command(request)
+        if command is None:
+            return
+        with self.condition:
+            if command.coalesce and any(type(pending) is type(command) for _, _, pending in self.heap):
+                self.coalesced_counter.inc()
+                return
+            heapq.heappush(self.heap, (command.priority, next(self.sequence), command))
+            self.condition.notify_all()
+            running = self.running
+        LOGGER.debug(f'Command queued: {command}')
+        if running is not None and command.priority < running.priority:
+            self.preempt_counter.inc()
+            if self.on_preempt is not None:
+                self.on_preempt(command)
+
+    def next_command(self, timeout=None):
+        """Highest priority command, blocks until there is one. None if the timeout expired first"""
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.heap, timeout):
+                return None
+            _, _, command = heapq.heappop(self.heap)
+            self.running = command
+        self.wait_histograms[command.name].observe_since(command.enqueued_at)
+        return command
+
+    def done(self, command):
+        with self.condition:
+            if self.running is command:
+                self.running = None
+
+    def has_preempting_command(self, command=None):
+        """A pending command has a higher priority than command (the running one by default)"""
+        with self.condition:
+            command = command or self.running
+            return bool(self.heap) and command is not None and self.heap[0][0] < command.priority
+
+    def pending(self):
+        with self.condition:
+            return [command for _, _, command in sorted(self.heap)]
+
+
+class CommandFanOut:
+    """
+    Routes the GUI requests of a multi-camera station to the face processor of each camera.
+    Authentication runs on every camera and quit stops them all, enrolment, user removal and resync (the gallery is
+    shared) only run on the first camera, the one shown in the GUI.
+    """
+    BROADCAST_COMMANDS = {AuthenticateCommand.name, QuitCommand.name}
+
+    def __init__(self, request_q, camera_request_qs):
+        """
+        :param request_q: queue of GUI request dicts
+        :param camera_request_qs: request queue of each camera's face processor, the first one is the primary camera
+        """
+        self.request_q = request_q
+        self.camera_request_qs = camera_request_qs
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='command-fan-out', daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while True:
+            self.route(self.request_q.get())
+
+    def route(self, request):
+        name = request.name if isinstance(request, Command) else request.get("command")
+        if name in self.BROADCAST_COMMANDS:
+            for camera_request_q in self.camera_request_qs:
+                camera_request_q.put(request)
+        else:
+            self.camera_request_qs[0].put(request)
+
+
+def main():
+    # Commands requested while the authentication loop runs are serviced by priority at its preemption points
+    import queue
+    request_q = queue.Queue()
+    executed = []
+    failures = []
+
+    def check(passed, description):
+        if not passed:
+            failures.append(description)
+
+    scheduler = CommandScheduler(request_q)
+    scheduler.start()
+
+    request_q.put({"command": "authenticate"})
+    command = scheduler.next_command(timeout=1)
+    if not isinstance(command, AuthenticateCommand):
+        print(f'FAIL, authenticate request scheduled as {command}')
+        sys.exit(1)
+
+    for request in [{"command": "resync"}, {"command": "authenticate"}, {"command": "enrol", "employee_id": 42},
+                    {"command": "resync"}, {"command": "bogus"}, {"command": "quit"}]:
+        request_q.put(request)
+    # Authentication loop: one preemption point per attempt
+    while not scheduler.has_preempting_command():
+        time.sleep(0.001)
+    time.sleep(0.05)
+    scheduler.done(command)
+
+    while True:
+        command = scheduler.next_command(timeout=0.1)
+        if command is None:
+            break
+        executed.append(command.name)
+        scheduler.done(command)
+    print(f'Executed in order: {executed}')
+    # Highest priority first, the second resync coalesced into the first and the bogus request dropped
+    check(executed == ['quit', 'enrol', 'resync', 'authenticate'], f'executed {executed}, not by priority and coalesced')
+    for name, histogram in scheduler.wait_histograms.items():
+        if histogram.count:
+            print(f'{name:>12}: {histogram.snapshot()}')
+
+    if failures:
+        for description in failures:
+            print(f'FAIL, {description}')
+        sys.exit(1)
+    print('Ordering and coalescing checks passed')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,304 @@
+import json
+import os
+import sys
+import threading
+import time
+
+import src.logger.custom_logger as custom_logger
+from src.utility import pipeline_metrics
+from src.processor.rsid_backend import get_rsid
+
+LOGGER = custom_logger.get_logger()
+
+# rsid_py.DeviceConfig fields managed here, values are the member names of the matching rsid_py enums
+DEVICE_CONFIG_ENUMS = {
+    "camera_rotation": 'CameraRotation',
+    "security_level": 'SecurityLevel',
+    "algo_flow": 'AlgoFlow',
+    "face_selection_policy": 'FaceSelectionPolicy'
+}
+
+# Configs previously hard-coded in FaceProcessor.set_device_config(), "default" can be overridden by device_config
+DEVICE_CONFIG_PROFILES = {
+    "default": {
+        "camera_rotation": 'Rotation_0_Deg',
+        "security_level": 'Medium',
+        "algo_flow": 'All',
+        "face_selection_policy": 'Single'
+    },
+    "custom": {
+        "camera_rotation": 'Rotation_180_Deg',
+        "security_level": 'High',
+        "algo_flow": 'All',
+        "face_selection_policy": 'All'
+    }
+}
+
+
+def get_enum_name(value):
+    """rsid_py enum value to its member name, e.g. SecurityLevel.Medium -> 'Medium'"""
+    return getattr(value, 'name', str(value).split('.')[-1])
+
+
+def get_port_serial_number(port):
+    """USB serial number of the device on the serial port, read from the OS rather than from the device"""
+    try:
+        import serial.tools.list_ports
+        for port_info in serial.tools.list_ports.comports():
+            if port_info.device == port and port_info.serial_number:
+                return port_info.serial_number
+    except Exception as e:
+        LOGGER.warning(f'Unable to read the serial number of {port}: {e}')
+    return port
+
+
+class DeviceConfigManager:
+    """
+    Writes the device config only when the device does not have it already.
+
+    Every authenticate/enrol session used to build a DeviceConfig, write it (a serial round trip and a flash write)
+    and query it back. The config last known on each device is cached by serial number: a known device with the
+    desired config costs nothing, an unknown one costs a query, and only a device with a different config is written
+    to. The cache only lasts as long as the connection, DeviceSession forgets a device when it reconnects to it as it
+    may have been reset or swapped meanwhile. Keeping it on disk across restarts is an opt-in (cache_path).
+    """
+
+    def __init__(self, profiles=None, cache_path=None, verify_after_write=False, rsid=None):
+        """
+        :param profiles: device config per profile name, see DEVICE_CONFIG_PROFILES
+        :param cache_path: JSON file keeping the cache across restarts, None for memory only. A device reset, swapped
+            or reconfigured by another tool while the app was stopped keeps its config until the app reconnects to it
+        :param verify_after_write: query the config back after writing it, as set_device_config() used to
+        :param rsid: rsid_py module, or a stand-in for tests
+        """
+        self.profiles = profiles or DEVICE_CONFIG_PROFILES
+        self.cache_path = cache_path
+        self.verify_after_write = verify_after_write
+        self.rsid = rsid
+        self.lock = threading.Lock()
+        self.known_configs = self.load_cache()
+
+        self.metrics = pipeline_metrics.get_registry()
+        self.apply_histogram = self.metrics.histogram('device_config_apply_ms', 'Time spent making sure the device runs the desired config')
+        self.write_counter = self.metrics.counter('device_config_written', 'Device configs written to the device')
+        self.skip_counter = self.metrics.counter('device_config_skipped', 'Device config writes skipped as the device already had it')
+
+    def get_rsid(self):
+        if self.rsid is None:
+            self.rsid = get_rsid()
+        return self.rsid
+
+    def get_desired_config(self, profile=None):
+        desired_config = self.profiles.get(profile or 'default')
+        if desired_config is None:
+            LOGGER.error(f'Unknown device config profile "{profile}", using "default"')
+            desired_config = self.profiles['default']
+        return dict(desired_config)
+
+    def load_cache(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path, 'r') as cache_file:
+                return json.load(cache_file)
+        except (OSError, ValueError) as e:
+            LOGGER.warning(f'Ignoring unreadable device config cache {self.cache_path}: {e}')
+            return {}
+
+    def save_cache(self):
+        if not self.cache_path:
+            return
+        try:
+            with open(self.cache_path, 'w') as cache_file:
+                json.dump(self.known_configs, cache_file, indent=4)
+        except OSError as e:
+            LOGGER.warning(f'Unable to save the device config cache {self.cache_path}: {e}')
+
+    def forget(self, serial_number=None):
+        """Drop the cached config of a device (all devices if None), e.g. after it was configured by another tool"""
+        with self.lock:
+            if serial_number is None:
+                self.known_configs.clear()
+            else:
+                self.known_configs.pop(serial_number, None)
+            self.save_cache()
+
+    def query(self, authenticator):
+        device_config = authenticator.query_device_config()
+        return {field: get_enum_name(getattr(device_config, field)) for field in DEVICE_CONFIG_ENUMS}
+
+    def write(self, authenticator, desired_config):
+        rsid = self.get_rsid()
+        new_device_config = rsid.DeviceConfig()
+        for field, enum_name in DEVICE_CONFIG_ENUMS.items():
+            setattr(new_device_config, field, getattr(getattr(rsid, enum_name), desired_config[field]))
+        authenticator.set_device_config(new_device_config)
+
+    def apply(self, authenticator, serial_number, profile=None):
+        """
+        Make sure the device runs the config of the profile.
+        :return: True if the config was written to the device
+        """
+        apply_start_time = time.perf_counter()
+        desired_config = self.get_desired_config(profile)
+        with self.lock:
+            known_config = self.known_configs.get(serial_number)
+            if known_config is None:
+                # First time this device is seen, one query instead of a blind write
+                known_config = self.query(authenticator)
+                LOGGER.face_rec(f'Device {serial_number} config: {known_config}')
+
+            written = known_config != desired_config
+            if written:
+                LOGGER.face_rec(f'Writing device config "{profile or "default"}" to {serial_number}: {desired_config}')
+                self.write(authenticator, desired_config)
+                self.write_counter.inc()
+                if self.verify_after_write:
+                    desired_config = self.query(authenticator)
+                    LOGGER.face_rec(f'Final device config preview: {desired_config}')
+            else:
+                self.skip_counter.inc()
+
+            if self.known_configs.get(serial_number) != desired_config:
+                self.known_configs[serial_number] = desired_config
+                self.save_cache()
+        self.apply_histogram.observe_since(apply_start_time)
+        return written
+
+
+def create_device_config_manager(config):
+    """Manager with the default profile overridden by device_config in the app config"""
+    profiles = {name: dict(profile) for name, profile in DEVICE_CONFIG_PROFILES.items()}
+    profiles['default'].update(config.device_config or {})
+    return DeviceConfigManager(
+        profiles,
+        cache_path=config.device_config_cache_path,
+        verify_after_write=bool(config.device_config_verify_after_write)
+    )
+
+
+_manager = None
+
+
+def get_device_config_manager(config=None):
+    """Manager shared by every device session of the app"""
+    global _manager
+    if _manager is None:
+        if config is not None:
+            _manager = create_device_config_manager(config)
+        else:
+            _manager = DeviceConfigManager()
+    return _manager
+
+
+class _StandInEnum:
+    def __init__(self, enum_name, name):
+        self.name = name
+        self.enum_name = enum_name
+
+    def __repr__(self):
+        return f'{self.enum_name}.{self.name}'
+
+
+class _StandInRsid:
+    """Minimal rsid_py stand-in: DeviceConfig, the config enums and a FaceAuthenticator with serial latencies"""
+
+    def __init__(self):
+        for field, enum_name in DEVICE_CONFIG_ENUMS.items():
+            names = {profile[field] for profile in DEVICE_CONFIG_PROFILES.values()}
+            setattr(self, enum_name, type(enum_name, (), {name: _StandInEnum(enum_name, name) for name in names}))
+
+    class DeviceConfig:
+        pass
+
+    class FaceAuthenticator:
+        # Serial round trip of a query, and of a write which also goes to flash
+        QUERY_SECONDS = 0.03
+        WRITE_SECONDS = 0.15
+
+        def __init__(self, device_config):
+            self.device_config = device_config
+            self.queries = 0
+            self.writes = 0
+
+        def query_device_config(self):
+            time.sleep(self.QUERY_SECONDS)
+            self.queries += 1
+            return self.device_config
+
+        def set_device_config(self, device_config):
+            time.sleep(self.WRITE_SECONDS)
+            self.writes += 1
+            self.device_config = device_config
+
+
+def main():
+    # Config cost of authenticate/enrol sessions with the previous write-and-query path and with the manager
+    rsid = _StandInRsid()
+    sessions = 20
+    factory_config = rsid.DeviceConfig()
+    for field, enum_name in DEVICE_CONFIG_ENUMS.items():
+        setattr(factory_config, field, getattr(getattr(rsid, enum_name), DEVICE_CONFIG_PROFILES['custom'][field]))
+
+    # Previous behaviour: write and query back on every session
+    legacy_manager = DeviceConfigManager(rsid=rsid)
+    authenticator = rsid.FaceAuthenticator(factory_config)
+    start_time = time.perf_counter()
+    for _ in range(sessions):
+        legacy_manager.write(authenticator, legacy_manager.get_desired_config())
+        legacy_manager.query(authenticator)
+    legacy_seconds = time.perf_counter() - start_time
+    print(f'write + query per session: {1000 * legacy_seconds / sessions:.1f} ms/session, '
+          f'{authenticator.writes} writes, {authenticator.queries} queries')
+
+    manager = DeviceConfigManager(rsid=rsid)
+    authenticator = rsid.FaceAuthenticator(factory_config)
+    start_time = time.perf_counter()
+    for _ in range(sessions):
+        manager.apply(authenticator, 'F455-0001')
+    managed_seconds = time.perf_counter() - start_time
+    print(f'config manager:            {1000 * managed_seconds / sessions:.1f} ms/session, '
+          f'{authenticator.writes} writes, {authenticator.queries} queries')
+
+    failures = []
+
+    def check(passed, description):
+        if not passed:
+            failures.append(description)
+
+    # One query and one write for all the sessions, the rest is served from the cache
+    check(authenticator.writes == 1 and authenticator.queries == 1,
+          f'{authenticator.writes} writes and {authenticator.queries} queries over {sessions} sessions, expected 1 and 1')
+    check(managed_seconds <= legacy_seconds / 4,
+          f'config manager took {managed_seconds:.3f} s against {legacy_seconds:.3f} s for write + query per session')
+
+    # A device already running the desired config is never written to
+    authenticator = rsid.FaceAuthenticator(authenticator.device_config)
+    check(not manager.apply(authenticator, 'F455-0002'), 'device already configured was written to')
+    check(authenticator.writes == 0 and authenticator.queries == 1,
+          f'device already configured: {authenticator.writes} writes and {authenticator.queries} queries, expected 0 and 1')
+
+    # Changing the desired config writes again, once
+    manager.profiles = dict(manager.profiles, default=DEVICE_CONFIG_PROFILES['custom'])
+    check(manager.apply(authenticator, 'F455-0002'), 'changed config was not written')
+    check(not manager.apply(authenticator, 'F455-0002'), 'changed config was written again')
+    check(authenticator.writes == 1, f'changed config: {authenticator.writes} writes, expected 1')
+
+    # A device factory reset behind the cache, forgotten when DeviceSession reconnects to it: queried and written again
+    reset_config = rsid.DeviceConfig()
+    for field, enum_name in DEVICE_CONFIG_ENUMS.items():
+        setattr(reset_config, field, getattr(getattr(rsid, enum_name), DEVICE_CONFIG_PROFILES['default'][field]))
+    authenticator = rsid.FaceAuthenticator(reset_config)
+    manager.forget('F455-0002')
+    check(manager.apply(authenticator, 'F455-0002'), 'device reset after a reconnect was not written')
+    check(authenticator.queries == 1, f'device reset after a reconnect: {authenticator.queries} queries, expected 1')
+
+    if failures:
+        for description in failures:
+            print(f'FAIL, {description}')
+        sys.exit(1)
+    print('Timing and cache checks passed')
+
+
+if __name__ == '__main__':
+    main()
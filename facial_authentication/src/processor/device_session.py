@@ -0,0 +1,195 @@
+import threading
+import time
+
+import src.logger.custom_logger as custom_logger
+from src.utility import pipeline_metrics
+from src.processor.device_config_manager import get_port_serial_number
+from src.processor.rsid_backend import get_rsid
+
+LOGGER = custom_logger.get_logger()
+
+# Device config not written on the current connection yet
+_NOT_APPLIED = object()
+
+# Errors rsid_py raises when the serial link fails, anything else is left to the caller
+SERIAL_ERRORS = (RuntimeError, OSError)
+
+
+class DeviceSessionError(Exception):
+    """The F455 could not be reached, even after reconnecting"""
+
+
+class DeviceSession:
+    """
+    Single long-lived rsid_py.FaceAuthenticator shared by every face processor command.
+
+    Authenticate, enrol and remove used to open their own serial session and re-write the device config each time.
+    Here the session stays open, device operations run one at a time (execute() holds the session lock),
+    a dropped serial link is reconnected with exponential backoff and the device config is checked once per
+    connection (the config manager only writes it if the device runs another one).
+    """
+
+    def __init__(
+            self, port, device_config_manager=None, authenticator_factory=None,
+            reconnect_initial_delay=0.5, reconnect_max_delay=10.0, max_connect_attempts=10, connect_timeout=30.0
+    ):
+        """
+        :param port: serial port of the F455
+        :param device_config_manager: DeviceConfigManager making sure the device runs the desired config
+        :param authenticator_factory: authenticator_factory(port) opens a session, FaceAuthenticator of the selected
+            rsid_py backend by default
+        :param connect_timeout: seconds a command keeps trying to connect before the device is reported unreachable
+        """
+        self.port = port
+        self.device_config_manager = device_config_manager
+        self.authenticator_factory = authenticator_factory
+        self.reconnect_initial_delay = reconnect_initial_delay
+        self.reconnect_max_delay = reconnect_max_delay
+        self.max_connect_attempts = max_connect_attempts
+        self.connect_timeout = connect_timeout
+        self.connect_cancelled = threading.Event()
+
+        self.lock = threading.RLock()
+        # Host-side matches run one at a time, and never on a session being closed
+        self.match_lock = threading.Lock()
+        self.authenticator = None
+        self.serial_number = None
+        self.desired_device_config = None
+        self.applied_device_config = _NOT_APPLIED
+        self.connections = 0
+        self.invalidated = False
+
+        self.metrics = pipeline_metrics.get_registry()
+        self.connect_histogram = self.metrics.histogram('device_connect_ms', 'Time spent opening a session with the device')
+        self.reconnect_counter = self.metrics.counter('device_reconnects', 'Device sessions reopened after a serial error')
+        self.command_wait_histogram = self.metrics.histogram('device_command_wait_ms', 'Time a device command waited for the session')
+
+    def set_device_config(self, profile=None):
+        """Device config profile the session should run with, applied before the next command if it changed"""
+        with self.lock:
+            self.desired_device_config = profile
+
+    def is_connected(self):
+        return self.authenticator is not None
+
+    def connect(self):
+        """
+        Open the session unless it is open, retrying with exponential backoff for up to connect_timeout seconds.
+        The lock is only held during each attempt: other commands are not held up by the backoff, and cancel() ends it.
+        """
+        delay = self.reconnect_initial_delay
+        deadline = time.perf_counter() + self.connect_timeout
+        self.connect_cancelled.clear()
+        for attempt in range(1, self.max_connect_attempts + 1):
+            with self.lock:
+                if self.authenticator is not None:
+                    return self.authenticator
+                try:
+                    return self.open_session()
+                except SERIAL_ERRORS as e:
+                    LOGGER.error(f'Unable to open a device session on {self.port} (attempt {attempt}/{self.max_connect_attempts}): {e}')
+            if attempt == self.max_connect_attempts or time.perf_counter() + delay > deadline:
+                break
+            if self.connect_cancelled.wait(delay):
+                LOGGER.info(f'Connection to the device on {self.port} cancelled')
+                break
+            delay = min(delay * 2, self.reconnect_max_delay)
+        raise DeviceSessionError(f'Device unreachable on {self.port}')
+
+    def open_session(self):
+        """Single connection attempt. Must be called with the lock held"""
+        connect_start_time = time.perf_counter()
+        self.authenticator = self.open_authenticator()
+        self.serial_number = get_port_serial_number(self.port)
+        self.connect_histogram.observe_since(connect_start_time)
+        LOGGER.face_rec(f'Device session opened on {self.port}')
+        if self.connections:
+            self.reconnect_counter.inc()
+            # The link dropped, the device may have been reset or swapped for another with the same serial number
+            if self.device_config_manager is not None:
+                self.device_config_manager.forget(self.serial_number)
+        self.connections += 1
+        # A new connection may be to another device, its config is not known
+        self.applied_device_config = _NOT_APPLIED
+        return self.authenticator
+
+    def open_authenticator(self):
+        if self.authenticator_factory is not None:
+            return self.authenticator_factory(self.port)
+        return get_rsid().FaceAuthenticator(self.port)
+
+    def disconnect(self):
+        with self.lock:
+            if self.authenticator is None:
+                return
+            with self.match_lock:
+                try:
+                    self.authenticator.disconnect()
+                except Exception as e:
+                    LOGGER.warning(f'Error while closing the device session: {e}')
+                self.authenticator = None
+            self.invalidated = False
+
+    def invalidate(self):
+        """
+        Drop the session after a serial error reported through a callback status.
+        Callbacks run inside the command, so the session is only closed once the command returns.
+        """
+        LOGGER.warning(f'Device session on {self.port} invalidated')
+        self.invalidated = True
+
+    def apply_device_config(self):
+        if self.device_config_manager is None or self.applied_device_config == self.desired_device_config:
+            return
+        self.device_config_manager.apply(self.authenticator, self.serial_number, self.desired_device_config)
+        self.applied_device_config = self.desired_device_config
+
+    def execute(self, operation, name='command', retry=True):
+        """
+        Run operation(authenticator) on the device, after any other command in progress.
+        A failing command is retried once on a fresh session.
+        :param retry: False for operations the device may have carried out before the serial link failed (enrol,
+            remove), running them again could enrol twice or start a second callback stream
+        """
+        wait_start_time = time.perf_counter()
+        attempts = 2 if retry else 1
+        for attempt in range(attempts):
+            self.connect()
+            with self.lock:
+                if not attempt:
+                    self.command_wait_histogram.observe_since(wait_start_time)
+                try:
+                    if self.authenticator is None:
+                        # Closed by another command since connect()
+                        self.open_session()
+                    self.apply_device_config()
+                    result = operation(self.authenticator)
+                    if self.invalidated:
+                        self.disconnect()
+                    return result
+                except SERIAL_ERRORS as e:
+                    LOGGER.error(f'Device {name} failed, reconnecting: {e}')
+                    self.disconnect()
+                    if attempt == attempts - 1:
+                        raise
+
+    def run_host_side(self, operation, name='host operation'):
+        """
+        Run operation(authenticator) without waiting for the device command in progress.
+        For host-side calls only (faceprint matching), which never talk to the device over the serial link. They are
+        serialised on their own lock: matcher threads never call into the authenticator at the same time, and the
+        session is not closed under them. Without a session there is no authenticator to match with, the operation
+        fails rather than opening one.
+        """
+        with self.match_lock:
+            authenticator = self.authenticator
+            if authenticator is None:
+                raise DeviceSessionError(f'No device session on {self.port} for {name}')
+            return operation(authenticator)
+
+    def cancel(self):
+        """Cancel the operation in progress, deliberately without the lock as the operation holds it"""
+        self.connect_cancelled.set()
+        authenticator = self.authenticator
+        if authenticator is not None:
+            authenticator.cancel()
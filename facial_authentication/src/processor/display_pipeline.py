@@ -0,0 +1,158 @@
+import time
+import numpy as np
+import cv2
+from PIL import Image
+
+import src.logger.custom_logger as custom_logger
+
+LOGGER = custom_logger.get_logger()
+
+
+class DisplayPipeline:
+    """
+    Prepares camera frames for the GUI in a single pass on the image processor thread.
+
+    The letterboxed geometry for a source resolution is computed once and cached, every frame is then
+    resized with a single cv2.resize() straight into a reused display canvas. The GUI thread receives an
+    image that is already at display size, so all it has to do is blit it.
+
+    The images handed to the GUI come from a small ring that is refilled in place, so no image is allocated per
+    frame. The ring must be longer than the number of frames the GUI can lag behind, it drains to the newest frame.
+    """
+    # Same as MODERN_COLORS['camera_bg'] used by the GUI camera frame
+    BACKGROUND_COLOR = (17, 24, 39)
+
+    # Number of frames between each timing summary printout
+    TIMING_LOG_INTERVAL = 300
+
+    # Number of display images cycled through when handing frames over to the GUI thread
+    HANDOFF_BUFFERS = 3
+
+    def __init__(
+            self, display_width, display_height, mirror=True,
+            background_color=BACKGROUND_COLOR, interpolation=cv2.INTER_AREA, handoff_buffers=HANDOFF_BUFFERS
+    ):
+        self.display_width = display_width
+        self.display_height = display_height
+        self.mirror = mirror
+        self.background_color = background_color
+        self.interpolation = interpolation
+
+        # Reused display canvas, the letterbox bars are only painted when the geometry changes
+        self.canvas = np.empty((display_height, display_width, 3), dtype=np.uint8)
+        self.canvas_roi = None
+
+        # Display images handed to the GUI thread, refilled from the canvas in turn
+        self.handoff_images = [Image.new('RGB', (display_width, display_height)) for _ in range(handoff_buffers)]
+        self.handoff_index = 0
+
+        # Cached geometry, keyed on the source resolution it was computed for
+        self.geometry_source_size = None
+        self.geometry = None
+
+        # Per-frame timings (milliseconds) of the last rendered frame
+        self.last_timings = {
+            "resize_ms": 0.0,
+            "handoff_ms": 0.0,
+            "total_ms": 0.0
+        }
+        self.frames_rendered = 0
+        self._timings_sum = dict.fromkeys(self.last_timings, 0.0)
+
+    def get_geometry(self, source_width, source_height):
+        """
+        Compute the letterboxed geometry of a source resolution inside the display canvas.
+        :return: tuple of (width, height, x_offset, y_offset) of the scaled image within the canvas
+        """
+        if self.geometry_source_size == (source_width, source_height):
+            return self.geometry
+
+        scale = min(self.display_width / source_width, self.display_height / source_height)
+        new_width = min(self.display_width, max(1, int(round(source_width * scale))))
+        new_height = min(self.display_height, max(1, int(round(source_height * scale))))
+        x_offset = (self.display_width - new_width) // 2
+        y_offset = (self.display_height - new_height) // 2
+
+        self.geometry_source_size = (source_width, source_height)
+        self.geometry = (new_width, new_height, x_offset, y_offset)
+
+        # Repaint the letterbox bars and point the resize target at the image area of the canvas
+        self.canvas[:] = self.background_color
+        self.canvas_roi = self.canvas[y_offset:y_offset + new_height, x_offset:x_offset + new_width]
+
+        LOGGER.info(
+            f'Display geometry: {source_width}x{source_height} -> {new_width}x{new_height} '
+            f'at ({x_offset}, {y_offset}) in {self.display_width}x{self.display_height}'
+        )
+        return self.geometry
+
+    def render(self, frame):
+        """
+        Letterbox a camera frame into the display canvas.
+        :param frame: HxWx3 uint8 camera frame, left untouched
+        :return: PIL Image at display size, valid until the ring wraps around to it again
+        """
+        start_time = time.perf_counter()
+
+        source_height, source_width = frame.shape[:2]
+        new_width, new_height, _, _ = self.get_geometry(source_width, source_height)
+
+        # Single resize, written straight into the canvas
+        cv2.resize(frame, (new_width, new_height), dst=self.canvas_roi, interpolation=self.interpolation)
+        if self.mirror:
+            # Mirroring the downscaled image is far cheaper than mirroring the full frame
+            cv2.flip(self.canvas_roi, 1, dst=self.canvas_roi)
+        resized_time = time.perf_counter()
+
+        # The canvas is copied into the next image of the ring, so the canvas can be reused for the next frame
+        # while the GUI thread is still displaying this one
+        display_image = self.handoff_images[self.handoff_index]
+        self.handoff_index = (self.handoff_index + 1) % len(self.handoff_images)
+        display_image.frombytes(self.canvas)
+        end_time = time.perf_counter()
+
+        self.record_timings((resized_time - start_time) * 1000, (end_time - resized_time) * 1000)
+        return display_image
+
+    def record_timings(self, resize_ms, handoff_ms):
+        self.last_timings["resize_ms"] = resize_ms
+        self.last_timings["handoff_ms"] = handoff_ms
+        self.last_timings["total_ms"] = resize_ms + handoff_ms
+        for key, value in self.last_timings.items():
+            self._timings_sum[key] += value
+        self.frames_rendered += 1
+
+        if self.frames_rendered % DisplayPipeline.TIMING_LOG_INTERVAL == 0:
+            LOGGER.debug(f'Display pipeline timings over {self.frames_rendered} frames: {self.get_average_timings()}')
+
+    def get_average_timings(self):
+        if self.frames_rendered == 0:
+            return dict(self.last_timings)
+        return {
+            key: round(value / self.frames_rendered, 3) for key, value in self._timings_sum.items()
+        }
+
+
+def main():
+    # Compare the previous double resize against the single-pass pipeline on a synthetic camera frame
+    frame = np.random.randint(0, 255, (1280, 720, 3), dtype=np.uint8)
+    iterations = 200
+
+    start_time = time.perf_counter()
+    for _ in range(iterations):
+        image = Image.fromarray(cv2.flip(frame, 1)).resize((300, 450))
+        resized = image.resize((280, 420), Image.LANCZOS)
+        centered_image = Image.new('RGB', (280, 420), DisplayPipeline.BACKGROUND_COLOR)
+        centered_image.paste(resized, (0, 0))
+    double_resize_ms = (time.perf_counter() - start_time) * 1000 / iterations
+
+    pipeline = DisplayPipeline(280, 420)
+    for _ in range(iterations):
+        pipeline.render(frame)
+
+    print(f'Double resize: {double_resize_ms:.3f} ms/frame')
+    print(f'Display pipeline: {pipeline.get_average_timings()} ms/frame')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+import time
+
+import numpy as np
+
+import src.logger.custom_logger as custom_logger
+from src.processor.gallery import normalize_features
+
+LOGGER = custom_logger.get_logger()
+
+
+class EnrolmentSelection:
+    """Capture chosen among the enrolment captures of an employee, and how it compares to the gallery"""
+
+    def __init__(self, best_index, consistency, cross_similarity, gallery_employee_id=None, gallery_similarity=None):
+        self.best_index = best_index
+        # Mean similarity of each capture to the other captures
+        self.consistency = consistency
+        self.cross_similarity = cross_similarity
+        # Closest faceprint of another employee in the gallery
+        self.gallery_employee_id = gallery_employee_id
+        self.gallery_similarity = gallery_similarity
+
+    @property
+    def best_consistency(self):
+        return float(self.consistency[self.best_index])
+
+    def __repr__(self):
+        return (
+            f'EnrolmentSelection(best_index={self.best_index}, consistency={np.round(self.consistency, 3).tolist()}, '
+            f'gallery_employee_id={self.gallery_employee_id}, gallery_similarity={self.gallery_similarity})'
+        )
+
+
+def select_enrolment_capture(captures, gallery_employee_ids=None, gallery_features=None, employee_id=None):
+    """
+    Choose the capture representing the employee best, on the host, without re-authenticating against each capture.
+
+    Captures are cross-scored against each other in one matrix product (cosine similarity of the feature vectors).
+    The one closest on average to the others is kept: it is the most typical view of the face, a capture spoiled by
+    pose or lighting scores low against all the others. The chosen capture is then scored against the whole gallery
+    the same way, faceprints already enrolled under employee_id are left out so a re-enrolment is not a duplicate.
+    :param captures: feature vectors of the successful enrolment captures
+    :param gallery_employee_ids, gallery_features: Gallery.get_features()
+    """
+    capture_features = normalize_features(captures)
+    cross_similarity = capture_features @ capture_features.T
+    count = len(capture_features)
+    if count > 1:
+        consistency = (cross_similarity.sum(axis=1) - np.diag(cross_similarity)) / (count - 1)
+    else:
+        consistency = np.ones(count, dtype=np.float32)
+    best_index = int(np.argmax(consistency))
+
+    gallery_employee_id = None
+    gallery_similarity = None
+    if gallery_features is not None and len(gallery_features):
+        similarity = gallery_features @ capture_features[best_index]
+        others = np.array([gallery_id != employee_id for gallery_id in gallery_employee_ids])
+        if others.any():
+            similarity = np.where(others, similarity, -np.inf)
+            closest = int(np.argmax(similarity))
+            gallery_employee_id = gallery_employee_ids[closest]
+            gallery_similarity = float(similarity[closest])
+
+    return EnrolmentSelection(best_index, consistency, cross_similarity, gallery_employee_id, gallery_similarity)
+
+
+def main():
+    # Best-of-N enrolment on the simulated device: re-authenticating once per capture to score it (the previous
+    # experimental flow) vs host-side cross-scoring
+    from src.simulator import rsid_py
+    from src.processor.gallery import Gallery
+
+    best_of = 3
+    employees = 5
+    rsid_py.configure(
+        person_seconds=1e9, gap_seconds=0.0, unknown_rate=0.0, known_identities=employees,
+        enroll_status_mix={"Success": 1.0}, auth_status_mix={"Success": 1.0}, capture_noise=[0.1, 1.0],
+        enroll_seconds=2.5, auth_seconds=0.8
+    )
+    authenticator = rsid_py.FaceAuthenticator(rsid_py.SIMULATED_PORT)
+    scene = rsid_py.get_scene()
+
+    gallery = Gallery()
+    gallery.load(lambda: {
+        f'E{identity:03d}': [faceprint]
+        for identity, faceprint in enumerate(_records_to_faceprints(rsid_py, range(100, 600)))
+    })
+    gallery_employee_ids, gallery_features = gallery.get_features()
+
+    def capture(extract):
+        captured = []
+        while not captured:
+            extract(on_result=lambda status, faceprint: captured.append(faceprint))
+        return captured[0]
+
+    def template_similarity(identity, faceprint):
+        template = normalize_features([rsid_py.identity_features(identity)])[0]
+        return float(normalize_features([faceprint.features])[0] @ template)
+
+    results = {"re-authentication": [], "host cross-scoring": []}
+    for identity in range(employees):
+        # The same person stays in front of the camera for the whole enrolment
+        scene.identities[0] = identity
+        start = time.perf_counter()
+        captures = [capture(authenticator.extract_faceprints_for_enroll) for _ in range(best_of)]
+        capture_seconds = time.perf_counter() - start
+
+        # Previous flow: one live authentication per capture, the capture the live face matches best is kept
+        start = time.perf_counter()
+        scores = []
+        for enrolment in captures:
+            probe = capture(authenticator.extract_faceprints_for_auth)
+            enrolled = rsid_py.Faceprints()
+            enrolled.enroll_descriptor = enrolment.features
+            scores.append(authenticator.match_faceprints(probe, enrolled, rsid_py.Faceprints()).score)
+        chosen = captures[int(np.argmax(scores))]
+        results["re-authentication"].append(
+            (time.perf_counter() - start, capture_seconds, template_similarity(identity, chosen))
+        )
+
+        start = time.perf_counter()
+        selection = select_enrolment_capture(
+            [faceprint.features for faceprint in captures], gallery_employee_ids, gallery_features
+        )
+        chosen = captures[selection.best_index]
+        results["host cross-scoring"].append(
+            (time.perf_counter() - start, capture_seconds, template_similarity(identity, chosen))
+        )
+
+    print(f'Best of {best_of} captures, {employees} employees, gallery of {len(gallery_employee_ids)} faceprints')
+    print(f'{"selection":>20} {"selection s":>12} {"enrolment s":>12} {"similarity to the true face":>28}')
+    for name, samples in results.items():
+        selection_seconds, capture_seconds, similarity = np.mean(samples, axis=0)
+        print(
+            f'{name:>20} {selection_seconds:>12.4f} {selection_seconds + capture_seconds:>12.2f} {similarity:>28.3f}'
+        )
+
+
+def _records_to_faceprints(rsid_py, identities):
+    for identity in identities:
+        faceprint = rsid_py.Faceprints()
+        faceprint.enroll_descriptor = rsid_py.identity_features(identity)
+        yield faceprint
+
+
+if __name__ == '__main__':
+    main()
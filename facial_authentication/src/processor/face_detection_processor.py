@@ -4,23 +4,23 @@ Created on Mon Mar  7 09:33:51 2022
 
 @author: Maventree
 """
-from cv2 import cv2
-import mediapipe as mp
+import cv2
 import traceback
 import threading
 import src.logger.custom_logger as custom_logger
+from src.utility import pipeline_metrics
+from src.processor.face_detectors import MediaPipeFaceDetector
 import time
 
 LOGGER = custom_logger.get_logger()
 
-# Initialize the mediapipe face detection class.
-mp_face_detection = mp.solutions.face_detection
+# Frame pipeline metrics
+METRICS = pipeline_metrics.get_registry()
+DETECT_HISTOGRAM = METRICS.histogram('face_detect_ms', 'Time spent running face detection on a frame')
+FACE_DETECTED_COUNTER = METRICS.counter('face_detected_frames', 'Frames in which at least one face was detected')
 
-# Set up the Face Detection functions for images and videos.
-face_detection = mp_face_detection.FaceDetection(min_detection_confidence=0.5)
-
-# Initialize the mediapipe drawing class.
-mp_drawing = mp.solutions.drawing_utils
+# Face detector backend, created on first use (MediaPipe) unless set from the app config beforehand
+face_detector = None
 
 window_title = "esc to quit, space to take pic"
 active_keypress = 1
@@ -36,69 +36,98 @@ class FaceDetectionProcessor(threading.Thread):
         LOGGER.info("FaceDetectionProcessor init complete.")
 
     @staticmethod
-    def detect_faces(image, face_detection, draw_face_landmarks_on_image=False):
+    def set_face_detector(detector):
+        global face_detector
+        face_detector = detector
+
+    @staticmethod
+    def get_face_detector():
+        global face_detector
+        if face_detector is None:
+            face_detector = MediaPipeFaceDetector(min_detection_confidence=0.5)
+        return face_detector
+
+    @staticmethod
+    def detect_faces(image, face_detector, draw_face_landmarks_on_image=False, buffer_pool=None):
         '''
         This function performs face detection on an image.
         Args:
             image:   The input image with prominent face(s) whose landmarks need to be detected.
-            face_detection:   The FaceDetection function required to perform the face landmarks detection.
+            face_detector:   The FaceDetector backend required to perform the face detection.
             draw_face_landmarks_on_image:    A boolean value that is if set to true the function draws face landmarks on the output image.
+            buffer_pool:   Optional FrameBufferPool the RGB conversion is written into, instead of a new image.
         Returns:
             image_to_return: A copy of input image with the detected face landmarks drawn if specified.
-            results: The output of the face landmarks detection on the input image.
+            faces: The list of DetectedFace found in the input image.
         '''
         # Convert the image from BGR into RGB format.
-        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        if buffer_pool is not None:
+            image_rgb = buffer_pool.cvt_color('detect_rgb', image, cv2.COLOR_BGR2RGB)
+        else:
+            image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
 
         # Perform the Face Detection.
-        results = face_detection.process(image_rgb)
+        faces = face_detector.detect(image_rgb)
 
         image_to_return = image
 
-        # If face landmarks are detected and we have to draw them
-        if results.detections and draw_face_landmarks_on_image:
+        # If faces are detected and we have to draw them
+        if faces and draw_face_landmarks_on_image:
             # Create a copy of the input image to draw landmarks on.
             drawn_image = image.copy()
 
             # Iterate over the found faces.
-            for detection in results.detections:
-                # Draw the face landmarks on the copy of the input image.
-                mp_drawing.draw_detection(drawn_image, detection)
+            for face in faces:
+                # Draw the face box and landmarks on the copy of the input image.
+                cv2.rectangle(drawn_image, (face.x, face.y), (face.x + face.w, face.y + face.h), (0, 255, 0), 2)
+                for landmark_x, landmark_y in face.landmarks.values():
+                    cv2.circle(drawn_image, (int(landmark_x), int(landmark_y)), 3, (0, 0, 255), cv2.FILLED)
 
             image_to_return = drawn_image
 
-        return image_to_return, results
+        return image_to_return, faces
 
     def detect_face(
-            image=None, draw_face_landmarks_on_image=False
+            image=None, draw_face_landmarks_on_image=False, buffer_pool=None, face_detector=None
     ):
+        # NOTE: With a buffer_pool, the returned image is a pooled buffer that is overwritten by the next frame
+        # NOTE: Faces are reported in the coordinates of the mirrored image, the same way the GUI shows it
+        # NOTE: Without a face_detector the one shared by the app is used, each camera pipeline passes its own
         final_result = {
             "image": None,
-            "face_detected": False
+            "face_detected": False,
+            "faces": []
         }
 
         # Read a sample image if no image is provided.
         if image is None:
             image = cv2.imread('./image/image_1.jpg')  # Replace with your image path.
 
-        flipped_image = cv2.flip(image, 1)
+        if buffer_pool is not None:
+            flipped_image = buffer_pool.flip('detect_flipped', image, 1)
+        else:
+            flipped_image = cv2.flip(image, 1)
 
         # Ensure there's a usable frame after flipping
         if flipped_image is not None:
-            image, results = FaceDetectionProcessor.detect_faces(
-                flipped_image, face_detection,
-                draw_face_landmarks_on_image
+            detect_start_time = time.perf_counter()
+            image, faces = FaceDetectionProcessor.detect_faces(
+                flipped_image, face_detector or FaceDetectionProcessor.get_face_detector(),
+                draw_face_landmarks_on_image, buffer_pool
             )
+            DETECT_HISTOGRAM.observe_since(detect_start_time)
 
             # If no faces detected
-            if not results.detections:
+            if not faces:
                 # Pass back the image to be displayed so the stream looks "live"
                 final_result['image'] = image
                 return final_result
 
             # If faces detected
+            FACE_DETECTED_COUNTER.inc()
             final_result['image'] = image
             final_result['face_detected'] = True
+            final_result['faces'] = faces
             return final_result
         else:
             print('Image NONE!')
@@ -0,0 +1,313 @@
+import argparse
+import os
+import sys
+import time
+import numpy as np
+import cv2
+
+import src.logger.custom_logger as custom_logger
+from src.processor.frame_buffer_pool import FrameBufferPool
+
+LOGGER = custom_logger.get_logger()
+
+FACE_DETECTOR_MEDIAPIPE = 'mediapipe'
+FACE_DETECTOR_YUNET = 'yunet'
+FACE_DETECTOR_HAAR = 'haar'
+FACE_DETECTOR_STUB = 'stub'
+
+
+class DetectedFace:
+    """
+    A face found by a detector, in pixel coordinates of the image passed to detect().
+    landmarks holds whichever of right_eye, left_eye, nose_tip the backend provides, as (x, y).
+    """
+
+    def __init__(self, x, y, w, h, score=1.0, landmarks=None):
+        self.x = x
+        self.y = y
+        self.w = w
+        self.h = h
+        self.score = score
+        self.landmarks = landmarks or {}
+
+    def __repr__(self):
+        return f'DetectedFace(x={self.x}, y={self.y}, w={self.w}, h={self.h}, score={self.score:.2f})'
+
+    def iou(self, other):
+        x1, y1 = max(self.x, other.x), max(self.y, other.y)
+        x2, y2 = min(self.x + self.w, other.x + other.w), min(self.y + self.h, other.y + other.h)
+        intersection = max(0, x2 - x1) * max(0, y2 - y1)
+        union = self.w * self.h + other.w * other.h - intersection
+        return intersection / union if union > 0 else 0.0
+
+
+class FaceDetector:
+    """
+    Host-side face detector, only has to tell whether (and where) faces are present in a frame.
+    Backends take an RGB frame and return a list of DetectedFace.
+    """
+    name = 'base'
+
+    def detect(self, image_rgb):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MediaPipeFaceDetector(FaceDetector):
+    """MediaPipe short-range face detection, the original detector of the station"""
+    name = FACE_DETECTOR_MEDIAPIPE
+
+    # MediaPipe keypoint order
+    KEYPOINT_NAMES = ('right_eye', 'left_eye', 'nose_tip', 'mouth_center', 'right_ear_tragion', 'left_ear_tragion')
+
+    def __init__(self, min_detection_confidence=0.5):
+        import mediapipe as mp
+
+        self.face_detection = mp.solutions.face_detection.FaceDetection(min_detection_confidence=min_detection_confidence)
+
+    def detect(self, image_rgb):
+        image_height, image_width = image_rgb.shape[:2]
+        results = self.face_detection.process(image_rgb)
+
+        faces = []
+        for detection in results.detections or []:
+            box = detection.location_data.relative_bounding_box
+            landmarks = {
+                name: (keypoint.x * image_width, keypoint.y * image_height)
+                for name, keypoint in zip(MediaPipeFaceDetector.KEYPOINT_NAMES, detection.location_data.relative_keypoints)
+            }
+            faces.append(DetectedFace(
+                int(box.xmin * image_width), int(box.ymin * image_height),
+                int(box.width * image_width), int(box.height * image_height),
+                detection.score[0], landmarks
+            ))
+        return faces
+
+    def close(self):
+        self.face_detection.close()
+
+
+class DownscalingFaceDetector(FaceDetector):
+    """Base for the OpenCV backends, frames are downscaled to input_width before detection"""
+
+    def __init__(self, input_width=320):
+        self.input_width = input_width
+        self.buffer_pool = FrameBufferPool()
+
+    def downscale(self, image):
+        image_height, image_width = image.shape[:2]
+        scale = min(1.0, self.input_width / image_width)
+        size = (int(image_width * scale), int(image_height * scale))
+        small_image = self.buffer_pool.get('detector_input', (size[1], size[0]) + image.shape[2:], image.dtype)
+        cv2.resize(image, size, dst=small_image, interpolation=cv2.INTER_AREA)
+        return small_image, scale
+
+
+class YuNetFaceDetector(DownscalingFaceDetector):
+    """
+    OpenCV DNN YuNet detector (cv2.FaceDetectorYN, OpenCV >= 4.5.4).
+    Model: https://github.com/opencv/opencv_zoo/tree/main/models/face_detection_yunet
+    NOTE: The 2022mar model works with OpenCV 4.5.x, newer models need newer OpenCV
+    """
+    name = FACE_DETECTOR_YUNET
+
+    def __init__(self, model_path, score_threshold=0.6, input_width=320):
+        super().__init__(input_width)
+        if not os.path.isfile(model_path):
+            raise FileNotFoundError(f'YuNet model not found: {model_path}')
+        self.face_detector = cv2.FaceDetectorYN.create(model_path, '', (input_width, input_width), score_threshold)
+        self.input_size = None
+
+    def detect(self, image_rgb):
+        small_image, scale = self.downscale(image_rgb)
+        small_image_bgr = self.buffer_pool.cvt_color('detector_bgr', small_image, cv2.COLOR_RGB2BGR)
+
+        input_size = (small_image_bgr.shape[1], small_image_bgr.shape[0])
+        if input_size != self.input_size:
+            self.face_detector.setInputSize(input_size)
+            self.input_size = input_size
+
+        _, detections = self.face_detector.detect(small_image_bgr)
+
+        faces = []
+        for detection in detections if detections is not None else []:
+            x, y, w, h = (detection[:4] / scale).astype(int)
+            landmarks = {
+                'right_eye': (detection[4] / scale, detection[5] / scale),
+                'left_eye': (detection[6] / scale, detection[7] / scale),
+                'nose_tip': (detection[8] / scale, detection[9] / scale)
+            }
+            faces.append(DetectedFace(int(x), int(y), int(w), int(h), float(detection[14]), landmarks))
+        return faces
+
+
+class HaarFaceDetector(DownscalingFaceDetector):
+    """OpenCV Haar cascade, cheapest of the real detectors but frontal faces only and no landmarks"""
+    name = FACE_DETECTOR_HAAR
+
+    def __init__(self, cascade_path=None, input_width=320, min_neighbors=5):
+        super().__init__(input_width)
+        cascade_path = cascade_path or os.path.join(cv2.data.haarcascades, 'haarcascade_frontalface_default.xml')
+        self.face_cascade = cv2.CascadeClassifier(cascade_path)
+        if self.face_cascade.empty():
+            raise FileNotFoundError(f'Haar cascade not found: {cascade_path}')
+        self.min_neighbors = min_neighbors
+
+    def detect(self, image_rgb):
+        small_image, scale = self.downscale(image_rgb)
+        gray_image = self.buffer_pool.get('detector_gray', small_image.shape[:2])
+        cv2.cvtColor(small_image, cv2.COLOR_RGB2GRAY, dst=gray_image)
+
+        min_size = max(24, small_image.shape[1] // 10)
+        boxes = self.face_cascade.detectMultiScale(
+            gray_image, scaleFactor=1.1, minNeighbors=self.min_neighbors, minSize=(min_size, min_size)
+        )
+        return [
+            DetectedFace(int(x / scale), int(y / scale), int(w / scale), int(h / scale))
+            for (x, y, w, h) in boxes
+        ]
+
+
+class StubFaceDetector(FaceDetector):
+    """
+    No detection at all, reports a fixed face in the middle of the frame (or none).
+    For stations where the device's own detection is enough, and for headless testing.
+    """
+    name = FACE_DETECTOR_STUB
+
+    def __init__(self, face_present=True):
+        self.face_present = face_present
+
+    def detect(self, image_rgb):
+        if not self.face_present:
+            return []
+        image_height, image_width = image_rgb.shape[:2]
+        w = image_width // 2
+        h = int(w * 1.25)
+        return [DetectedFace((image_width - w) // 2, (image_height - h) // 2, w, h)]
+
+
+def create_face_detector(config):
+    """
+    Face detector backend selected by face_detector_backend in the app config.
+    Falls back to MediaPipe if the selected backend cannot be created.
+    """
+    backend = config.face_detector_backend or FACE_DETECTOR_MEDIAPIPE
+    min_confidence = config.face_detector_min_confidence or 0.5
+    input_width = config.face_detector_input_width or 320
+
+    try:
+        if backend == FACE_DETECTOR_YUNET:
+            face_detector = YuNetFaceDetector(config.face_detector_yunet_model_path, min_confidence, input_width)
+        elif backend == FACE_DETECTOR_HAAR:
+            face_detector = HaarFaceDetector(input_width=input_width)
+        elif backend == FACE_DETECTOR_STUB:
+            face_detector = StubFaceDetector()
+        else:
+            face_detector = MediaPipeFaceDetector(min_confidence)
+    except Exception as e:
+        LOGGER.error(f'Unable to create "{backend}" face detector, falling back to MediaPipe: {e}')
+        face_detector = MediaPipeFaceDetector(min_confidence)
+
+    LOGGER.info(f'Face detector backend: {face_detector.name}')
+    return face_detector
+
+
+def benchmark_face_detector(face_detector, frames, reference_results=None):
+    """
+    Run a detector over RGB frames.
+    :return: dict of latency and CPU figures, per-frame results, and agreement with the reference results if given
+    """
+    import psutil
+
+    process = psutil.Process()
+    latencies_ms = []
+    results = []
+
+    cpu_start = sum(process.cpu_times()[:2])
+    wall_start = time.perf_counter()
+    for frame in frames:
+        start_time = time.perf_counter()
+        results.append(face_detector.detect(frame))
+        latencies_ms.append((time.perf_counter() - start_time) * 1000)
+    wall_seconds = time.perf_counter() - wall_start
+    cpu_seconds = sum(process.cpu_times()[:2]) - cpu_start
+
+    report = {
+        "backend": face_detector.name,
+        "frames": len(latencies_ms),
+        "mean_ms": float(np.mean(latencies_ms)),
+        "p95_ms": float(np.percentile(latencies_ms, 95)),
+        # Percent of one core, can exceed 100 for backends that use several threads
+        "cpu_percent": 100.0 * cpu_seconds / wall_seconds if wall_seconds > 0 else 0.0,
+        "results": results
+    }
+
+    if reference_results is not None:
+        # Face present/absent agreement per frame, and how well the boxes line up when both found one
+        presence_agreement = [bool(result) == bool(reference) for result, reference in zip(results, reference_results)]
+        ious = [
+            max(face.iou(reference[0]) for face in result)
+            for result, reference in zip(results, reference_results) if result and reference
+        ]
+        report["agreement_percent"] = 100.0 * float(np.mean(presence_agreement))
+        report["mean_iou"] = float(np.mean(ious)) if ious else 0.0
+
+    return report
+
+
+def main():
+    from src.processor.frame_source import FileFrameSource
+
+    parser = argparse.ArgumentParser(description='Compare face detector backends on a recorded frame set')
+    parser.add_argument('recording', help='recording made with frame_source.py record')
+    parser.add_argument('--backends', nargs='+', default=[FACE_DETECTOR_YUNET, FACE_DETECTOR_HAAR, FACE_DETECTOR_STUB],
+                        help='backends compared against MediaPipe, which always runs first as the reference')
+    parser.add_argument('--min-confidence', type=float, default=0.5)
+    parser.add_argument('--yunet-model', default='./model/face_detection_yunet_2022mar.onnx')
+    parser.add_argument('--input-width', type=int, default=320)
+    args = parser.parse_args()
+
+    # The backend classes are built directly, not through create_face_detector(): its fallback to MediaPipe would
+    # time MediaPipe under the label of a backend that failed to load
+    backend_factories = {
+        FACE_DETECTOR_MEDIAPIPE: lambda: MediaPipeFaceDetector(args.min_confidence),
+        FACE_DETECTOR_YUNET: lambda: YuNetFaceDetector(args.yunet_model, args.min_confidence, args.input_width),
+        FACE_DETECTOR_HAAR: lambda: HaarFaceDetector(input_width=args.input_width),
+        FACE_DETECTOR_STUB: lambda: StubFaceDetector()
+    }
+    unknown_backends = [backend for backend in args.backends if backend not in backend_factories]
+    if unknown_backends:
+        parser.error(f'unknown backends {unknown_backends}, choose from {list(backend_factories)}')
+    # MediaPipe is the reference the other backends are compared against, so it runs first whatever the order given
+    backends = [FACE_DETECTOR_MEDIAPIPE] + [backend for backend in args.backends if backend != FACE_DETECTOR_MEDIAPIPE]
+
+    # Frames are decoded once up front so decoding does not count towards detection time
+    frames = [cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) for frame in FileFrameSource(args.recording).iter_frames()]
+
+    reference_results = None
+    for backend in backends:
+        try:
+            face_detector = backend_factories[backend]()
+        except Exception as e:
+            print(f'FAIL, unable to create the "{backend}" face detector: {e}')
+            sys.exit(1)
+        report = benchmark_face_detector(face_detector, frames, reference_results)
+        face_detector.close()
+
+        if reference_results is None:
+            reference_results = report["results"]
+
+        agreement = ' (reference)'
+        if "agreement_percent" in report:
+            agreement = f', agreement {report["agreement_percent"]:.1f}%, mean IoU {report["mean_iou"]:.2f}'
+        print(
+            f'{backend:>10}: {report["mean_ms"]:.2f} ms/frame (p95 {report["p95_ms"]:.2f}), '
+            f'CPU {report["cpu_percent"]:.0f}%{agreement}'
+        )
+
+
+if __name__ == '__main__':
+    main()
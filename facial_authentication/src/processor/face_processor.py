@@ -6,12 +6,25 @@ import json
 import queue
 import requests
 
-import rsid_py
+from src.processor.rsid_backend import rsid_py
 from src.processor.face_detection_status import FaceDetectionStatus
 from src.processor.face_detection_msg import FaceDetectionMessage
 from src.network_comms.database_handler import DatabaseHandler
 # from src.processor.gesture_processor import GestureProcessor
 import src.logger.custom_logger as custom_logger
+from src.utility import pipeline_metrics
+from src.processor import face_tracker as face_tracker_module
+from src.processor.feed_channel import get_feed_channel, FACE_FEED, GESTURE_FEED
+from src.processor.device_session import DeviceSession, DeviceSessionError, SERIAL_ERRORS
+from src.processor.auth_state_machine import AuthenticationFlow, AuthResult
+from src.processor.gallery import get_gallery
+from src.processor.match_pipeline import get_matcher_pool
+from src.processor.enrolment_selection import select_enrolment_capture
+from src.processor.device_config_manager import get_device_config_manager, get_port_serial_number
+from src.processor.command_scheduler import (
+    CommandScheduler, AuthenticateCommand, EnrolCommand, QuitCommand, RemoveAllUsersCommand, ResyncCommand,
+    PRIORITY_ENROL
+)
 
 LOGGER = custom_logger.get_logger()
 
@@ -27,18 +40,20 @@ class FaceProcessor(threading.Thread):
     def __init__(
             self, parent, cmd_request_q, ready_status_q, feedback_msg_q,
             not_used_q, feedback_livestream_detections_q, config, processor_mode,
-            socket_handler=None
+            socket_handler=None, face_tracker=None
     ):
         LOGGER.info("FaceProcessor init...")
         super().__init__()
 
         self.parent = parent
 
-        self.DB_FACEPRINTS = None
+        # Enrolled faceprints, one copy shared by the face processors of every camera
+        self.gallery = get_gallery()
         self.init_processor_mode(processor_mode)
         
-        self.START_DELAY = 5
+        self.START_DELAY = config.auth_startup_delay_seconds if config.auth_startup_delay_seconds is not None else 5
         self.START_COUNTDOWN = 1
+        self.START_COUNTDOWN_SECONDS = config.auth_startup_countdown_seconds if config.auth_startup_countdown_seconds is not None else 5
 
         # Responsibility: configuration class
         self.PORT = config.PORT
@@ -56,7 +71,8 @@ class FaceProcessor(threading.Thread):
 
         self.ETC_IN = 1
         self.ETC_OUT = 2
-        self.ETC_STATUS = self.ETC_OUT
+        # Attendance direction reported for this camera, e.g. one camera at the entrance and one at the exit
+        self.ETC_STATUS = self.ETC_IN if config.etc_direction == 'in' else self.ETC_OUT
         
         self.feedback_gesture = None
 
@@ -65,18 +81,81 @@ class FaceProcessor(threading.Thread):
         self.resync_date = ""
 
         self.cmd_exec = {
-            'resync': self.resync,
-            'authenticate': self.face_authenticate,
-            'enrol': self.face_enroll,
-            'd': self.remove_all_users,
-            'quit': self.exit_app,
+            ResyncCommand: lambda command: self.resync(),
+            AuthenticateCommand: lambda command: self.face_authenticate(),
+            EnrolCommand: lambda command: self.face_enroll(command.employee_id),
+            RemoveAllUsersCommand: lambda command: self.remove_all_users(),
+            QuitCommand: lambda command: self.exit_app(),
             # 'authenticate_with_gesture': self.face_authenticate_with_gesture
         }
+        # Commands whose result stays on screen before the ready state comes back. The ready state is set on a timer,
+        # so a command waiting behind them, e.g. the authentication they preempted, starts at once
+        self.RESULT_DISPLAY_COMMANDS = (EnrolCommand, RemoveAllUsersCommand)
+        self.RESULT_DISPLAY_SECONDS = 2.5
+        self.ready_state_timer = None
+        self.ready_state_lock = threading.Lock()
+        # Commands requested on cmd_request_q, run by priority. The authentication loop gives way to the others
+        self.command_scheduler = CommandScheduler(cmd_request_q, on_preempt=self.on_command_preempt)
 
         self.socket_handler = socket_handler
 
+        # Faces tracked across frames by the image processor, an accepted face is not re-authenticated until it
+        # leaves the frame
+        self.face_tracker = face_tracker
+        if self.face_tracker is None and self.config.face_tracker_enabled:
+            self.face_tracker = face_tracker_module.get_tracker(self.config)
+        # Track ID of the face being authenticated, and of the faces extracted and waiting for their result
+        self.auth_track_id = None
+        self.pending_track_ids = set()
+
+        # One serial session with the device for every command, reopened if the link drops
+        self.device_session = DeviceSession(
+            self.PORT, get_device_config_manager(config),
+            reconnect_initial_delay=config.device_reconnect_initial_delay or 0.5,
+            reconnect_max_delay=config.device_reconnect_max_delay or 10.0,
+            max_connect_attempts=config.device_max_connect_attempts or 10,
+            connect_timeout=config.device_connect_timeout or 30.0
+        )
+
+        # Face presence and gesture published by the image processor frame pipeline
+        self.face_feed = get_feed_channel(FACE_FEED, config.camera_id)
+        self.gesture_feed = get_feed_channel(GESTURE_FEED, config.camera_id)
+
+        # Authentication paced by events and configurable result display and cooldown durations
+        self.auth_flow = AuthenticationFlow(
+            self.is_face_present, self.extract_for_auth, self.match_auth_result,
+            self.show_auth_result, self.clear_auth_result,
+            is_already_authenticated=self.is_tracked_face_authenticated,
+            display_seconds=config.auth_result_display_seconds if config.auth_result_display_seconds is not None else 1.0,
+            cooldown_seconds=config.auth_cooldown_seconds if config.auth_cooldown_seconds is not None else 0.3,
+            on_tick=self.check_daily_resync,
+            max_pending_matches=config.auth_pipeline_max_pending or 0,
+            matcher_workers=config.auth_pipeline_matcher_workers or 1,
+            min_display_seconds=config.auth_result_min_display_seconds if config.auth_result_min_display_seconds is not None else 0.5,
+            cancel_extraction=self.device_session.cancel,
+            extraction_deadline_seconds=config.auth_extraction_deadline_seconds,
+            is_attempt_face_present=self.is_auth_face_present,
+            # Matcher threads shared by the cameras, matching against the one gallery
+            matcher_pool=get_matcher_pool(config.auth_pipeline_matcher_workers or 1)
+        )
+        self.face_feed.subscribe(self.auth_flow.on_face_feed)
+        self.gesture_feed.subscribe(self.on_gesture_feed)
+
         self.summarized_face_processor_feedback = []
 
+        # Authentication metrics
+        self.metrics = pipeline_metrics.get_registry()
+        self.auth_attempt_histogram = self.metrics.histogram('auth_attempt_ms', 'Duration of an authentication attempt, device extraction included')
+        self.gallery_match_histogram = self.metrics.histogram('gallery_match_ms', 'Time spent matching a faceprint against the gallery')
+        self.auth_accepted_counter = self.metrics.counter('auth_accepted', 'Authentications matched to an employee')
+        self.auth_rejected_counter = self.metrics.counter('auth_rejected', 'Authentications rejected by the device (spoof, pose, no face)')
+        self.auth_no_match_counter = self.metrics.counter('auth_no_match', 'Valid faces without a matching employee')
+        self.auth_match_error_counter = self.metrics.counter('auth_match_errors', 'Authentications whose matching failed, retried')
+        self.auth_skipped_counter = self.metrics.counter('auth_skipped_tracked', 'Authentications skipped as the tracked face was already accepted')
+        self.enrol_histogram = self.metrics.histogram('enrol_ms', 'Duration of an enrolment, captures and selection included')
+        self.enrol_selection_histogram = self.metrics.histogram('enrol_selection_ms', 'Time spent choosing the best enrolment capture')
+        self.enrol_duplicate_counter = self.metrics.counter('enrol_duplicates', 'Enrolments refused as the face is enrolled under another employee')
+
         LOGGER.info("FaceProcessor init complete.")
 
     def init_processor_mode(self, processor_mode):
@@ -85,24 +164,27 @@ class FaceProcessor(threading.Thread):
             self.parent.exit()
 
         if processor_mode == FaceProcessor.MODE_AUTHENTICATION:
-            self.DB_FACEPRINTS = self.get_faceprint_records_from_remote_db()
+            # Loaded once for all the cameras starting together
+            self.gallery.load(self.get_faceprint_records_from_remote_db)
         else:
             if not DatabaseHandler.is_ailanthus_alive():
                 LOGGER.error(f'Unable to establish connection to Ailanthus server')
                 self.parent.exit()
 
     def run(self):
-        
+        # Commands requested during the startup countdown are queued by priority
+        self.command_scheduler.start()
         # self.send_feedback_msg(f'Warning: Please step back ⌛', FaceDetectionStatus.REJECTED)
         # time.sleep(self.START_DELAY)
         # Initial warning message
         self.send_feedback_msg("Warning: Please step back ⏳", FaceDetectionStatus.REJECTED)
         time.sleep(self.START_DELAY)
-        self.send_feedback_msg("Face Authentication Begins in 5 Seconds", FaceDetectionStatus.REJECTED)
-        time.sleep(2)
+        countdown_seconds = self.START_COUNTDOWN_SECONDS
+        if countdown_seconds:
+            self.send_feedback_msg(f"Face Authentication Begins in {countdown_seconds} Seconds", FaceDetectionStatus.REJECTED)
+            time.sleep(2)
  
         # Countdown timer with feedback messages
-        countdown_seconds = 5
         for seconds_left in range(countdown_seconds, 0, -1):
  
             status = FaceDetectionStatus.ACCEPTED
@@ -118,8 +200,11 @@ class FaceProcessor(threading.Thread):
         self.init_ready_state(0)
         LOGGER.info("Test starting now") 
         while True:
-            self.poll_cmd_request_q()
-            self.init_ready_state()
+            command = self.poll_cmd_request_q()
+            if isinstance(command, self.RESULT_DISPLAY_COMMANDS):
+                self.schedule_ready_state(self.RESULT_DISPLAY_SECONDS)
+            else:
+                self.init_ready_state(0)
             
     
     def time_difference(first_entry,repeat_entry):
@@ -141,37 +226,25 @@ class FaceProcessor(threading.Thread):
         return td_seconds
 
     @staticmethod
-    def set_device_config(face_authenticator, custom_device_config=None):
+    def set_device_config(face_authenticator, custom_device_config=None, serial_number=None):
         """
-        Setup device config before enrolment/authentication takes place.
+        Setup device config before enrolment/authentication takes place, skipped if the device already runs it.
         :param str face_authenticator: current face authenticator to be configured used for the enrolment/authentication process
         :param str custom_device_config: set to True to make custom config take effect
+        :param str serial_number: serial number of the device, the config last applied on it is cached under it
         """
         # Available config:
         # https://github.com/IntelRealSense/RealSenseID/blob/master/wrappers/python/face_auth_py.cc#L397-L415
         # Config types and explanation:
         # https://github.com/IntelRealSense/RealSenseID#device-configuration-api
-        if custom_device_config:
-            LOGGER.face_rec("Device config to be used: custom")
-            new_device_config = rsid_py.DeviceConfig()
-
-            # Modify the custom config to your liking below
-            new_device_config.camera_rotation = rsid_py.CameraRotation.Rotation_180_Deg
-            new_device_config.security_level = rsid_py.SecurityLevel.High
-            new_device_config.algo_flow = rsid_py.AlgoFlow.All
-            new_device_config.face_selection_policy = rsid_py.FaceSelectionPolicy.All
-            face_authenticator.set_device_config(new_device_config)
-            device_config = face_authenticator.query_device_config()
-        else:
-            LOGGER.face_rec("Device config to be used: default")
-            new_device_config = rsid_py.DeviceConfig()
-            new_device_config.camera_rotation = rsid_py.CameraRotation.Rotation_0_Deg
-            new_device_config.security_level = rsid_py.SecurityLevel.Medium
-            new_device_config.algo_flow = rsid_py.AlgoFlow.All
-            new_device_config.face_selection_policy = rsid_py.FaceSelectionPolicy.Single
-            face_authenticator.set_device_config(new_device_config)
-            device_config = face_authenticator.query_device_config()
-        LOGGER.face_rec(f"Final device config preview: {device_config}")
+        # Profiles are in device_config_manager.py, the default one can be changed with device_config in the app config
+        profile = 'custom' if custom_device_config else 'default'
+        LOGGER.face_rec(f"Device config to be used: {profile}")
+        get_device_config_manager().apply(face_authenticator, serial_number, profile)
+
+    @property
+    def DB_FACEPRINTS(self):
+        return self.gallery.faceprints
 
     def get_faceprint_records_from_remote_db(self):
         try:
@@ -248,22 +321,9 @@ class FaceProcessor(threading.Thread):
     # authenticator:
     # https://github.com/IntelRealSense/RealSenseID/blob/master/wrappers/python/face_auth_py.cc#L593
 
-    def on_fp_auth_result(self, face_auth_status, detection_faceprint, authenticator):
-        auth_status_msg_str = str(face_auth_status)
-        auth_status_msg = FaceDetectionMessage.cleanup_msg(auth_status_msg_str)
-        LOGGER.face_rec(f'Final results concluded for detected Face: {"Ok" if "Success" in auth_status_msg_str else "Not Ok"} ---> {auth_status_msg_str}')
-
-        # If face detected is an invalid face (spoofing, face too tilted, no face, error), no relation to matched auth!
-        #   1. Update status bar
-        #   2. Set determination status for detection box color
-        if face_auth_status != rsid_py.AuthenticateStatus.Success:
-            LOGGER.face_rec(f'Forbidden: {auth_status_msg}')
-            # self.send_feedback_msg(f'Forbidden: {auth_status_msg}', FaceDetectionStatus.REJECTED)
-            self.send_feedback_livestream_faces_processed(FaceDetectionStatus.REJECTED)
-            time.sleep(1)
-            self.send_feedback_msg(f'Ready')
-            return
-
+    def match_faceprint(self, authenticator, result):
+        """Match the extracted faceprint against the gallery, the best match above the threshold is kept"""
+        match_start_time = time.perf_counter()
         max_score = -100
         selected_user = None
         # Match auth logic begin
@@ -274,7 +334,7 @@ class FaceProcessor(threading.Thread):
                 updated_faceprints = rsid_py.Faceprints()
 
                 # Perform matching on detection faceprint against record faceprint
-                match_result = authenticator.match_faceprints(detection_faceprint, faceprint, updated_faceprints)
+                match_result = authenticator.match_faceprints(result.faceprint, faceprint, updated_faceprints)
                 LOGGER.face_rec(f'Comparison with {employee_id}: score={match_result.score}')
 
                 # If current match is success
@@ -286,25 +346,72 @@ class FaceProcessor(threading.Thread):
                             # Update and keep track of the highest matched score thus far
                             max_score = match_result.score
                             selected_user = employee_id
+        self.gallery_match_histogram.observe_since(match_start_time)
+
+        result.employee_id = selected_user
+        result.score = max_score if selected_user is not None else None
+        return result
+
+    def match_auth_result(self, result):
+        if not self.DB_FACEPRINTS:
+            return result
+        # Matching runs on the host, it does not wait for the extraction of the next person
+        return self.device_session.run_host_side(lambda authenticator: self.match_faceprint(authenticator, result), 'matching')
+
+    def show_auth_result(self, result):
+        auth_status_msg_str = str(result.device_status)
+        auth_status_msg = FaceDetectionMessage.cleanup_msg(auth_status_msg_str)
+        LOGGER.face_rec(f'Final results concluded for detected Face: {"Ok" if "Success" in auth_status_msg_str else "Not Ok"} ---> {auth_status_msg_str}')
+        self.pending_track_ids.discard(result.track_id)
+
+        if result.error is not None:
+            # Matching could not be done, the face is left untracked for another attempt
+            LOGGER.face_rec(f'Matching failed, retrying: {result.error}')
+            self.auth_match_error_counter.inc()
+            self.send_feedback_msg('Device unreachable, please try again', FaceDetectionStatus.REJECTED)
+            return
 
-        if selected_user is not None:
-            LOGGER.face_rec(f'Success, Matched user: "{selected_user}", Score: {max_score}')
-            self.send_feedback_msg( f'{selected_user}', FaceDetectionStatus.ACCEPTED)
-            time.sleep(1)  
-            # , Gesture:{self.feedback_gesture}', FaceDetectionStatus.ACCEPTED)
-            self.send_feedback_msg(f'Ready')
+        # If face detected is an invalid face (spoofing, face too tilted, no face, error), no relation to matched auth!
+        #   1. Update status bar
+        #   2. Set determination status for detection box color
+        if not result.device_success:
+            LOGGER.face_rec(f'Forbidden: {auth_status_msg}')
+            if 'SerialError' in auth_status_msg_str:
+                self.device_session.invalidate()
+            # self.send_feedback_msg(f'Forbidden: {auth_status_msg}', FaceDetectionStatus.REJECTED)
+            self.auth_rejected_counter.inc()
+            self.set_auth_track_result(result.track_id, FaceDetectionStatus.REJECTED)
+            self.send_feedback_livestream_faces_processed(FaceDetectionStatus.REJECTED)
+            return
+
+        if not self.DB_FACEPRINTS:
+            LOGGER.face_rec('No faceprints detected in sys. Pls Enroll an employee or Resync')
+            self.send_feedback_msg("No faceprints in sys. Pls Enroll an employee or Resync", FaceDetectionStatus.REJECTED)
+            return
+
+        if result.employee_id is not None:
+            self.auth_accepted_counter.inc()
+            self.set_auth_track_result(result.track_id, FaceDetectionStatus.ACCEPTED, result.employee_id)
+            LOGGER.face_rec(f'Success, Matched user: "{result.employee_id}", Score: {result.score}')
+            self.send_feedback_msg(f'{result.employee_id}', FaceDetectionStatus.ACCEPTED)
             self.send_feedback_livestream_faces_processed(FaceDetectionStatus.ACCEPTED)
             if self.socket_handler is not None:
                 #Edit ETC in or out here
-                self.socket_handler.broadcast_to_clients(selected_user, self.ETC_STATUS)
+                self.socket_handler.broadcast_to_clients(result.employee_id, self.ETC_STATUS)
         else:
             LOGGER.face_rec(f'Forbidden: No matching user found')
+            self.auth_no_match_counter.inc()
+            self.set_auth_track_result(result.track_id, FaceDetectionStatus.REJECTED)
             self.send_feedback_msg(
                 f'#8: Forbidden: No matching user found', FaceDetectionStatus.REJECTED
             )
             self.send_feedback_livestream_faces_processed(FaceDetectionStatus.REJECTED)
-            time.sleep(1)
-            self.send_feedback_msg(f'Ready')
+
+    def clear_auth_result(self, result):
+        # Result display is over, the detection border is removed and the status bar goes back to ready
+        self.livestream_detections = []
+        self.feedback_livestream_detections_q.put(self.livestream_detections)
+        self.send_feedback_msg(f'Ready')
 
     # def face_authenticate(self):
         
@@ -374,50 +481,93 @@ class FaceProcessor(threading.Thread):
 
     def face_authenticate(self):
         LOGGER.face_rec('Waiting for face detection...')
-        with rsid_py.FaceAuthenticator(self.PORT) as authenticator:
-            FaceProcessor.set_device_config(authenticator)
-            
-            def on_result(face_auth_status, detection_faceprint):
-                if detection_faceprint is not None:
-                    LOGGER.face_rec('Face detected. Authentication triggered')
-                    if len(self.DB_FACEPRINTS) == 0:
-                        LOGGER.face_rec('No faceprints detected in sys. Pls Enroll an employee or Resync')
-                        self.send_feedback_msg("No faceprints in sys. Pls Enroll an employee or Resync", FaceDetectionStatus.REJECTED)
-                    else:
-                        self.ready_status_q.put(False)
-                        LOGGER.face_rec('Authenticating..')
-                        self.send_feedback_msg("Authenticating..")
-                        self.perform_authentication(authenticator, face_auth_status, detection_faceprint)
-
-            def on_hint(hint):
-                self.on_hint(hint)
-
-            def on_faces(faces, timestamp):
-                self.on_faces(faces, timestamp)
-
-            while True:
-                if datetime.now().hour == 16 and datetime.now().minute == 10 and str(date.today()) != self.resync_date:
-                    self.resync_date = str(date.today())
-                    # LOGGER.info("Test started") 
-                    self.resync()
-                get_feedback_gesture = open('./write/feed_fd_temp.txt', 'r')
-                self.feedback_gesture = get_feedback_gesture.readline().strip()
-                get_feedback_gesture.close()
-
-                if self.feedback_gesture in ['True', '2']:
-                    LOGGER.face_rec(f'{"Face" if self.feedback_gesture == "True" else "Gesture"} Detected: "{self.feedback_gesture}"')
-                    self.summarized_face_processor_feedback.clear()
-                    authenticator.extract_faceprints_for_auth(
-                        on_result=on_result,
-                        on_hint=on_hint,
-                        on_faces=on_faces
-                    )
-                time.sleep(0.5)
-
-    def perform_authentication(self, authenticator, face_auth_status, detection_faceprint):
-        self.on_fp_auth_result(face_auth_status, detection_faceprint, authenticator)
-        time.sleep(0.5)
-        self.livestream_detections.clear()
+        self.auth_flow.run(should_yield=self.command_scheduler.has_preempting_command)
+        # Preempted by a higher priority command, authentication resumes once it is done
+        self.command_scheduler.put(AuthenticateCommand())
+
+    def on_command_preempt(self, command):
+        # Runs on the command feeder thread. Commands using the device do not wait for the extraction in progress
+        LOGGER.info(f'Command {command} preempts the authentication')
+        self.auth_flow.request_yield(cancel_attempt=command.priority <= PRIORITY_ENROL)
+
+    def is_face_present(self):
+        self.feedback_gesture = self.gesture_feed.get()
+        return bool(self.face_feed.get()) or self.feedback_gesture == 2
+
+    def is_auth_face_present(self):
+        # The tracker tells the face being authenticated apart from the next person stepping in
+        if self.face_tracker is not None and self.auth_track_id is not None:
+            return self.face_tracker.is_tracked(self.auth_track_id)
+        return self.is_face_present()
+
+    def on_gesture_feed(self, gesture):
+        # A V-sign triggers an authentication like a face does
+        if gesture == 2:
+            self.auth_flow.on_face_feed(True)
+
+    def check_daily_resync(self):
+        if datetime.now().hour == 16 and datetime.now().minute == 10 and str(date.today()) != self.resync_date:
+            self.resync_date = str(date.today())
+            # LOGGER.info("Test started") 
+            # Every camera gets here at the same minute, the gallery is only fetched by the first one
+            self.gallery.load(self.get_faceprint_records_from_remote_db)
+
+    def extract_for_auth(self, on_extracted):
+        def on_result(face_auth_status, detection_faceprint):
+            if detection_faceprint is not None:
+                LOGGER.face_rec('Face detected. Authentication triggered')
+                self.ready_status_q.put(False)
+                LOGGER.face_rec('Authenticating..')
+                self.send_feedback_msg("Authenticating..")
+            result = AuthResult(
+                face_auth_status, detection_faceprint, face_auth_status == rsid_py.AuthenticateStatus.Success
+            )
+            result.track_id = self.auth_track_id
+            if detection_faceprint is not None and result.track_id is not None:
+                self.pending_track_ids.add(result.track_id)
+            on_extracted(result)
+
+        LOGGER.face_rec(f'{"Gesture" if self.feedback_gesture == 2 else "Face"} Detected: "{self.feedback_gesture}"')
+        self.summarized_face_processor_feedback.clear()
+        extraction_start_time = time.perf_counter()
+        try:
+            self.device_session.execute(
+                lambda authenticator: authenticator.extract_faceprints_for_auth(
+                    on_result=on_result,
+                    on_hint=self.on_hint,
+                    on_faces=self.on_faces
+                ),
+                'authentication'
+            )
+        except DeviceSessionError as e:
+            # The next attempt tries to connect again
+            self.on_device_unreachable(e)
+            return
+        self.auth_attempt_histogram.observe_since(extraction_start_time)
+
+    def is_tracked_face_authenticated(self):
+        """
+        Check the face in front of the camera against the tracker, remembering its track ID for the attempt.
+        :return: True if the face was already accepted and is still in the frame, or is waiting for its result
+        """
+        if self.face_tracker is None:
+            return False
+
+        track = self.face_tracker.get_primary_track()
+        self.auth_track_id = track.track_id if track is not None else None
+        if track is not None and track.track_id in self.pending_track_ids:
+            LOGGER.debug(f'Skipping authentication, tracked face waiting for its result: {track}')
+            return True
+        if track is not None and self.face_tracker.is_authenticated(track.track_id):
+            LOGGER.debug(f'Skipping authentication, tracked face already accepted: {track}')
+            self.auth_skipped_counter.inc()
+            return True
+        return False
+
+    def set_auth_track_result(self, track_id, status, employee_id=None):
+        # The result of a pipelined attempt may come after the next attempt started, hence the track ID of the result
+        if self.face_tracker is not None and track_id is not None:
+            self.face_tracker.set_track_result(track_id, status, employee_id)
 
     # face_auth_status:
     # https://github.com/IntelRealSense/RealSenseID/blob/master/wrappers/python/face_auth_py.cc#L346
@@ -432,6 +582,8 @@ class FaceProcessor(threading.Thread):
         #   1. Set determination status for detection box color
         if face_auth_status != rsid_py.EnrollStatus.Success:
             LOGGER.face_rec(f'{enroll_status_msg}')
+            if 'SerialError' in enroll_status_msg_str:
+                self.device_session.invalidate()
             self.send_feedback_msg(enroll_status_msg, FaceDetectionStatus.REJECTED)
             self.send_feedback_livestream_faces_processed(FaceDetectionStatus.REJECTED)
             return
@@ -464,27 +616,96 @@ class FaceProcessor(threading.Thread):
     def face_enroll(self, user_id=f'user_{int(time.time() / 1000)}'):
         LOGGER.face_rec('Face enrolment triggered')
         self.summarized_face_processor_feedback.clear()
-        with rsid_py.FaceAuthenticator(self.PORT) as authenticator:
-            FaceProcessor.set_device_config(authenticator)
-            self.ready_status_q.put(False)
-            LOGGER.face_rec(f'Enrolling...')
-            self.send_feedback_msg("Enrolling...")
-            authenticator.extract_faceprints_for_enroll(
-                on_result=
-                lambda face_auth_status, detection_faceprint:
-                self.on_fp_enroll_result(face_auth_status, detection_faceprint, user_id),
-                on_progress=self.on_progress,
-                on_hint=self.on_hint,
-                on_faces=self.on_faces
+        self.ready_status_q.put(False)
+        LOGGER.face_rec(f'Enrolling...')
+        self.send_feedback_msg("Enrolling...")
+        enrol_start_time = time.perf_counter()
+        if (self.config.enroll_best_out_of or 1) > 1:
+            self.face_enroll_best_of(user_id, self.config.enroll_best_out_of)
+        else:
+            self.device_session.execute(
+                lambda authenticator: authenticator.extract_faceprints_for_enroll(
+                    on_result=
+                    lambda face_auth_status, detection_faceprint:
+                    self.on_fp_enroll_result(face_auth_status, detection_faceprint, user_id),
+                    on_progress=self.on_progress,
+                    on_hint=self.on_hint,
+                    on_faces=self.on_faces
+                ),
+                'enrolment', retry=False
             )
+        self.enrol_histogram.observe_since(enrol_start_time)
+
+    def face_enroll_best_of(self, employee_id, best_of):
+        """
+        Enrol the best of several captures. Captures are scored against each other and against the gallery on the host,
+        so the only device round trips are the captures themselves.
+        """
+        captures = []
+        attempts = 0
+        # Failed captures (face not frontal, too far) are retried, up to as many again
+        while len(captures) < best_of and attempts < best_of * 2:
+            attempts += 1
+            self.send_feedback_msg(f"Enrolling... {len(captures) + 1}/{best_of}")
+            outcome = {}
+            self.device_session.execute(
+                lambda authenticator: authenticator.extract_faceprints_for_enroll(
+                    on_result=
+                    lambda face_auth_status, detection_faceprint:
+                    outcome.update(status=face_auth_status, faceprint=detection_faceprint),
+                    on_progress=self.on_progress,
+                    on_hint=self.on_hint,
+                    on_faces=self.on_faces
+                ),
+                'enrolment', retry=False
+            )
+            if outcome.get("status") == rsid_py.EnrollStatus.Success:
+                captures.append(outcome["faceprint"])
+            elif "status" in outcome:
+                # Reported like a failed single capture enrolment, nothing is saved
+                self.on_fp_enroll_result(outcome["status"], None, employee_id)
+
+        if not captures:
+            LOGGER.face_rec(f'Enrolment of {employee_id} failed, no successful capture')
+            return
+
+        selection_start_time = time.perf_counter()
+        gallery_employee_ids, gallery_features = self.gallery.get_features()
+        selection = select_enrolment_capture(
+            [capture.features for capture in captures], gallery_employee_ids, gallery_features, employee_id
+        )
+        self.enrol_selection_histogram.observe_since(selection_start_time)
+        LOGGER.face_rec(f'Enrolment captures of {employee_id}: {selection}')
+
+        duplicate_similarity = self.config.enroll_duplicate_similarity
+        if duplicate_similarity is not None and selection.gallery_similarity is not None and \
+                selection.gallery_similarity >= duplicate_similarity:
+            self.enrol_duplicate_counter.inc()
+            LOGGER.face_rec(f'Enrolment refused, face already enrolled as {selection.gallery_employee_id}')
+            self.send_feedback_msg(
+                f'Already enrolled as {selection.gallery_employee_id}', FaceDetectionStatus.REJECTED
+            )
+            self.send_feedback_livestream_faces_processed(FaceDetectionStatus.REJECTED)
+            return
+
+        min_consistency = self.config.enroll_min_consistency
+        if min_consistency is not None and len(captures) > 1 and selection.best_consistency < min_consistency:
+            # Captures of different people, or all of them poor
+            LOGGER.face_rec(f'Enrolment refused, captures do not match each other: {selection.best_consistency:.3f}')
+            self.send_feedback_msg('Captures do not match, please enrol again', FaceDetectionStatus.REJECTED)
+            self.send_feedback_livestream_faces_processed(FaceDetectionStatus.REJECTED)
+            return
+
+        self.on_fp_enroll_result(rsid_py.EnrollStatus.Success, captures[selection.best_index], employee_id)
 
     def remove_all_users(self):
-        with rsid_py.FaceAuthenticator(self.PORT) as f:
-            LOGGER.face_rec(f'Remove...')
-            self.send_feedback_msg("Remove..")
-            f.remove_all_users()
-            LOGGER.face_rec(f'Remove Success')
-            self.send_feedback_msg("Remove Success")
+        LOGGER.face_rec(f'Remove...')
+        self.send_feedback_msg("Remove..")
+        self.device_session.execute(
+            lambda authenticator: authenticator.remove_all_users(), 'remove all users', retry=False
+        )
+        LOGGER.face_rec(f'Remove Success')
+        self.send_feedback_msg("Remove Success")
 
     def on_progress(self, p):
         LOGGER.face_rec(f'on_progress() - p: {p}')
@@ -524,12 +745,13 @@ class FaceProcessor(threading.Thread):
 
     def exit_app(self):
         LOGGER.info(f'Application exiting...')
+        self.device_session.disconnect()
         self.send_feedback_msg('Bye.. :)')
         time.sleep(0.4)
         os._exit(0)
 
     def resync(self):
-        self.DB_FACEPRINTS = self.get_faceprint_records_from_remote_db()
+        self.gallery.load(self.get_faceprint_records_from_remote_db, force=True)
 
     def init_ready_state(self, delay=2.5):
         LOGGER.face_rec(f"Init-ing ready state in: {delay} seconds")
@@ -555,29 +777,50 @@ class FaceProcessor(threading.Thread):
         
         LOGGER.debug(f'summarized_face_processor_feedback: {self.summarized_face_processor_feedback}')
 
+    def schedule_ready_state(self, delay):
+        # The result of the command stays on screen for delay seconds, without holding up the command thread
+        with self.ready_state_lock:
+            if self.ready_state_timer is not None:
+                self.ready_state_timer.cancel()
+            self.ready_state_timer = threading.Timer(delay, self.on_ready_state_timer)
+            self.ready_state_timer.daemon = True
+            self.ready_state_timer.start()
+
+    def on_ready_state_timer(self):
+        with self.ready_state_lock:
+            # Cancelled, or replaced by the timer of a later command
+            if self.ready_state_timer is not threading.current_thread():
+                return
+            self.ready_state_timer = None
+            self.init_ready_state(0)
+
+    def cancel_ready_state(self):
+        with self.ready_state_lock:
+            if self.ready_state_timer is not None:
+                self.ready_state_timer.cancel()
+                self.ready_state_timer = None
+
     def poll_cmd_request_q(self):
-        # Get a command from the queue. This blocks the thread until a command is passed to the queue
-        request_dict = self.cmd_request_q.get()
+        # Get the highest priority command. This blocks the thread until a command is requested
+        command = self.command_scheduler.next_command()
+        if not isinstance(command, AuthenticateCommand):
+            # The result still on screen would be cleared in the middle of this command. The authentication leaves it
+            # until its timer, as it only shows anything once a face comes
+            self.cancel_ready_state()
         self.ready_status_q.put(False)
-        command = request_dict.get("command")
-
-        # Retrieve function corresponding to the command received
-        func_call = self.cmd_exec.get(command, lambda: None)
-
-        # Ensure the function exists
-        if callable(func_call) and func_call.__name__ != "<lambda>":
-            # If function's name retrieved is the related to enrolment
-            if func_call.__name__ == "face_enroll":
-                # Need to explicitly retrieve employee ID
-                employee_id = request_dict.get("employee_id")
-                # And pass it as an argument
-                func_call(employee_id)
-            # Else
-            else:
-                # Just invoke function normally
-                func_call()
-        else:
-            LOGGER.error(f'Invoking cmd request failed. No such function "{command}" exists. >>>{func_call.__name__}')
+        LOGGER.debug(f'Running command: {command}')
+        try:
+            self.cmd_exec[type(command)](command)
+        except (DeviceSessionError,) + SERIAL_ERRORS as e:
+            # An unplugged device fails the command, not the face processor
+            self.on_device_unreachable(e)
+        finally:
+            self.command_scheduler.done(command)
+        return command
+
+    def on_device_unreachable(self, error):
+        LOGGER.error(f'Device command failed: {error}')
+        self.send_feedback_msg('Device unreachable, please check the camera connection', FaceDetectionStatus.REJECTED)
 
 
 def get_device_port():
@@ -613,196 +856,35 @@ def get_device_port():
     return com_port
 
 
-def face_enroll_loop(authenticator, enrolment_loop_q, stop_enrolment_loop_q, employee_id):
-    def _on_enrolment_loop_result(face_auth_status, detection_faceprint):
-        nonlocal enrolment_loop_q
-        nonlocal employee_id
-
-        try:
-            # ---Beginning of face descriptor extraction logic---
-            fp = {
-                "employee_id": employee_id,
-                "faceprint": {
-                    "version": detection_faceprint.version,
-                    "features_type": detection_faceprint.features_type,
-                    "flags": detection_faceprint.flags,
-                    "adaptive_descriptor_nomask": detection_faceprint.features,
-                    "adaptive_descriptor_withmask": [0] * 259,
-                    "enroll_descriptor": detection_faceprint.features
-                }
-            }
-
-            fp_json_str = json.dumps(fp)
-            enrolment_loop_q.put(fp_json_str)
-            print(f"{fp_json_str}")
-        except Exception as e:
-            print(f"e: {e}")
-
-    def _on_hint(h):
-        # TODO: provide status message feedback
-        # print(f"\n\n\n on_hint():\t h: {h} \n\n\n")
-        return
-
-    def _on_faces(f, i):
-        # TODO: draw feedback on screen
-        # print(f"\n\n\n _on_faces():\t f: {f}, i: {i} \n\n\n")
-        return
-
-    while True:
-        try:
-            stop_enrolment_loop_q.get_nowait()
-        except queue.Empty:
-            authenticator.extract_faceprints_for_enroll(
-                on_result=
-                lambda face_auth_status, detection_faceprint:
-                    _on_enrolment_loop_result(face_auth_status, detection_faceprint),
-
-                on_hint=_on_hint,
-
-                on_faces=_on_faces
-            )
-            time.sleep(0.2)
-        else:
-            return
-
-
-def generate_auth_result(authenticator, enrolment_result, auth_result_q):
-    auth_result = {
-        "best_score": None,
-        "best_index": None,
-        "list": []
-    }
-    auth_success_q = queue.Queue()
-
-    def _on_auth_result(face_auth_status, detection_faceprint):
-        nonlocal authenticator
-        nonlocal enrolment
-        nonlocal auth_result
-        nonlocal auth_success_q
-
-        if face_auth_status != rsid_py.AuthenticateStatus.Success:
-            auth_success_q.put(False)
-            return
-
-        enrolment_o = json.loads(enrolment)
-        enrolment_properties = enrolment_o["faceprint"]
-        enrolment_faceprints = rsid_py.Faceprints()
-        enrolment_faceprints.version = enrolment_properties["version"]
-        enrolment_faceprints.features_type = enrolment_properties["features_type"]
-        enrolment_faceprints.flags = enrolment_properties["flags"]
-        enrolment_faceprints.adaptive_descriptor_nomask = enrolment_properties["adaptive_descriptor_nomask"]
-        enrolment_faceprints.adaptive_descriptor_withmask = enrolment_properties["adaptive_descriptor_withmask"]
-        enrolment_faceprints.enroll_descriptor = enrolment_properties["enroll_descriptor"]
-
-        updated_faceprints = rsid_py.Faceprints()
-        match_result = authenticator.match_faceprints(detection_faceprint, enrolment_faceprints, updated_faceprints)
-
-        if match_result.success:
-            auth_result["list"].append({
-                "enrolment": enrolment,
-                "match_result": match_result,
-                "score": match_result.score
-            })
-            auth_success_q.put(True)
-        else:
-            auth_success_q.put(False)
-        return
-
-    def _on_hint(authenticate_status):
-        return
-
-    def _on_faces(faces, timestamp):
-        return
-
-    for enrolment in enrolment_result:
-        auth_success = False
-        while not auth_success:
-            authenticator.extract_faceprints_for_auth(
-                on_result=
-                lambda face_auth_status, detection_faceprint:
-                _on_auth_result(face_auth_status, detection_faceprint),
-                on_hint=_on_hint,
-                on_faces=_on_faces
-            )
-            auth_success = auth_success_q.get()
-
-    best_score = 0
-    best_index = None
-    for i, item in enumerate(auth_result["list"]):
-        score = item["score"]
-        if score > best_score:
-            best_index = i
-            best_score = score
-
-    auth_result["best_score"] = best_score
-    auth_result["best_index"] = best_index
-    auth_result_q.put(auth_result)
-
-
 def main():
+    # Best-of-N enrolment captures on the device, the best one chosen on the host
     employee_id = "Bob the builder"
     facial_config = {
-        "min_auth_score_threshold": 2500,
-        "min_enroll_score_threshold": 2500,
         "enroll_best_out_of": 3
     }
 
-    with rsid_py.FaceAuthenticator(get_device_port()) as authenticator:
-        FaceProcessor.set_device_config(authenticator)
+    device_port = get_device_port()
+    with rsid_py.FaceAuthenticator(device_port) as authenticator:
+        FaceProcessor.set_device_config(authenticator, serial_number=get_port_serial_number(device_port))
 
-        enrolment_loop_q = queue.Queue()
-        stop_enrolment_loop_q = queue.Queue()
-        on_demand_cancel_q = queue.Queue()
+        captures = []
 
-        def _poll_on_demand_cancellation():
-            nonlocal authenticator
-            nonlocal on_demand_cancel_q
-            print("polling for on demand cancellation")
-            on_demand_cancel_q.get()
-            authenticator.cancel()
+        def _on_enrolment_result(face_auth_status, detection_faceprint):
+            print(f"Capture {len(captures) + 1}: {face_auth_status}")
+            if face_auth_status == rsid_py.EnrollStatus.Success:
+                captures.append(detection_faceprint)
 
-        # TODO: begin cancel queue thread here on authenticator to block on thread and check for on demand cancellation
-        threading.Thread(target=lambda: _poll_on_demand_cancellation(), daemon=True).start()
+        while len(captures) < facial_config["enroll_best_out_of"]:
+            authenticator.extract_faceprints_for_enroll(on_result=_on_enrolment_result)
+            time.sleep(0.2)
 
-        threading.Thread(target=lambda: face_enroll_loop(authenticator, enrolment_loop_q, stop_enrolment_loop_q, employee_id), daemon=True).start()
-        enrolment_result = []
-        while True:
-            enrolment_result.append(enrolment_loop_q.get())
-            if len(enrolment_result) == facial_config["enroll_best_out_of"]:
-                stop_enrolment_loop_q.put(True)
-                break
+        selection_start_time = time.perf_counter()
+        selection = select_enrolment_capture([capture.features for capture in captures])
+        print(f'\n{employee_id}: {selection}')
+        print(f'Best index: {selection.best_index}, consistency: {selection.best_consistency:.3f}')
+        print(f'Selected in {(time.perf_counter() - selection_start_time) * 1000:.3f} ms')
 
-        # Wait awhile for things to resolve before continuing
-        time.sleep(0.5)
-        print(f"Final result:")
-        for result in enrolment_result:
-            print(result)
-
-        print("BEGIN AUTH COMPARISONS")
-        auth_result_q = queue.Queue()
-        threading.Thread(
-            target=lambda: generate_auth_result(authenticator, enrolment_result, auth_result_q),
-            daemon=True).start()
-
-        auth_result = None
-        while auth_result is None:
-            time.sleep(0.5)
-            try:
-                auth_result = auth_result_q.get_nowait()
-            except queue.Empty:
-                pass
-
-        auth_result_list = auth_result["list"]
-        for i, item in enumerate(auth_result_list):
-            print()
-            print(f'[{i}]enrolment: {item["enrolment"]}')
-            print(f'[{i}]match_result: {item["match_result"]}')
-            print(f'[{i}]score: {item["score"]}')
-        print(f'\nBest score: {auth_result["best_score"]}')
-        print(f'Best index: {auth_result["best_index"]}')
-        #   print(f"Enrolling: {employee id}, score: {auth_result.best}")
 
 if __name__ == '__main__':
 
     main()
-
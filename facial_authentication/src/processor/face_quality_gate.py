@@ -0,0 +1,266 @@
+import argparse
+import numpy as np
+import cv2
+
+import src.logger.custom_logger as custom_logger
+from src.utility import pipeline_metrics
+
+LOGGER = custom_logger.get_logger()
+
+QUALITY_OK = 'ok'
+QUALITY_NO_FACE = 'no_face'
+QUALITY_TOO_FAR = 'too_far'
+QUALITY_OFF_CENTER = 'off_center'
+QUALITY_BLURRY = 'blurry'
+QUALITY_TURNED = 'turned'
+
+
+class FaceQualityGate:
+    """
+    Host-side check of a detected face before the face processor is signalled.
+
+    Every device extraction that ends in FaceIsTooFar, FaceTiltIsTooHigh, NoFaceDetected etc. costs a full
+    device round trip plus the feedback delays, so frames that are unlikely to succeed are held back:
+        1. Face box width relative to the frame width (too far away)
+        2. Face centre offset from the frame centre, relative to the frame size
+        3. Sharpness, variance of the Laplacian over the face box (motion blur, out of focus)
+        4. Yaw, nose offset from the middle of the eyes relative to the eye distance (needs landmarks)
+    """
+
+    def __init__(self, min_width_ratio=0.18, max_center_offset=0.25, min_sharpness=50.0, max_yaw=0.3):
+        self.min_width_ratio = min_width_ratio
+        self.max_center_offset = max_center_offset
+        self.min_sharpness = min_sharpness
+        self.max_yaw = max_yaw
+
+        metrics = pipeline_metrics.get_registry()
+        self.passed_counter = metrics.counter('quality_gate_passed', 'Faces passed on to the face processor')
+        self.rejected_counters = {
+            reason: metrics.counter(f'quality_gate_{reason}', f'Faces held back by the quality gate: {reason}')
+            for reason in (QUALITY_TOO_FAR, QUALITY_OFF_CENTER, QUALITY_BLURRY, QUALITY_TURNED)
+        }
+
+    @staticmethod
+    def get_sharpness(image, face):
+        image_height, image_width = image.shape[:2]
+        x1, y1 = max(face.x, 0), max(face.y, 0)
+        x2, y2 = min(face.x + face.w, image_width), min(face.y + face.h, image_height)
+        if x2 <= x1 or y2 <= y1:
+            return 0.0
+
+        face_roi = image[y1:y2, x1:x2]
+        # Measured on a fixed size so the score does not depend on the distance to the camera
+        face_gray = cv2.cvtColor(cv2.resize(face_roi, (96, 96), interpolation=cv2.INTER_AREA), cv2.COLOR_RGB2GRAY)
+        _, stddev = cv2.meanStdDev(cv2.Laplacian(face_gray, cv2.CV_16S))
+        return float(stddev[0][0] ** 2)
+
+    @staticmethod
+    def get_yaw(face):
+        """Nose offset from the middle of the eyes divided by the eye distance, 0 when facing the camera"""
+        landmarks = face.landmarks
+        if not all(name in landmarks for name in ('right_eye', 'left_eye', 'nose_tip')):
+            return None
+        right_eye_x, left_eye_x, nose_x = landmarks['right_eye'][0], landmarks['left_eye'][0], landmarks['nose_tip'][0]
+        eye_distance = abs(left_eye_x - right_eye_x)
+        if eye_distance < 1:
+            return None
+        return (nose_x - (right_eye_x + left_eye_x) / 2) / eye_distance
+
+    def check(self, faces, image):
+        """
+        Check the largest detected face of a frame.
+        :return: tuple of (reason, measurements), reason is QUALITY_OK if the face is worth authenticating
+        """
+        if not faces:
+            return QUALITY_NO_FACE, {}
+
+        face = max(faces, key=lambda f: f.w * f.h)
+        image_height, image_width = image.shape[:2]
+
+        measurements = {
+            "width_ratio": face.w / image_width,
+            "center_offset": max(
+                abs(face.x + face.w / 2 - image_width / 2) / image_width,
+                abs(face.y + face.h / 2 - image_height / 2) / image_height
+            ),
+            "yaw": FaceQualityGate.get_yaw(face)
+        }
+
+        # Cheapest checks first, the sharpness measurement is only done when the geometry is fine
+        if measurements["width_ratio"] < self.min_width_ratio:
+            reason = QUALITY_TOO_FAR
+        elif measurements["center_offset"] > self.max_center_offset:
+            reason = QUALITY_OFF_CENTER
+        elif measurements["yaw"] is not None and abs(measurements["yaw"]) > self.max_yaw:
+            reason = QUALITY_TURNED
+        else:
+            measurements["sharpness"] = FaceQualityGate.get_sharpness(image, face)
+            reason = QUALITY_BLURRY if measurements["sharpness"] < self.min_sharpness else QUALITY_OK
+
+        if reason == QUALITY_OK:
+            self.passed_counter.inc()
+        else:
+            self.rejected_counters[reason].inc()
+        return reason, measurements
+
+
+def create_face_quality_gate(config):
+    """Quality gate if turned on in the app config, else None"""
+    if not config.face_quality_gate_enabled:
+        return None
+    return FaceQualityGate(
+        min_width_ratio=config.face_quality_min_width_ratio or 0.18,
+        max_center_offset=config.face_quality_max_center_offset or 0.25,
+        min_sharpness=config.face_quality_min_sharpness or 50.0,
+        max_yaw=config.face_quality_max_yaw or 0.3
+    )
+
+
+def simulate_attempts(timeline, is_attempt_allowed, get_device_status, attempt_seconds=0.8, failure_penalty_seconds=3.5):
+    """
+    Replay the authentication loop over one recorded approach.
+    :param timeline: list of (timestamp, faces, image) of the recording
+    :param is_attempt_allowed: is_attempt_allowed(frame_index), whether the face processor is signalled for a frame
+    :param get_device_status: get_device_status(frame_index) -> AuthenticateStatus member name of an attempt started
+        on that frame, from the device, never from the gate
+    :param failure_penalty_seconds: time.sleep(1) after a failure plus init_ready_state(2.5)
+    :return: tuple of (attempts, failures, time to accept in seconds or None)
+    """
+    attempts = failures = 0
+    first_face_time = None
+    busy_until = None
+
+    for index, (timestamp, faces, _) in enumerate(timeline):
+        if faces and first_face_time is None:
+            first_face_time = timestamp
+        if busy_until is not None and timestamp < busy_until:
+            continue
+        if not faces or not is_attempt_allowed(index):
+            continue
+
+        attempts += 1
+        if get_device_status(index) == 'Success':
+            return attempts, failures, timestamp + attempt_seconds - first_face_time
+        failures += 1
+        busy_until = timestamp + attempt_seconds + failure_penalty_seconds
+
+    return attempts, failures, None
+
+
+def get_recorded_statuses(auth_statuses):
+    """
+    Device status of an attempt started on each frame, from the labels of a recording: the status of the attempt the
+    frame was captured during, or for unlabelled frames of the next labelled one. NoFaceDetected past the last one
+    """
+    statuses = list(auth_statuses)
+    next_status = 'NoFaceDetected'
+    for index in range(len(statuses) - 1, -1, -1):
+        if statuses[index]:
+            next_status = statuses[index]
+        else:
+            statuses[index] = next_status
+    return statuses
+
+
+def get_simulated_statuses(frame_count, seed):
+    """Device status of an attempt started on each frame, drawn from the status mix of the simulated device"""
+    import random
+    from src.simulator.rsid_py import DEFAULT_SETTINGS
+
+    status_mix = DEFAULT_SETTINGS["auth_status_mix"]
+    rng = random.Random(seed)
+    return rng.choices(list(status_mix), weights=list(status_mix.values()), k=frame_count)
+
+
+def main():
+    """
+    Failure rate and time-to-accept with and without the gate, against device outcomes the gate plays no part in:
+    the statuses recorded next to the frames (frame_source.py record --label-auth), or with --simulated-statuses a
+    status drawn per frame from the simulated device mix. The gate only shows a gain on recorded statuses, a status
+    mix drawn independently of the frames can only show what the gate costs.
+    """
+    from types import SimpleNamespace
+    from src.processor.frame_source import FileFrameSource
+    from src.processor.face_detectors import create_face_detector
+
+    parser = argparse.ArgumentParser(description='Failure rate and time-to-accept with and without the quality gate')
+    parser.add_argument(
+        'recordings', nargs='+', help='one recording per approach, made with frame_source.py record --label-auth'
+    )
+    parser.add_argument('--backend', default='mediapipe')
+    parser.add_argument(
+        '--simulated-statuses', action='store_true',
+        help='draw the device status per frame from the simulated device mix for recordings without labels'
+    )
+    args = parser.parse_args()
+
+    face_detector = create_face_detector(SimpleNamespace(
+        face_detector_backend=args.backend, face_detector_min_confidence=0.5,
+        face_detector_input_width=320, face_detector_yunet_model_path='./model/face_detection_yunet_2022mar.onnx'
+    ))
+    quality_gate = FaceQualityGate()
+
+    results = {"before": [], "after": []}
+    status_sources = {"recorded": 0, "simulated": 0}
+    # Frames with a face the device would have accepted, and how many of them the gate held back
+    accepted_frames = held_back_accepted_frames = 0
+    for recording_index, recording in enumerate(args.recordings):
+        frame_source = FileFrameSource(recording)
+        if frame_source.auth_statuses is not None:
+            statuses = get_recorded_statuses(frame_source.auth_statuses)
+            status_sources["recorded"] += 1
+        elif args.simulated_statuses:
+            statuses = get_simulated_statuses(len(frame_source), seed=recording_index)
+            status_sources["simulated"] += 1
+        else:
+            parser.error(f'{recording} has no device statuses, record it with --label-auth or pass --simulated-statuses')
+
+        timeline = []
+        gate_passed = []
+        for timestamp, frame in zip(frame_source.timestamps, frame_source.iter_frames()):
+            image = cv2.flip(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), 1)
+            faces = face_detector.detect(image)
+            timeline.append((timestamp, faces, image))
+            gate_passed.append(bool(faces) and quality_gate.check(faces, image)[0] == QUALITY_OK)
+        for (_, faces, _), passed, status in zip(timeline, gate_passed, statuses):
+            if faces and status == 'Success':
+                accepted_frames += 1
+                held_back_accepted_frames += not passed
+
+        get_device_status = lambda index: statuses[index]
+        results["before"].append(simulate_attempts(timeline, lambda index: True, get_device_status))
+        results["after"].append(simulate_attempts(timeline, lambda index: gate_passed[index], get_device_status))
+
+    print(f'Device statuses: {status_sources["recorded"]} recorded, {status_sources["simulated"]} simulated recordings')
+    for mode, mode_results in results.items():
+        attempts = sum(result[0] for result in mode_results)
+        failures = sum(result[1] for result in mode_results)
+        times_to_accept = [result[2] for result in mode_results if result[2] is not None]
+        print(
+            f'{mode:>6}: {attempts} attempts, failure rate {100.0 * failures / max(attempts, 1):.1f}%, '
+            f'accepted {len(times_to_accept)}/{len(mode_results)}, '
+            f'mean time-to-accept {np.mean(times_to_accept) if times_to_accept else float("nan"):.2f} s'
+        )
+
+    # What the gate costs: faces the device accepts but the gate holds back, and approaches it slows down or loses
+    print(
+        f'False rejects: {held_back_accepted_frames}/{accepted_frames} frames the device accepts held back by the gate '
+        f'({100.0 * held_back_accepted_frames / max(accepted_frames, 1):.1f}%)'
+    )
+    lost = slower = faster = 0
+    delays = []
+    for (_, _, before_time), (_, _, after_time) in zip(results["before"], results["after"]):
+        if before_time is not None and after_time is None:
+            lost += 1
+        elif before_time is not None and after_time is not None:
+            delays.append(after_time - before_time)
+            slower += after_time > before_time
+            faster += after_time < before_time
+    print(
+        f'Approaches: {faster} accepted sooner, {slower} later, {lost} not accepted any more with the gate, '
+        f'mean change in time-to-accept {np.mean(delays) if delays else 0.0:+.2f} s'
+    )
+
+
+if __name__ == '__main__':
+    main()
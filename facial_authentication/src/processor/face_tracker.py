@@ -0,0 +1,159 @@
+import threading
+import time
+
+import src.logger.custom_logger as custom_logger
+from src.utility import pipeline_metrics
+from src.processor.face_detection_status import FaceDetectionStatus
+
+LOGGER = custom_logger.get_logger()
+
+
+class FaceTrack:
+    """A face followed across frames, carries the authentication outcome of the person it belongs to"""
+
+    def __init__(self, track_id, face, frame_index):
+        self.track_id = track_id
+        self.face = face
+        self.first_seen = time.time()
+        self.last_frame_index = frame_index
+        self.hits = 1
+        self.status = FaceDetectionStatus.PENDING
+        self.employee_id = None
+
+    def __repr__(self):
+        return f'FaceTrack(id={self.track_id}, status={self.status}, employee_id={self.employee_id}, hits={self.hits})'
+
+
+class FaceTracker:
+    """
+    IoU/centroid tracker on the host-side face detector output.
+
+    The image processor feeds it the faces of every frame, the face processor reads it to find out whether the
+    person in front of the camera has already been authenticated. A track that was accepted is not
+    re-authenticated until it leaves the frame (no match for max_missed_frames frames).
+    """
+
+    def __init__(self, iou_threshold=0.3, max_centroid_distance=0.5, max_missed_frames=15):
+        self.iou_threshold = iou_threshold
+        # Fallback when boxes do not overlap enough (fast movement), relative to the track's box width
+        self.max_centroid_distance = max_centroid_distance
+        self.max_missed_frames = max_missed_frames
+
+        self.tracks = {}
+        self.next_track_id = 1
+        self.frame_index = 0
+        self.lock = threading.Lock()
+
+        metrics = pipeline_metrics.get_registry()
+        self.tracks_started_counter = metrics.counter('face_tracks_started', 'Faces that entered the frame')
+        metrics.gauge('face_tracks_active', 'Faces currently tracked', lambda: len(self.tracks))
+
+    @staticmethod
+    def centroid_distance(face, other):
+        dx = (face.x + face.w / 2) - (other.x + other.w / 2)
+        dy = (face.y + face.h / 2) - (other.y + other.h / 2)
+        return (dx * dx + dy * dy) ** 0.5
+
+    def match_score(self, track, face):
+        """Higher is better, None if the face cannot belong to the track"""
+        iou = track.face.iou(face)
+        if iou >= self.iou_threshold:
+            return 1.0 + iou
+        distance = FaceTracker.centroid_distance(track.face, face) / max(track.face.w, 1)
+        if distance <= self.max_centroid_distance:
+            return 1.0 - distance
+        return None
+
+    def update(self, faces):
+        """Associate the faces of a new frame with the existing tracks, returns the active tracks"""
+        with self.lock:
+            self.frame_index += 1
+
+            # Greedy association, best scoring pairs first
+            candidates = []
+            for track in self.tracks.values():
+                for face_index, face in enumerate(faces):
+                    score = self.match_score(track, face)
+                    if score is not None:
+                        candidates.append((score, track.track_id, face_index))
+            candidates.sort(reverse=True)
+
+            matched_tracks = set()
+            matched_faces = set()
+            for _, track_id, face_index in candidates:
+                if track_id in matched_tracks or face_index in matched_faces:
+                    continue
+                track = self.tracks[track_id]
+                track.face = faces[face_index]
+                track.last_frame_index = self.frame_index
+                track.hits += 1
+                matched_tracks.add(track_id)
+                matched_faces.add(face_index)
+
+            for face_index, face in enumerate(faces):
+                if face_index not in matched_faces:
+                    track = FaceTrack(self.next_track_id, face, self.frame_index)
+                    self.tracks[track.track_id] = track
+                    self.next_track_id += 1
+                    self.tracks_started_counter.inc()
+                    LOGGER.debug(f'Face track started: {track}')
+
+            # Tracks that have not been matched for a while have left the frame
+            for track_id in [
+                track_id for track_id, track in self.tracks.items()
+                if self.frame_index - track.last_frame_index > self.max_missed_frames
+            ]:
+                LOGGER.debug(f'Face track ended: {self.tracks[track_id]}')
+                del self.tracks[track_id]
+
+            return list(self.tracks.values())
+
+    def get_primary_track(self):
+        """
+        The largest face currently in the frame, the one the device will authenticate.
+        Tracks missing from the last few frames still count, so a detector dropout does not look like a new person.
+        """
+        with self.lock:
+            if not self.tracks:
+                return None
+            return max(self.tracks.values(), key=lambda track: track.face.w * track.face.h)
+
+    def is_tracked(self, track_id):
+        """The face of the track is still in the frame"""
+        with self.lock:
+            return track_id in self.tracks
+
+    def is_authenticated(self, track_id):
+        with self.lock:
+            track = self.tracks.get(track_id)
+            return track is not None and track.status is FaceDetectionStatus.ACCEPTED
+
+    def set_track_result(self, track_id, status, employee_id=None):
+        """Record the authentication outcome of a track, ignored if the track has left the frame meanwhile"""
+        with self.lock:
+            track = self.tracks.get(track_id)
+            if track is None:
+                return
+            track.status = status
+            track.employee_id = employee_id
+            LOGGER.face_rec(f'Face track result: {track}')
+
+    def reset(self):
+        with self.lock:
+            self.tracks.clear()
+
+
+_trackers = {}
+_trackers_lock = threading.Lock()
+
+
+def get_tracker(config=None):
+    """Tracker shared by the image processor and the face processor of a camera"""
+    camera_id = config.camera_id if config else None
+    with _trackers_lock:
+        if camera_id not in _trackers:
+            _trackers[camera_id] = FaceTracker(
+                iou_threshold=(config.face_tracker_iou_threshold if config else None) or 0.3,
+                max_missed_frames=(config.face_tracker_max_missed_frames if config else None) or 15
+            )
+        return _trackers[camera_id]
@@ -0,0 +1,72 @@
+import threading
+import time
+
+import src.logger.custom_logger as custom_logger
+
+LOGGER = custom_logger.get_logger()
+
+# Channels shared by the image processor (publisher) and the face processor (consumer)
+FACE_FEED = 'face'
+GESTURE_FEED = 'gesture'
+
+
+class FeedChannel:
+    """
+    Latest value published by the frame pipeline, kept in memory.
+    Replaces the ./write/feed_*_temp.txt files that were rewritten on every frame and polled by the face processor.
+    Consumers either read the current value or block until it changes.
+    """
+
+    def __init__(self, name, initial_value=None):
+        self.name = name
+        self.value = initial_value
+        self.version = 0
+        self.updated_at = None
+        self.condition = threading.Condition()
+        self.subscribers = []
+
+    def publish(self, value):
+        with self.condition:
+            # Only a change wakes the consumers up, the pipeline publishes the same value on most frames
+            if value == self.value and self.version:
+                return
+            self.value = value
+            self.version += 1
+            self.updated_at = time.perf_counter()
+            self.condition.notify_all()
+        # Called on the publisher's thread, subscribers must only hand the value over
+        for subscriber in self.subscribers:
+            subscriber(value)
+
+    def subscribe(self, callback):
+        """callback(value) on every change of the value"""
+        self.subscribers.append(callback)
+
+    def get(self):
+        return self.value
+
+    def wait_for(self, predicate, timeout=None):
+        """
+        Block until predicate(value) holds.
+        :return: the value, or None if the timeout expired first
+        """
+        with self.condition:
+            if self.condition.wait_for(lambda: predicate(self.value), timeout):
+                return self.value
+            return None
+
+
+_channels = {}
+_channels_lock = threading.Lock()
+
+
+def get_feed_channel(name, camera_id=None):
+    """
+    Channel shared by the processors of a camera, created on first use.
+    Each camera of a multi-camera station has its own channels, camera_id None is the only camera.
+    """
+    key = name if camera_id is None else f'{name}:{camera_id}'
+    with _channels_lock:
+        if key not in _channels:
+            _channels[key] = FeedChannel(key)
+        return _channels[key]
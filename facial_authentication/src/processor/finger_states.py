@@ -0,0 +1,219 @@
+import argparse
+import sys
+import time
+import numpy as np
+
+from src.processor.gesture_detection_status import GestureDetectionStatus
+
+# MediaPipe hand landmark indexes
+WRIST = 0
+THUMB_MCP = 2
+THUMB_TIP = 4
+FINGER_TIPS = np.array([8, 12, 16, 20])     # Index, middle, ring, pinky
+FINGER_NAMES = ['THUMB', 'INDEX', 'MIDDLE', 'RING', 'PINKY']
+HAND_LABELS = ['LEFT', 'RIGHT']
+
+# Fingers are only counted while the index finger is bent less than this at its PIP joint (landmarks 3-2-1)
+MAX_INDEX_ANGLE = 150.0
+
+# Wrist anchor is reported in GUI feedback image coordinates, as in GestureProcessor.count_fingers()
+WRIST_ANCHOR_SCALE = np.array([400, 600])
+
+
+class FingerStates:
+    """
+    Finger states of every hand of a frame, as arrays (one row per hand):
+        extended (hands, 5) bool, thumb to pinky; counts (hands,); is_right (hands,) bool;
+        index_angle (hands,) degrees; wrist_anchor (hands, 2) int
+    """
+
+    def __init__(self, extended, counts, is_right, index_angle, wrist_anchor):
+        self.extended = extended
+        self.counts = counts
+        self.is_right = is_right
+        self.index_angle = index_angle
+        self.wrist_anchor = wrist_anchor
+
+    def to_dicts(self, hand_index=0):
+        """fingers_statuses and fingers_counted dictionaries of one hand, as GestureProcessor.count_fingers() returns them"""
+        fingers_statuses = {f'{label}_{finger}': False for label in ('RIGHT', 'LEFT') for finger in FINGER_NAMES}
+        fingers_counted = {'LEFT': 0, 'RIGHT': 0}
+        if len(self.counts) <= hand_index:
+            return fingers_statuses, fingers_counted
+
+        hand_label = HAND_LABELS[int(self.is_right[hand_index])]
+        for finger, extended in zip(FINGER_NAMES, self.extended[hand_index]):
+            fingers_statuses[f'{hand_label}_{finger}'] = bool(extended)
+        fingers_counted[hand_label] = int(self.counts[hand_index])
+        return fingers_statuses, fingers_counted
+
+
+def landmarks_to_array(multi_hand_landmarks):
+    """MediaPipe multi_hand_landmarks to a (hands, 21, 3) array, the only per-landmark Python loop left"""
+    return np.array(
+        [[(landmark.x, landmark.y, landmark.z) for landmark in hand.landmark] for hand in multi_hand_landmarks],
+        dtype=np.float64
+    ).reshape(-1, 21, 3)
+
+
+def handedness_to_array(multi_handedness):
+    """MediaPipe multi_handedness to a (hands,) bool array, True for a right hand"""
+    return np.array([hand.classification[0].label == 'Right' for hand in multi_handedness], dtype=bool)
+
+
+def get_joint_angles(landmarks, a, b, c):
+    """Angle in degrees at landmark b between landmarks a and c (x/y only), for every hand"""
+    ab = landmarks[:, a, :2] - landmarks[:, b, :2]
+    cb = landmarks[:, c, :2] - landmarks[:, b, :2]
+    angle = np.abs(np.degrees(np.arctan2(cb[:, 1], cb[:, 0]) - np.arctan2(ab[:, 1], ab[:, 0])))
+    return np.where(angle > 180.0, 360.0 - angle, angle)
+
+
+def compute_finger_states(landmarks, is_right, max_index_angle=MAX_INDEX_ANGLE):
+    """
+    Same rules as GestureProcessor.count_fingers(), applied to all hands at once:
+    a finger is extended when its tip is above its PIP joint, the thumb when its tip is on the outer side of its MCP,
+    and nothing is counted while the index finger is bent too far.
+    """
+    index_angle = get_joint_angles(landmarks, 3, 2, 1)
+    # count_fingers() compares the angle rounded to 2 decimals
+    counted = np.round(index_angle, 2) < max_index_angle
+
+    extended = np.empty((landmarks.shape[0], 5), dtype=bool)
+    extended[:, 1:] = landmarks[:, FINGER_TIPS, 1] < landmarks[:, FINGER_TIPS - 2, 1]
+    thumb_tip_x = landmarks[:, THUMB_TIP, 0]
+    thumb_mcp_x = landmarks[:, THUMB_MCP, 0]
+    extended[:, 0] = np.where(is_right, thumb_tip_x < thumb_mcp_x, thumb_tip_x > thumb_mcp_x)
+    extended &= counted[:, None]
+
+    wrist_anchor = (landmarks[:, WRIST, :2] * WRIST_ANCHOR_SCALE).astype(int)
+    return FingerStates(extended, extended.sum(axis=1), is_right, index_angle, wrist_anchor)
+
+
+def recognize_gestures(finger_states):
+    """
+    Gesture of every hand, as GestureProcessor.recognize_gestures() decides it:
+    index and middle only -> V-sign, index only -> index finger, anything else -> None
+    """
+    extended, counts = finger_states.extended, finger_states.counts
+    vsign = (counts == 2) & extended[:, 1] & extended[:, 2]
+    index_finger = (counts == 1) & extended[:, 1]
+    return [
+        GestureDetectionStatus.VSIGN if is_vsign else GestureDetectionStatus.INDEXFINGER if is_index else None
+        for is_vsign, is_index in zip(vsign, index_finger)
+    ]
+
+
+def detect_gesture(results, max_index_angle=MAX_INDEX_ANGLE):
+    """
+    Gesture of the first hand of MediaPipe hands results, the only one count_fingers() ever looks at.
+    :return: GestureDetectionStatus or None
+    """
+    if not results.multi_hand_landmarks:
+        return None
+    landmarks = landmarks_to_array(results.multi_hand_landmarks[:1])
+    is_right = handedness_to_array(results.multi_handedness[:1])
+    return recognize_gestures(compute_finger_states(landmarks, is_right, max_index_angle))[0]
+
+
+class _Landmark:
+    def __init__(self, x, y, z):
+        self.x, self.y, self.z = x, y, z
+
+
+class _Hand:
+    def __init__(self, points):
+        self.landmark = [_Landmark(*point) for point in points]
+
+
+class _Classification:
+    def __init__(self, label, index):
+        self.label, self.index, self.score = label, index, 1.0
+
+
+class _Handedness:
+    def __init__(self, label, index):
+        self.classification = [_Classification(label, index)]
+
+
+class _HandsResults:
+    """Stand-in for the results of mp_hands.Hands.process(), built from a landmark array"""
+
+    def __init__(self, landmarks, is_right):
+        self.multi_hand_landmarks = [_Hand(hand) for hand in landmarks]
+        self.multi_handedness = [
+            _Handedness('Right' if right else 'Left', index) for index, right in enumerate(is_right)
+        ]
+
+
+def generate_hands(count, rng):
+    """Random but plausible hands: an upright palm with every finger randomly raised or curled"""
+    landmarks = np.empty((count, 21, 3))
+    wrist = rng.uniform(0.3, 0.7, size=(count, 1, 2))
+    for finger, base in enumerate(range(1, 21, 4)):
+        x_offset = (finger - 2) * 0.04
+        raised = rng.random(count) < 0.5
+        for joint in range(4):
+            rise = 0.05 * (joint + 1) * np.where(raised, 1.0, 0.4 if joint < 2 else -0.2)
+            landmarks[:, base + joint, 0] = wrist[:, 0, 0] + x_offset + rng.normal(0, 0.01, count)
+            landmarks[:, base + joint, 1] = wrist[:, 0, 1] - rise
+    landmarks[:, WRIST, :2] = wrist[:, 0]
+    landmarks[:, :, 2] = rng.normal(0, 0.02, size=(count, 21))
+    return landmarks
+
+
+def main():
+    # Parity with GestureProcessor.count_fingers()/recognize_gestures() and micro-benchmark of both
+    from src.processor.gesture_processor_working import GestureProcessor
+
+    parser = argparse.ArgumentParser(description='Check the vectorised finger states against count_fingers()')
+    parser.add_argument('--hands', type=int, default=5000, help='random hands to compare')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    landmarks = generate_hands(args.hands, rng)
+    is_right = rng.random(args.hands) < 0.5
+    image = np.zeros((600, 400, 3), dtype=np.uint8)
+    samples = [_HandsResults(landmarks[i:i + 1], is_right[i:i + 1]) for i in range(args.hands)]
+
+    # Every hand must come out the same from count_fingers()/recognize_gestures(), from the vectorised version one
+    # hand at a time, and from the vectorised version with all the hands in one batch
+    batch_gestures = recognize_gestures(compute_finger_states(landmarks, is_right))
+    mismatches = []
+    for index, results in enumerate(samples):
+        _, fingers_statuses, fingers_counted = GestureProcessor.count_fingers(image, results, False)
+        _, gesture = GestureProcessor.recognize_gestures(image, fingers_statuses, fingers_counted, False)
+
+        finger_states = compute_finger_states(
+            landmarks_to_array(results.multi_hand_landmarks), handedness_to_array(results.multi_handedness)
+        )
+        if (fingers_statuses, fingers_counted) != finger_states.to_dicts() or \
+                gesture != recognize_gestures(finger_states)[0] or gesture != batch_gestures[index]:
+            mismatches.append(index)
+    print(f'Parity: {args.hands - len(mismatches)}/{args.hands} hands identical')
+    if mismatches:
+        print(f'FAIL, vectorised finger states differ from count_fingers() for hands {mismatches[:10]}')
+        sys.exit(1)
+
+    start_time = time.perf_counter()
+    for results in samples:
+        _, fingers_statuses, fingers_counted = GestureProcessor.count_fingers(image, results, False)
+        GestureProcessor.recognize_gestures(image, fingers_statuses, fingers_counted, False)
+    loop_seconds = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    for results in samples:
+        detect_gesture(results)
+    vectorised_seconds = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    recognize_gestures(compute_finger_states(landmarks, is_right))
+    batch_seconds = time.perf_counter() - start_time
+
+    print(f'count_fingers + recognize_gestures: {1e6 * loop_seconds / args.hands:.1f} us/hand')
+    print(f'vectorised, one frame at a time:    {1e6 * vectorised_seconds / args.hands:.1f} us/hand')
+    print(f'vectorised, all hands in one batch: {1e6 * batch_seconds / args.hands:.2f} us/hand')
+
+
+if __name__ == '__main__':
+    main()
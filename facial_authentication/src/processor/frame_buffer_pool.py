@@ -0,0 +1,156 @@
+import sys
+import time
+import tracemalloc
+import numpy as np
+import cv2
+
+import src.logger.custom_logger as custom_logger
+from src.utility import pipeline_metrics
+
+LOGGER = custom_logger.get_logger()
+
+
+class FrameBufferPool:
+    """
+    Pre-allocated working arrays for the per-frame image operations.
+
+    Every buffer is keyed on (name, shape, dtype), so it is allocated the first time a resolution is seen and
+    reused for every following frame. OpenCV calls write into these buffers through their dst= parameter, which
+    keeps the steady-state frame path free of full-size allocations.
+    NOTE: A buffer is overwritten by the next frame, callers must copy anything they need to keep.
+    """
+
+    def __init__(self):
+        # {(name, shape, dtype): array}
+        self.buffers = {}
+        self.allocations_counter = pipeline_metrics.get_registry().counter(
+            'frame_buffer_allocations', 'Working arrays allocated by the frame buffer pool'
+        )
+
+    def get(self, name, shape, dtype=np.uint8):
+        key = (name, tuple(shape), np.dtype(dtype).str)
+        buffer = self.buffers.get(key)
+        if buffer is None:
+            buffer = np.empty(shape, dtype=dtype)
+            self.buffers[key] = buffer
+            self.allocations_counter.inc()
+            LOGGER.info(f'Frame buffer allocated: {name} {shape}, {buffer.nbytes / 1024:.0f} KB')
+        return buffer
+
+    def cvt_color(self, name, src, code):
+        """cv2.cvtColor() into a pooled buffer, only for conversions that keep the channel count"""
+        return cv2.cvtColor(src, code, dst=self.get(name, src.shape, src.dtype))
+
+    def flip(self, name, src, flip_code):
+        """cv2.flip() into a pooled buffer"""
+        return cv2.flip(src, flip_code, dst=self.get(name, src.shape, src.dtype))
+
+    def get_total_bytes(self):
+        return sum(buffer.nbytes for buffer in self.buffers.values())
+
+
+# Frames replayed before measuring, enough to fill the sample windows of the meters (1024 events)
+WARM_UP_FRAMES = 1100
+
+
+def record_test_frames(path, frames=120):
+    """Recording of synthetic frames of the simulated device, someone stepping in front of the camera and away"""
+    from src.simulator.rsid_py import Preview
+    from src.processor.frame_source import FrameRecorder, RecordedImage
+
+    scene_frames = Preview().frames
+    frame_recorder = FrameRecorder(path, max_frames=frames)
+    for index in range(frames):
+        frame_recorder.record(RecordedImage(scene_frames[index % 60 < 40].copy()))
+    frame_recorder.save()
+
+
+def main():
+    """
+    Check that the steady-state frame path allocates no working arrays: a recording is replayed through
+    ImageProcessor.on_image_available() and its frame pipeline, as built for the app config, with the stub face
+    detector. numpy reports its buffers to tracemalloc
+    """
+    import argparse
+    import queue
+    import tempfile
+    from pathlib import Path
+    from src.configuration.app_authentication_config import _AppConfiguration, _CameraConfiguration
+    from src.processor.face_detection_status import FaceDetectionStatus
+    from src.processor.frame_source import FileFrameSource, RecordedImage
+    from src.processor.image_processor import ImageProcessor
+
+    parser = argparse.ArgumentParser(description='Check the frame path allocates no working arrays in steady state')
+    parser.add_argument('--recording', help='recording made with frame_source.py record, synthetic frames by default')
+    parser.add_argument('--variant', default='face', help='frame pipeline variant')
+    args = parser.parse_args()
+
+    recording = args.recording
+    if recording is None:
+        recording = str(Path(tempfile.mkdtemp()) / 'frames.npz')
+        record_test_frames(recording)
+    frames = [RecordedImage(frame) for frame in FileFrameSource(recording).iter_frames()]
+
+    config = _CameraConfiguration(_AppConfiguration(), {
+        "face_detector_backend": 'stub',
+        "frame_pipeline_variant": args.variant,
+        "frame_source": 'file',
+        "frame_source_path": recording,
+        "frame_record_path": None
+    })
+    image_q = queue.Queue()
+    image_processor = ImageProcessor(image_q, queue.Queue(), config)
+    frame_pipeline = image_processor.frame_pipeline
+    # Detection box of an authentication in progress, drawn by the overlay stage
+    face = image_processor.face_detector.detect(frames[0].array)[0]
+    image_processor.livestream_detections = [{'face': face, 'status': FaceDetectionStatus.PENDING}]
+
+    def replay():
+        for image in frames:
+            image_processor.on_image_available(image)
+            # The GUI takes the display image of every frame
+            while not image_q.empty():
+                image_q.get_nowait()
+
+    # Warm up, the pool allocates its buffers for this resolution on the first frame, the stages set up their state
+    # (tracks, vote windows) and the bounded sample windows of the frame metrics fill up
+    for _ in range(-(-WARM_UP_FRAMES // len(frames))):
+        replay()
+    warm_allocations = image_processor.buffer_pool.allocations_counter.value
+    frames_before = frame_pipeline.frames_processed
+
+    tracemalloc.start()
+    tracemalloc.clear_traces()
+    start_time = time.perf_counter()
+    replay()
+    frame_ms = (time.perf_counter() - start_time) * 1000 / len(frames)
+    current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    buffer_pool = image_processor.buffer_pool
+    print(f'Frame pipeline "{frame_pipeline.variant}": {frame_pipeline.describe()}')
+    print(f'{frame_ms:.3f} ms/frame, pool holds {buffer_pool.get_total_bytes() / 1024:.0f} KB')
+    print(f'Traced allocations over {len(frames)} frames: current {current_bytes} B, peak {peak_bytes} B')
+    # Anything the size of the smallest working array would mean one slipped out of the pool. A few KB of Python
+    # objects (frame contexts, detection results, cv2 argument tuples) come and go with every frame
+    working_arrays = [buffer.nbytes for buffer in buffer_pool.buffers.values()]
+    if image_processor.display_pipeline is not None:
+        working_arrays.append(image_processor.display_pipeline.canvas.nbytes)
+    smallest_array_bytes = min(working_arrays)
+    failures = []
+    if frame_pipeline.frames_processed - frames_before != len(frames):
+        failures.append(f'{frame_pipeline.frames_processed - frames_before} of {len(frames)} frames went through the pipeline')
+    if buffer_pool.allocations_counter.value != warm_allocations:
+        failures.append(f'pool allocated {buffer_pool.allocations_counter.value - warm_allocations} buffers after the first pass')
+    if peak_bytes >= smallest_array_bytes:
+        failures.append(f'peak {peak_bytes} B, a working array ({smallest_array_bytes} B) was allocated')
+    if current_bytes >= 4096:
+        failures.append(f'{current_bytes} B still allocated after {len(frames)} frames')
+    if failures:
+        print(f'FAIL, steady-state frame path: {"; ".join(failures)}')
+        sys.exit(1)
+    print('OK, no working arrays allocated in steady state')
+
+
+if __name__ == '__main__':
+    main()
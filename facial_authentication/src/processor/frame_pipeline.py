@@ -0,0 +1,356 @@
+import time
+from PIL import Image
+import cv2
+
+import src.logger.custom_logger as custom_logger
+from src.utility import pipeline_metrics
+from src.processor.face_detection_processor import FaceDetectionProcessor
+from src.processor.face_quality_gate import QUALITY_OK
+from src.processor.gesture_vote import create_gesture_vote, NO_GESTURE
+from src.processor.gesture_engine import GestureEngine, GESTURE_ENGINE_TRACKING
+from src.processor.feed_channel import get_feed_channel, FACE_FEED, GESTURE_FEED
+
+LOGGER = custom_logger.get_logger()
+
+STAGE_OVERLAY = 'overlay'
+STAGE_CONVERT = 'convert'
+STAGE_DETECT_FACE = 'detect_face'
+STAGE_DETECT_GESTURE = 'detect_gesture'
+STAGE_VOTE = 'vote'
+STAGE_PUBLISH = 'publish'
+STAGE_DISPLAY = 'display'
+
+# Behaviour of the former image processor copies, reproduced from config by frame_pipeline_variant
+FRAME_PIPELINE_VARIANTS = {
+    # image_processor.py: face presence drives authentication
+    'face': {
+        "stages": [STAGE_OVERLAY, STAGE_CONVERT, STAGE_DETECT_FACE, STAGE_PUBLISH, STAGE_DISPLAY]
+    },
+    # image_processor_original.py, image_processor_working2.py: raw gesture of every frame
+    'gesture': {
+        "stages": [STAGE_CONVERT, STAGE_DETECT_GESTURE, STAGE_VOTE, STAGE_PUBLISH, STAGE_DISPLAY],
+        "gesture_vote": 'passthrough'
+    },
+    # image_processor_time.py: gestures forced to clock in/out at fixed times of the day
+    'gesture_time': {
+        "stages": [STAGE_CONVERT, STAGE_DETECT_GESTURE, STAGE_VOTE, STAGE_PUBLISH, STAGE_DISPLAY],
+        "gesture_vote": 'time_override',
+        "display_prescale": 0.5
+    },
+    # image_processors/image_processor_pop.py: mode over blocks of 3 frames
+    'gesture_pop': {
+        "stages": [STAGE_CONVERT, STAGE_DETECT_GESTURE, STAGE_VOTE, STAGE_PUBLISH, STAGE_DISPLAY],
+        "gesture_vote": 'block_mode',
+        "gesture_vote_window": 3
+    },
+    # image_processors/image_processor_nonpop.py: majority over a streak of 20 gesture frames
+    'gesture_nonpop': {
+        "stages": [STAGE_CONVERT, STAGE_DETECT_GESTURE, STAGE_VOTE, STAGE_PUBLISH, STAGE_DISPLAY],
+        "gesture_vote": 'streak_mode',
+        "gesture_vote_window": 20
+    },
+    # Face presence with gestures, hands tracked around the face only while an authentication is pending
+    'face_gesture': {
+        "stages": [STAGE_OVERLAY, STAGE_CONVERT, STAGE_DETECT_FACE, STAGE_DETECT_GESTURE, STAGE_VOTE, STAGE_PUBLISH, STAGE_DISPLAY],
+        "gesture_vote": 'ring'
+    },
+    # backup/image_processor_array.py: sum over a streak of 10 gesture frames
+    'gesture_array': {
+        "stages": [STAGE_CONVERT, STAGE_DETECT_GESTURE, STAGE_VOTE, STAGE_PUBLISH, STAGE_DISPLAY],
+        "gesture_vote": 'streak_sum',
+        "gesture_vote_window": 10
+    }
+}
+
+
+class FrameContext:
+    """Everything the stages know about one camera frame"""
+
+    def __init__(self, frame, capture_time):
+        self.frame = frame                  # HxWx3 camera frame (RGB), overlays are drawn onto it in place
+        self.capture_time = capture_time    # time.perf_counter() at which the frame was received
+        self.converted = None               # Colour converted copy used for detection
+        self.feedback_fd = None             # Face detection result
+        self.face_ready = False             # Face present and worth authenticating
+        self.gesture = None                 # GestureDetectionStatus of the frame, if any
+        self.gesture_vote = NO_GESTURE      # Gesture decided by the vote, NO_GESTURE if undecided
+        self.display_image = None           # Image handed over to the GUI
+
+
+class FrameStage:
+    """
+    One step of the frame pipeline.
+    process() returns False when the stage had nothing to do, so the call is left out of the stage timing.
+    """
+    name = None
+
+    def __init__(self, enabled=True, metric_name=None):
+        self.enabled = enabled
+        self.timing_histogram = pipeline_metrics.get_registry().histogram(
+            metric_name or f'stage_{self.name}_ms', f'Time spent in the {self.name} stage of the frame pipeline'
+        )
+
+    def process(self, context):
+        raise NotImplementedError
+
+
+class OverlayStage(FrameStage):
+    """Draws the detection boxes received from the face processor onto the frame"""
+    name = STAGE_OVERLAY
+
+    def __init__(self, overlay_renderer, get_detections, enabled=True):
+        # Kept under the name the system panel and dashboards already use
+        super().__init__(enabled, metric_name='overlay_ms')
+        self.overlay_renderer = overlay_renderer
+        self.get_detections = get_detections
+
+    def process(self, context):
+        # NOTE: Detections only exist AFTER enrolment or authentication is triggered in face_processor.
+        #   In normal circumstances, there will not be any detected faces, so nothing will be drawn
+        detections = self.get_detections()
+        if not detections:
+            return False
+        self.overlay_renderer.draw(detections, context.frame)
+
+
+class ConvertStage(FrameStage):
+    """RGB camera frame to the channel order the detectors are fed with"""
+    name = STAGE_CONVERT
+
+    def __init__(self, buffer_pool, enabled=True):
+        super().__init__(enabled)
+        self.buffer_pool = buffer_pool
+
+    def process(self, context):
+        context.converted = self.buffer_pool.cvt_color('fd_compatible', context.frame, cv2.COLOR_BGR2RGB)
+
+
+class FaceDetectStage(FrameStage):
+    """Host-side face detection, feeds the face tracker and the quality gate"""
+    name = STAGE_DETECT_FACE
+
+    def __init__(self, buffer_pool, face_tracker=None, face_quality_gate=None, face_detector=None, enabled=True):
+        super().__init__(enabled)
+        self.buffer_pool = buffer_pool
+        self.face_tracker = face_tracker
+        self.face_quality_gate = face_quality_gate
+        self.face_detector = face_detector
+
+    def process(self, context):
+        context.feedback_fd = FaceDetectionProcessor.detect_face(
+            context.converted, buffer_pool=self.buffer_pool, face_detector=self.face_detector
+        )
+        if self.face_tracker is not None:
+            self.face_tracker.update(context.feedback_fd['faces'])
+
+        # The face processor is only signalled when the face is likely to be authenticated successfully
+        context.face_ready = context.feedback_fd['face_detected']
+        if context.face_ready and self.face_quality_gate is not None:
+            quality, _ = self.face_quality_gate.check(context.feedback_fd['faces'], context.feedback_fd['image'])
+            context.face_ready = quality == QUALITY_OK
+
+
+class GestureDetectStage(FrameStage):
+    """
+    MediaPipe hands gesture recognition (index finger, V-sign).
+    With a gesture engine, hands are tracked in video mode around the face found by the detect_face stage,
+    otherwise the static full-frame GestureProcessor.detect_gesture() of the previous variants is used.
+    """
+    name = STAGE_DETECT_GESTURE
+
+    def __init__(self, buffer_pool, gesture_engine=None, face_tracker=None, only_while_auth_pending=False, enabled=True):
+        super().__init__(enabled)
+        # Imported here as it loads the MediaPipe hands models, only needed by the gesture variants
+        from src.processor.gesture_processor_working import GestureProcessor
+        self.gesture_processor = GestureProcessor
+        self.buffer_pool = buffer_pool
+        self.gesture_engine = gesture_engine
+        self.face_tracker = face_tracker
+        self.only_while_auth_pending = only_while_auth_pending
+        self.skipped_counter = pipeline_metrics.get_registry().counter(
+            'gesture_inference_skipped', 'Frames without gesture inference as no authentication was pending'
+        )
+
+    def is_auth_pending(self, context):
+        """A face is in front of the camera and has not been accepted yet"""
+        if context.feedback_fd is None:
+            # No face stage in the pipeline, nothing to tell whether an authentication is pending
+            return True
+        if not context.feedback_fd['face_detected']:
+            return False
+        if self.face_tracker is None:
+            return True
+        track = self.face_tracker.get_primary_track()
+        return track is None or not self.face_tracker.is_authenticated(track.track_id)
+
+    def process(self, context):
+        if self.only_while_auth_pending and not self.is_auth_pending(context):
+            context.gesture = None
+            self.skipped_counter.inc()
+            return False
+
+        if self.gesture_engine is None:
+            # The annotated images of the previous variants were never displayed, so nothing is drawn here
+            context.gesture = self.gesture_processor.detect_gesture(context.converted)['gesture']
+        elif context.feedback_fd is not None:
+            # Reuse the mirrored frame and the faces of the detect_face stage
+            context.gesture = self.gesture_engine.detect(context.feedback_fd['image'], context.feedback_fd['faces'])
+        else:
+            mirrored_image = self.buffer_pool.flip('gesture_flipped', context.converted, 1)
+            context.gesture = self.gesture_engine.detect(mirrored_image)
+
+
+class GestureVoteStage(FrameStage):
+    """Smooths the per-frame gestures into a decision"""
+    name = STAGE_VOTE
+
+    def __init__(self, gesture_vote, enabled=True):
+        super().__init__(enabled)
+        self.gesture_vote = gesture_vote
+
+    def process(self, context):
+        gesture_value = context.gesture.value if context.gesture is not None else NO_GESTURE
+        context.gesture_vote = self.gesture_vote.update(gesture_value)
+
+
+class PublishStage(FrameStage):
+    """Hands the frame results over to the face processor through the in-memory feed channels"""
+    name = STAGE_PUBLISH
+
+    def __init__(self, publish_face=True, publish_gesture=False, camera_id=None, enabled=True):
+        super().__init__(enabled)
+        self.face_feed = get_feed_channel(FACE_FEED, camera_id) if publish_face else None
+        self.gesture_feed = get_feed_channel(GESTURE_FEED, camera_id) if publish_gesture else None
+
+    def process(self, context):
+        if self.face_feed is not None:
+            self.face_feed.publish(context.face_ready)
+        if self.gesture_feed is not None:
+            self.gesture_feed.publish(context.gesture_vote)
+
+
+class DisplayStage(FrameStage):
+    """Mirrors and resizes the frame for the GUI and queues it"""
+    name = STAGE_DISPLAY
+
+    def __init__(self, image_q, display_pipeline=None, feedback_size=(400, 600), prescale=1.0, enabled=True):
+        # Kept under the name the system panel and dashboards already use
+        super().__init__(enabled, metric_name='display_resize_ms')
+        self.image_q = image_q
+        self.display_pipeline = display_pipeline
+        self.feedback_size = feedback_size
+        self.prescale = prescale
+
+    def process(self, context):
+        if self.display_pipeline is not None:
+            # Frame is mirrored and letterboxed in a single pass, the GUI thread only has to blit it
+            display_image = self.display_pipeline.render(context.frame)
+        else:
+            mirrored_frame = cv2.flip(context.frame, 1)
+            if self.prescale != 1.0:
+                mirrored_frame = cv2.resize(mirrored_frame, (0, 0), fx=self.prescale, fy=self.prescale)
+            # Put the PIL Image in the queue, the GUI thread handles the PhotoImage creation
+            display_image = Image.fromarray(mirrored_frame).resize(self.feedback_size)
+
+        # Lets the GUI measure how long the frame waited in the queue
+        display_image.info['capture_time'] = context.capture_time
+        self.image_q.put(display_image)
+        context.display_image = display_image
+
+
+class FramePipeline:
+    """
+    Runs every camera frame through an ordered list of stages.
+    Stages can be turned on and off at runtime and each one is timed in the pipeline metrics (stage_<name>_ms).
+    """
+
+    def __init__(self, stages, variant=None):
+        self.stages = stages
+        self.variant = variant
+        self.frames_processed = 0
+
+    def process(self, frame, capture_time=None):
+        context = FrameContext(frame, capture_time or time.perf_counter())
+        for stage in self.stages:
+            if not stage.enabled:
+                continue
+            stage_start_time = time.perf_counter()
+            if stage.process(context) is not False:
+                stage.timing_histogram.observe_since(stage_start_time)
+        self.frames_processed += 1
+        return context
+
+    def get_stage(self, name):
+        for stage in self.stages:
+            if stage.name == name:
+                return stage
+        return None
+
+    def set_stage_enabled(self, name, enabled):
+        stage = self.get_stage(name)
+        if stage is None:
+            LOGGER.warning(f'Frame pipeline has no "{name}" stage')
+            return
+        stage.enabled = enabled
+        LOGGER.info(f'Frame pipeline stage "{name}" {"enabled" if enabled else "disabled"}')
+
+    def get_stage_timings(self):
+        return {stage.name: stage.timing_histogram.snapshot() for stage in self.stages}
+
+    def describe(self):
+        return ' -> '.join(stage.name if stage.enabled else f'({stage.name})' for stage in self.stages)
+
+
+def create_gesture_engine(config):
+    """Tracking gesture engine if selected by gesture_engine in the app config, None for the static detection"""
+    if config.gesture_engine != GESTURE_ENGINE_TRACKING:
+        return None
+    return GestureEngine(roi_enabled=config.gesture_roi_enabled is not False)
+
+
+def create_frame_pipeline(
+        config, image_q, buffer_pool, overlay_renderer, get_detections,
+        display_pipeline=None, face_tracker=None, face_quality_gate=None, face_detector=None
+):
+    """Build the pipeline of the variant selected by frame_pipeline_variant, stages are only created if used"""
+    variant_name = config.frame_pipeline_variant or 'face'
+    variant = FRAME_PIPELINE_VARIANTS.get(variant_name)
+    if variant is None:
+        LOGGER.error(f'Unknown frame pipeline variant "{variant_name}", using "face"')
+        variant_name, variant = 'face', FRAME_PIPELINE_VARIANTS['face']
+
+    disabled_stages = set(config.frame_pipeline_disabled_stages or [])
+    stage_names = variant["stages"]
+
+    stage_factories = {
+        STAGE_OVERLAY: lambda: OverlayStage(overlay_renderer, get_detections),
+        STAGE_CONVERT: lambda: ConvertStage(buffer_pool),
+        STAGE_DETECT_FACE: lambda: FaceDetectStage(buffer_pool, face_tracker, face_quality_gate, face_detector),
+        STAGE_DETECT_GESTURE: lambda: GestureDetectStage(
+            buffer_pool, create_gesture_engine(config), face_tracker, bool(config.gesture_only_while_auth_pending)
+        ),
+        # The window of a variant is part of how it votes (blocks of 3, streaks of 20 or 10), the configured window
+        # only applies to the variants without one
+        STAGE_VOTE: lambda: GestureVoteStage(create_gesture_vote(
+            variant.get("gesture_vote", 'passthrough'),
+            variant.get("gesture_vote_window") or config.gesture_vote_window, config.gesture_vote_quorum
+        )),
+        STAGE_PUBLISH: lambda: PublishStage(
+            publish_face=STAGE_DETECT_FACE in stage_names, publish_gesture=STAGE_DETECT_GESTURE in stage_names,
+            camera_id=config.camera_id
+        ),
+        STAGE_DISPLAY: lambda: DisplayStage(
+            image_q, display_pipeline, (config.image_feedback_size_x, config.image_feedback_size_y),
+            variant.get("display_prescale", 1.0)
+        )
+    }
+
+    stages = []
+    for stage_name in stage_names:
+        stage = stage_factories[stage_name]()
+        stage.enabled = stage_name not in disabled_stages
+        stages.append(stage)
+
+    frame_pipeline = FramePipeline(stages, variant_name)
+    LOGGER.info(f'Frame pipeline "{variant_name}": {frame_pipeline.describe()}')
+    return frame_pipeline
@@ -0,0 +1,309 @@
+import argparse
+import threading
+import time
+import numpy as np
+import cv2
+
+import src.logger.custom_logger as custom_logger
+
+LOGGER = custom_logger.get_logger()
+
+FRAME_SOURCE_LIVE = 'live'
+FRAME_SOURCE_FILE = 'file'
+
+REPLAY_SPEED_REAL = 'real'
+REPLAY_SPEED_MAX = 'max'
+
+
+class RecordedImage:
+    """Stand-in for the rsid_py image passed to preview callbacks (width, height, get_buffer())"""
+
+    def __init__(self, array):
+        self.array = array
+        self.height, self.width = array.shape[:2]
+
+    def get_buffer(self):
+        return self.array.reshape(-1)
+
+
+class LiveFrameSource:
+    """Frames from the F455 camera through rsid_py.Preview"""
+
+    def __init__(self, camera_number=-1):
+        self.camera_number = camera_number  # -1 means auto detect
+        self.preview = None
+
+    def start(self, on_image_available):
+        from src.processor.rsid_backend import rsid_py
+
+        preview_cfg = rsid_py.PreviewConfig()
+        preview_cfg.camera_number = self.camera_number
+        self.preview = rsid_py.Preview(preview_cfg)
+        self.preview.start(on_image_available)
+
+    def stop(self):
+        if self.preview is not None:
+            self.preview.stop()
+
+    def wait(self):
+        # Preview callbacks run on rsid_py's own thread, nothing to wait on
+        while True:
+            time.sleep(1)
+
+
+class FileFrameSource:
+    """
+    Replays a session captured by FrameRecorder.
+    In real-time mode frames are paced by their recorded timestamps, in max mode they are delivered back to back.
+    """
+
+    def __init__(self, path, speed=REPLAY_SPEED_REAL, loop=False):
+        self.path = path
+        self.speed = speed
+        self.loop = loop
+        self.stop_event = threading.Event()
+        self.replay_thread = None
+        self.frames_delivered = 0
+
+        recording = np.load(path)
+        self.encoded_frames = recording['encoded_frames']
+        self.offsets = recording['offsets']
+        self.timestamps = recording['timestamps']
+        # Device authentication status of every frame, recorded with record --label-auth. None if not labelled
+        self.auth_statuses = recording['auth_statuses'] if 'auth_statuses' in recording.files else None
+        LOGGER.info(f'Loaded {len(self)} recorded frames from {path}')
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def decode_frame(self, index):
+        encoded_frame = self.encoded_frames[self.offsets[index]:self.offsets[index + 1]]
+        return cv2.imdecode(encoded_frame, cv2.IMREAD_COLOR)
+
+    def iter_frames(self):
+        """Decoded frames, in order, without any pacing"""
+        for index in range(len(self)):
+            yield self.decode_frame(index)
+
+    def start(self, on_image_available):
+        self.stop_event.clear()
+        self.replay_thread = threading.Thread(target=self._replay, args=(on_image_available,), daemon=True)
+        self.replay_thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def wait(self):
+        self.replay_thread.join()
+
+    def _replay(self, on_image_available):
+        while not self.stop_event.is_set():
+            replay_start_time = time.perf_counter()
+            for index in range(len(self)):
+                if self.stop_event.is_set():
+                    return
+
+                if self.speed == REPLAY_SPEED_REAL:
+                    delay = (self.timestamps[index] - self.timestamps[0]) - (time.perf_counter() - replay_start_time)
+                    if delay > 0:
+                        time.sleep(delay)
+
+                on_image_available(RecordedImage(self.decode_frame(index)))
+                self.frames_delivered += 1
+
+            if not self.loop:
+                LOGGER.info(f'Replay of {self.path} finished, {self.frames_delivered} frames delivered')
+                return
+
+
+class FrameRecorder:
+    """
+    Captures camera frames to disk for later replay, wraps the preview callback so the app keeps running
+    normally while recording.
+    Frames are JPEG (or PNG for lossless) encoded and saved with their timestamps into a compressed NPZ.
+    Frames can also be labelled with the status of the device authentication running while they were captured, which
+    gives the outcome an attempt started on that frame would have had.
+    """
+
+    def __init__(self, path, max_frames=600, encoding='.jpg', jpeg_quality=90):
+        self.path = path
+        self.max_frames = max_frames
+        self.encoding = encoding
+        self.encode_params = [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality] if encoding == '.jpg' else []
+        self.encoded_frames = []
+        self.timestamps = []
+        # Frame index -> AuthenticateStatus member name
+        self.auth_statuses = {}
+        self.start_time = None
+        self.saved = False
+        self.lock = threading.Lock()
+
+    def wrap(self, on_image_available):
+        def _on_image_available(image):
+            self.record(image)
+            on_image_available(image)
+        return _on_image_available
+
+    def record(self, image):
+        if self.saved:
+            return
+
+        # Encode before the frame is handed on, detection boxes get drawn onto the camera buffer
+        array = np.asarray(memoryview(image.get_buffer()), dtype=np.uint8).reshape((image.height, image.width, -1))
+        success, encoded_frame = cv2.imencode(self.encoding, array, self.encode_params)
+        if not success:
+            LOGGER.warning('Failed to encode frame for recording')
+            return
+
+        now = time.perf_counter()
+        with self.lock:
+            if self.start_time is None:
+                self.start_time = now
+            self.encoded_frames.append(encoded_frame.reshape(-1))
+            self.timestamps.append(now - self.start_time)
+            frames_recorded = len(self.timestamps)
+
+        if frames_recorded >= self.max_frames:
+            self.save()
+
+    def get_frame_count(self):
+        with self.lock:
+            return len(self.timestamps)
+
+    def label_auth_status(self, first_frame, status):
+        """Label the frames recorded since first_frame with the status of the device authentication they ran under"""
+        with self.lock:
+            for index in range(first_frame, len(self.timestamps)):
+                self.auth_statuses[index] = status.name
+
+    def save(self):
+        with self.lock:
+            if self.saved or not self.timestamps:
+                return
+            self.saved = True
+            offsets = np.zeros(len(self.encoded_frames) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum([len(encoded_frame) for encoded_frame in self.encoded_frames])
+            arrays = {}
+            if self.auth_statuses:
+                # Frames past the last attempt with a result are left unlabelled
+                arrays["auth_statuses"] = np.asarray(
+                    [self.auth_statuses.get(index, '') for index in range(len(self.timestamps))]
+                )
+            np.savez_compressed(
+                self.path,
+                encoded_frames=np.concatenate(self.encoded_frames),
+                offsets=offsets,
+                timestamps=np.asarray(self.timestamps, dtype=np.float64),
+                **arrays
+            )
+        LOGGER.info(f'Recorded {len(self.timestamps)} frames to {self.path}')
+
+
+def create_frame_source(config):
+    """Frame source selected by the app configuration, defaults to the live camera"""
+    if config.frame_source == FRAME_SOURCE_FILE:
+        LOGGER.info(f'Using recorded frame source: {config.frame_source_path}')
+        return FileFrameSource(
+            config.frame_source_path,
+            speed=config.frame_source_speed or REPLAY_SPEED_REAL,
+            loop=bool(config.frame_source_loop)
+        )
+    # Each camera of a multi-camera station previews its own device, -1 auto detects the only one
+    camera_number = config.preview_camera_number
+    return LiveFrameSource(camera_number if camera_number is not None else -1)
+
+
+def create_frame_recorder(config):
+    """Frame recorder if recording is turned on in the app configuration, else None"""
+    if not config.frame_record_path:
+        return None
+    LOGGER.info(f'Recording camera frames to: {config.frame_record_path}')
+    return FrameRecorder(config.frame_record_path, max_frames=config.frame_record_max_frames or 600)
+
+
+def label_auth_statuses(recorder, port):
+    """
+    Run device authentications back to back while recording, every frame gets the status of the attempt it was
+    captured during. Returns once the recording is saved
+    """
+    from src.processor.rsid_backend import rsid_py
+
+    with rsid_py.FaceAuthenticator(port) as authenticator:
+        while not recorder.saved:
+            first_frame = recorder.get_frame_count()
+            statuses = []
+            authenticator.extract_faceprints_for_auth(on_result=lambda status, faceprints: statuses.append(status))
+            if statuses:
+                recorder.label_auth_status(first_frame, statuses[0])
+
+
+def benchmark(path, draw_detections=True):
+    """Replay a recording at max speed through detection, overlay and display preparation"""
+    from types import SimpleNamespace
+    from src.processor.face_detection_processor import FaceDetectionProcessor
+    from src.processor.face_detection_status import FaceDetectionStatus
+    from src.processor.overlay_renderer import OverlayRenderer
+    from src.processor.display_pipeline import DisplayPipeline
+
+    frame_source = FileFrameSource(path, speed=REPLAY_SPEED_MAX)
+    overlay_renderer = OverlayRenderer()
+    display_pipeline = DisplayPipeline(280, 420)
+    detections = [{'face': SimpleNamespace(x=340, y=700, w=400, h=500), 'status': FaceDetectionStatus.PENDING}]
+    stage_totals = {"detect_ms": 0.0, "overlay_ms": 0.0, "display_ms": 0.0}
+    faces_detected = 0
+
+    start_time = time.perf_counter()
+    for frame in frame_source.iter_frames():
+        stage_start_time = time.perf_counter()
+        if draw_detections:
+            overlay_renderer.draw(detections, frame)
+        overlay_end_time = time.perf_counter()
+        result = FaceDetectionProcessor.detect_face(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        faces_detected += 1 if result['face_detected'] else 0
+        detect_end_time = time.perf_counter()
+        display_pipeline.render(frame)
+        display_end_time = time.perf_counter()
+
+        stage_totals["overlay_ms"] += (overlay_end_time - stage_start_time) * 1000
+        stage_totals["detect_ms"] += (detect_end_time - overlay_end_time) * 1000
+        stage_totals["display_ms"] += (display_end_time - detect_end_time) * 1000
+    elapsed = time.perf_counter() - start_time
+
+    total_frames = len(frame_source)
+    print(f'Frames: {total_frames}, throughput: {total_frames / elapsed:.1f} fps, faces detected in {faces_detected} frames')
+    for stage, total_ms in stage_totals.items():
+        print(f'  {stage}: {total_ms / max(total_frames, 1):.3f} ms/frame')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Record camera sessions to disk and replay them for benchmarking')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    record_parser = subparsers.add_parser('record', help='record frames from the live camera')
+    record_parser.add_argument('path')
+    record_parser.add_argument('--frames', type=int, default=300)
+    record_parser.add_argument(
+        '--label-auth', metavar='PORT',
+        help='run device authentications on PORT while recording and label the frames with their status'
+    )
+
+    benchmark_parser = subparsers.add_parser('benchmark', help='replay a recording through the frame pipeline at max speed')
+    benchmark_parser.add_argument('path')
+    benchmark_parser.add_argument('--no-overlay', action='store_true')
+
+    args = parser.parse_args()
+    if args.command == 'record':
+        recorder = FrameRecorder(args.path, max_frames=args.frames)
+        live_source = LiveFrameSource()
+        live_source.start(recorder.record)
+        if args.label_auth:
+            label_auth_statuses(recorder, args.label_auth)
+        while not recorder.saved:
+            time.sleep(0.5)
+        live_source.stop()
+    else:
+        benchmark(args.path, draw_detections=not args.no_overlay)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+import threading
+import time
+
+import numpy as np
+
+import src.logger.custom_logger as custom_logger
+from src.utility import pipeline_metrics
+
+LOGGER = custom_logger.get_logger()
+
+
+class Gallery:
+    """
+    Enrolled faceprints by employee ID, shared by the face processors of every camera.
+
+    A multi-camera station keeps a single copy of the gallery in memory and fetches it once per resync, whatever the
+    number of cameras. Loads requested by several cameras at once (startup, daily resync) are served by the first one:
+    the others wait for it and reuse its records unless they are older than min_reload_seconds.
+    """
+
+    def __init__(self, min_reload_seconds=60.0):
+        self.min_reload_seconds = min_reload_seconds
+        self.faceprints = None
+        self.loaded_at = None
+        self.lock = threading.Lock()
+        # Enrolment descriptors as one matrix for vectorised host-side scoring, built on first use after a load
+        self.features = None
+
+        self.metrics = pipeline_metrics.get_registry(scoped=False)
+        self.load_counter = self.metrics.counter('gallery_loads', 'Faceprint records fetched from the DB')
+        self.load_histogram = self.metrics.histogram('gallery_load_ms', 'Time spent fetching the faceprint records')
+        self.metrics.gauge('gallery_employees', 'Employees in the gallery', lambda: len(self.faceprints or {}))
+
+    def load(self, fetch, force=False):
+        """
+        Fetch the gallery with fetch() -> {employee_id: [Faceprints]}, unless it was just loaded.
+        :param force: fetch even if the gallery was loaded moments ago, e.g. a resync requested on the GUI
+        :return: the faceprints
+        """
+        with self.lock:
+            if not force and self.faceprints is not None and \
+                    time.perf_counter() - self.loaded_at < self.min_reload_seconds:
+                LOGGER.debug('Gallery loaded moments ago, reusing it')
+                return self.faceprints
+            load_start_time = time.perf_counter()
+            faceprints = fetch()
+            self.load_histogram.observe_since(load_start_time)
+            self.load_counter.inc()
+            # Readers iterate over the previous dict until the reference is swapped
+            self.faceprints = faceprints
+            self.features = None
+            self.loaded_at = time.perf_counter()
+            return self.faceprints
+
+    def get_features(self):
+        """
+        (employee_ids, matrix) of every enrolled faceprint: one L2-normalised enrolment descriptor per row, with the
+        employee ID of each row. Empty when nothing is enrolled.
+        """
+        with self.lock:
+            if self.features is None:
+                employee_ids = []
+                descriptors = []
+                for employee_id, faceprint_list in (self.faceprints or {}).items():
+                    for faceprint in faceprint_list:
+                        employee_ids.append(employee_id)
+                        descriptors.append(faceprint.enroll_descriptor)
+                self.features = (employee_ids, normalize_features(descriptors))
+            return self.features
+
+
+def normalize_features(descriptors):
+    """Feature vectors as a float32 matrix with L2-normalised rows, cosine similarity is then a dot product"""
+    if not len(descriptors):
+        return np.zeros((0, 0), dtype=np.float32)
+    matrix = np.asarray(descriptors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+_gallery = None
+_gallery_lock = threading.Lock()
+
+
+def get_gallery():
+    """Gallery shared by every face processor of the app"""
+    global _gallery
+    with _gallery_lock:
+        if _gallery is None:
+            _gallery = Gallery()
+        return _gallery
+
+
+def main():
+    # Gallery memory and DB fetches of a multi-camera station, one gallery per camera vs the shared one
+    import tracemalloc
+    from concurrent.futures import ThreadPoolExecutor
+    from src.simulator import rsid_py
+
+    employees = 2000
+    fetch_seconds = 0.2
+    records = rsid_py.generate_faceprint_records([f'E{index:05d}' for index in range(employees)])
+
+    fetches = []
+
+    def fetch():
+        fetches.append(1)
+        # DB round trip, then the records are turned into faceprints like FaceProcessor does
+        time.sleep(fetch_seconds)
+        faceprints = {}
+        for record in records:
+            faceprint = rsid_py.Faceprints()
+            faceprint.adaptive_descriptor_nomask = list(record["adaptive_descriptor_nomask"])
+            faceprint.enroll_descriptor = list(record["enroll_descriptor"])
+            faceprints.setdefault(record["employee_id"], []).append(faceprint)
+        return faceprints
+
+    print(f'{"cameras":>7} {"galleries":>9} {"fetches":>7} {"startup s":>9} {"memory MB":>9}')
+    for cameras in (1, 2, 4):
+        for shared in (False, True):
+            del fetches[:]
+            shared_gallery = Gallery()
+            galleries = [shared_gallery if shared else Gallery() for _ in range(cameras)]
+            tracemalloc.start()
+            start = time.perf_counter()
+            # Every camera loads its gallery when its face processor starts
+            with ThreadPoolExecutor(cameras) as executor:
+                list(executor.map(lambda gallery: gallery.load(fetch), galleries))
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            label = 'shared' if shared else 'each'
+            print(f'{cameras:>7} {label:>9} {len(fetches):>7} {elapsed:>9.2f} {peak / 1e6:>9.1f}')
+
+
+if __name__ == '__main__':
+    main()
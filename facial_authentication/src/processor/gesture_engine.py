@@ -0,0 +1,121 @@
+import argparse
+import time
+import cv2
+
+import src.logger.custom_logger as custom_logger
+from src.processor import finger_states
+
+LOGGER = custom_logger.get_logger()
+
+GESTURE_ENGINE_STATIC = 'static'
+GESTURE_ENGINE_TRACKING = 'tracking'
+
+
+class GestureEngine:
+    """
+    Hand gesture recognition in MediaPipe tracking mode, restricted to the region around the detected face.
+
+    GestureProcessor.detect_gesture() runs the static-image Hands model, which re-runs palm detection on the full
+    frame every time. Here the video-mode instance (hands_videos) is used instead, so hand landmarks are tracked from
+    frame to frame, and only the area where a raised hand can be (beside and below the face) is processed.
+    Fingers are counted with the vectorised rules of finger_states, which give the same gestures as GestureProcessor.
+    """
+    # ROI around the face box, in face widths (left/right) and face heights (above/below)
+    ROI_SIDE = 1.5
+    ROI_ABOVE = 0.5
+    ROI_BELOW = 2.5
+
+    # ROI corners are snapped to this grid so the tracked input does not jitter with the face box
+    ROI_GRID = 32
+
+    def __init__(self, hands=None, roi_enabled=True):
+        # Imported here as it loads the MediaPipe hands models
+        from src.processor.gesture_processor_working import GestureProcessor, hands_videos
+
+        self.gesture_processor = GestureProcessor
+        self.hands = hands or hands_videos
+        self.roi_enabled = roi_enabled
+        self.last_roi = None
+
+    def get_roi(self, faces, image_shape):
+        image_height, image_width = image_shape[:2]
+        if not self.roi_enabled or not faces:
+            return 0, 0, image_width, image_height
+
+        face = max(faces, key=lambda f: f.w * f.h)
+        grid = GestureEngine.ROI_GRID
+        x1 = int(face.x - face.w * GestureEngine.ROI_SIDE) // grid * grid
+        y1 = int(face.y - face.h * GestureEngine.ROI_ABOVE) // grid * grid
+        x2 = -(-int(face.x + face.w * (1 + GestureEngine.ROI_SIDE)) // grid) * grid
+        y2 = -(-int(face.y + face.h * (1 + GestureEngine.ROI_BELOW)) // grid) * grid
+        return max(x1, 0), max(y1, 0), min(x2, image_width), min(y2, image_height)
+
+    def detect(self, image, faces=None):
+        """
+        :param image: mirrored frame in the channel order GestureProcessor expects (BGR)
+        :param faces: faces detected in the same frame, the ROI is anchored on the largest one
+        :return: GestureDetectionStatus or None
+        """
+        x1, y1, x2, y2 = self.get_roi(faces, image.shape)
+        if x2 <= x1 or y2 <= y1:
+            return None
+        self.last_roi = (x1, y1, x2, y2)
+
+        roi_image = image[y1:y2, x1:x2]
+        results = self.hands.process(cv2.cvtColor(roi_image, cv2.COLOR_BGR2RGB))
+
+        # Same rule as GestureProcessor.detect_gesture(), exactly one hand in view
+        if not results.multi_handedness or len(results.multi_handedness) != 1:
+            return None
+
+        return finger_states.detect_gesture(results)
+
+
+def main():
+    # FPS and CPU of the static full-frame gesture detection against the tracking engine on a recording
+    import psutil
+    from types import SimpleNamespace
+    from src.processor.frame_source import FileFrameSource
+    from src.processor.face_detectors import create_face_detector
+
+    parser = argparse.ArgumentParser(description='Compare static and tracking gesture detection on a recording')
+    parser.add_argument('recording', help='recording made with frame_source.py record')
+    args = parser.parse_args()
+
+    face_detector = create_face_detector(SimpleNamespace(
+        face_detector_backend='mediapipe', face_detector_min_confidence=0.5,
+        face_detector_input_width=320, face_detector_yunet_model_path=None
+    ))
+    # Mirrored, colour swapped frames, exactly what the frame pipeline hands to the gesture stage
+    frames = [cv2.flip(frame, 1) for frame in FileFrameSource(args.recording).iter_frames()]
+    faces_per_frame = [face_detector.detect(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)) for frame in frames]
+
+    engine = GestureEngine()
+    process = psutil.Process()
+    candidates = {
+        # detect_gesture() flips the image itself, so it is given the unmirrored frame
+        GESTURE_ENGINE_STATIC: lambda frame, faces: engine.gesture_processor.detect_gesture(cv2.flip(frame, 1))['gesture'],
+        GESTURE_ENGINE_TRACKING: lambda frame, faces: engine.detect(frame, faces)
+    }
+
+    results = {}
+    for name, detect in candidates.items():
+        cpu_start = sum(process.cpu_times()[:2])
+        start_time = time.perf_counter()
+        results[name] = [detect(frame, faces) for frame, faces in zip(frames, faces_per_frame)]
+        elapsed = time.perf_counter() - start_time
+        cpu_seconds = sum(process.cpu_times()[:2]) - cpu_start
+        recognized = sum(1 for gesture in results[name] if gesture is not None)
+        print(
+            f'{name:>8}: {len(frames) / elapsed:.1f} fps, CPU {100.0 * cpu_seconds / elapsed:.0f}%, '
+            f'gestures recognized in {recognized}/{len(frames)} frames'
+        )
+
+    agreement = sum(
+        1 for static, tracking in zip(results[GESTURE_ENGINE_STATIC], results[GESTURE_ENGINE_TRACKING]) if static == tracking
+    )
+    print(f'Agreement: {100.0 * agreement / max(len(frames), 1):.1f}%')
+
+
+if __name__ == '__main__':
+    main()
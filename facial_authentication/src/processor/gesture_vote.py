@@ -0,0 +1,218 @@
+from datetime import datetime
+import numpy as np
+
+import src.logger.custom_logger as custom_logger
+
+LOGGER = custom_logger.get_logger()
+
+# Vote values, 0 means no gesture (published as "None")
+NO_GESTURE = 0
+
+
+class PassthroughGestureVote:
+    """No voting, the gesture of every frame is published as is (image_processor_original/working2)"""
+    name = 'passthrough'
+
+    def update(self, gesture_value):
+        return gesture_value
+
+    def reset(self):
+        pass
+
+
+class TimeOverrideGestureVote(PassthroughGestureVote):
+    """
+    Any gesture is forced to clock in during the morning and to clock out during the evening (image_processor_time):
+        07:00-07:59 and 08:00-08:20 -> 1, 17:00-17:59 -> 2, otherwise the gesture itself
+    """
+    name = 'time_override'
+
+    def update(self, gesture_value):
+        if gesture_value == NO_GESTURE:
+            return NO_GESTURE
+
+        time_now = datetime.now()
+        if time_now.hour == 17:
+            return 2
+        if time_now.hour == 7 or (time_now.hour == 8 and 20 >= time_now.minute >= 0):
+            return 1
+        return gesture_value
+
+
+class BlockModeGestureVote:
+    """
+    Most frequent value over consecutive blocks of window frames, frames without a gesture vote for 0
+    (image_processor_pop, window of 3). Ties go to the lower value.
+    """
+    name = 'block_mode'
+
+    def __init__(self, window=3):
+        self.window = window
+        self.counts = [0, 0, 0]
+        self.total = 0
+
+    def update(self, gesture_value):
+        self.counts[gesture_value] += 1
+        self.total += 1
+        if self.total < self.window:
+            return NO_GESTURE
+
+        result = self.counts.index(max(self.counts))
+        self.reset()
+        return result
+
+    def reset(self):
+        self.counts = [0, 0, 0]
+        self.total = 0
+
+
+class StreakModeGestureVote:
+    """
+    Decides once a streak of window consecutive gesture frames is reached, any frame without a gesture resets
+    the streak (image_processor_nonpop, window of 20): 2 if V-signs are the majority, otherwise 1.
+    """
+    name = 'streak_mode'
+
+    def __init__(self, window=20):
+        self.window = window
+        self.counts = [0, 0, 0]
+        self.total = 0
+
+    def update(self, gesture_value):
+        if gesture_value == NO_GESTURE:
+            self.reset()
+            return NO_GESTURE
+
+        self.counts[gesture_value] += 1
+        self.total += 1
+        # Only the frame completing the streak publishes, the streak keeps growing until it is broken
+        if self.total != self.window:
+            return NO_GESTURE
+        return 2 if self.counts[2] > self.counts[1] else 1
+
+    def reset(self):
+        self.counts = [0, 0, 0]
+        self.total = 0
+
+
+class StreakSumGestureVote(StreakModeGestureVote):
+    """
+    Sums a streak of window consecutive gesture frames (1 per index finger, 2 per V-sign), any frame without a
+    gesture resets the streak (backup/image_processor_array, window of 10):
+        sum > 17 -> 2, 10 <= sum <= 15 -> 1, anything in between is ambiguous and dropped
+    """
+    name = 'streak_sum'
+
+    def __init__(self, window=10):
+        super().__init__(window)
+
+    def update(self, gesture_value):
+        if gesture_value == NO_GESTURE:
+            self.reset()
+            return NO_GESTURE
+
+        self.counts[gesture_value] += 1
+        self.total += 1
+        if self.total < self.window:
+            return NO_GESTURE
+
+        streak_sum = self.counts[1] + 2 * self.counts[2]
+        LOGGER.gesture(f"Gesture streak: {self.counts[1]}x1, {self.counts[2]}x2, sum={streak_sum}")
+        self.reset()
+        if streak_sum > 17:
+            return 2
+        if 15 >= streak_sum >= 10:
+            return 1
+        return NO_GESTURE
+
+
+class RingBufferGestureVote:
+    """
+    Sliding vote over the last window frames, kept in a fixed-size NumPy ring buffer.
+    Class counts are updated incrementally (one slot in, one slot out), so a frame costs O(1) whatever the window,
+    instead of rebuilding the buffer_array list and counting it on every frame.
+    A gesture wins once it fills at least quorum (fraction of the window) of the slots, frames without a gesture
+    take up slots too, so a hand that is put down stops the vote on its own.
+    """
+    name = 'ring'
+
+    def __init__(self, window=10, quorum=0.6, classes=3):
+        self.window = window
+        self.quorum_count = max(1, int(np.ceil(quorum * window)))
+        self.buffer = np.zeros(window, dtype=np.int8)
+        # Plain list, NumPy scalar indexing would cost more than the counting itself
+        self.counts = [0] * classes
+        self.position = 0
+        self.filled = 0
+
+    def update(self, gesture_value):
+        if self.filled == self.window:
+            self.counts[self.buffer.item(self.position)] -= 1
+        else:
+            self.filled += 1
+        self.buffer[self.position] = gesture_value
+        self.counts[gesture_value] += 1
+        self.position = (self.position + 1) % self.window
+        return self.get_result()
+
+    def get_result(self):
+        # Ties go to the lower gesture value, like the block mode
+        winner = self.counts.index(max(self.counts[1:]), 1)
+        return winner if self.counts[winner] >= self.quorum_count else NO_GESTURE
+
+    def reset(self):
+        self.buffer[:] = NO_GESTURE
+        self.counts = [0] * len(self.counts)
+        self.position = 0
+        self.filled = 0
+
+
+GESTURE_VOTES = {
+    vote_class.name: vote_class for vote_class in (
+        PassthroughGestureVote, TimeOverrideGestureVote, BlockModeGestureVote, StreakModeGestureVote, StreakSumGestureVote,
+        RingBufferGestureVote
+    )
+}
+
+
+def create_gesture_vote(name, window=None, quorum=None):
+    vote_class = GESTURE_VOTES.get(name)
+    if vote_class is None:
+        LOGGER.error(f'Unknown gesture vote "{name}", falling back to passthrough')
+        vote_class = PassthroughGestureVote
+    if vote_class is RingBufferGestureVote:
+        return RingBufferGestureVote(window or 10, quorum or 0.6)
+    if window and vote_class not in (PassthroughGestureVote, TimeOverrideGestureVote):
+        return vote_class(window)
+    return vote_class()
+
+
+def main():
+    # Per-frame cost of the ring buffer vote against the buffer_array list vote of image_processor_pop/nonpop
+    import timeit
+
+    frames = np.random.default_rng(0).choice([0, 1, 2], size=10000, p=[0.5, 0.3, 0.2]).tolist()
+    for window in (10, 20, 60):
+        def list_vote():
+            buffer_array = []
+            for gesture_value in frames:
+                buffer_array.append(gesture_value)
+                if len(buffer_array) > window:
+                    buffer_array = buffer_array[1:]
+                max(set(buffer_array), key=buffer_array.count)
+
+        def ring_vote():
+            vote = RingBufferGestureVote(window)
+            for gesture_value in frames:
+                vote.update(gesture_value)
+
+        list_seconds = min(timeit.repeat(list_vote, number=1, repeat=3))
+        ring_seconds = min(timeit.repeat(ring_vote, number=1, repeat=3))
+        print(
+            f'window {window:>3}: list {1e6 * list_seconds / len(frames):.2f} us/frame, '
+            f'ring {1e6 * ring_seconds / len(frames):.2f} us/frame'
+        )
+
+
+if __name__ == '__main__':
+    main()
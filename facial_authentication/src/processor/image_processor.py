@@ -6,14 +6,22 @@ import time
 import json
 from PIL import Image, ImageTk
 import numpy as np
-import rsid_py
 from datetime import datetime
 
 import src.utility.gui_feedback_color_utility as color_utility
 import src.logger.custom_logger as custom_logger
+from src.utility import pipeline_metrics
 from src.processor.face_detection_processor import FaceDetectionProcessor
 from src.processor.face_processor import FaceProcessor
 from src.processor.face_detection_status import FaceDetectionStatus
+from src.processor.display_pipeline import DisplayPipeline
+from src.processor.overlay_renderer import OverlayRenderer
+from src.processor.frame_source import create_frame_source, create_frame_recorder
+from src.processor.frame_buffer_pool import FrameBufferPool
+from src.processor.face_detectors import create_face_detector
+from src.processor import face_tracker as face_tracker_module
+from src.processor.face_quality_gate import create_face_quality_gate
+from src.processor.frame_pipeline import create_frame_pipeline
 
 LOGGER = custom_logger.get_logger()
 
@@ -31,7 +39,7 @@ except ImportError:
 
 
 class ImageProcessor(threading.Thread):
-    def __init__(self, feedback_livestream_image_q, feedback_livestream_detections_q, config):
+    def __init__(self, feedback_livestream_image_q, feedback_livestream_detections_q, config, face_tracker=None):
         LOGGER.info("ImageProcessor init...")
         super().__init__()
 
@@ -45,6 +53,49 @@ class ImageProcessor(threading.Thread):
         # Initialized required properties
         self.livestream_detections = []  # Initializing
 
+        # Draws the detection boxes in place, blending only the box ROI and reusing cached label sprites
+        self.overlay_renderer = OverlayRenderer()
+
+        # Face detector backend used to tell the face processor whether a face is present. Detectors keep per-stream
+        # state (MediaPipe graphs), so each camera pipeline has its own
+        self.face_detector = create_face_detector(self.config)
+        FaceDetectionProcessor.set_face_detector(self.face_detector)
+
+        # Follows the detected faces across frames, shared with the face processor
+        self.face_tracker = face_tracker
+        if self.face_tracker is None and self.config.face_tracker_enabled:
+            self.face_tracker = face_tracker_module.get_tracker(self.config)
+
+        # Holds back faces that are unlikely to pass the device checks (too far, off centre, blurry, turned away)
+        self.face_quality_gate = create_face_quality_gate(self.config)
+
+        # Working arrays reused across frames, OpenCV writes into them instead of allocating new frames
+        self.buffer_pool = FrameBufferPool()
+
+        # Single-pass display pipeline, frames are letterboxed to the GUI display size on this thread
+        self.display_pipeline = None
+        if self.config.display_pipeline_enabled:
+            self.display_pipeline = DisplayPipeline(self.config.display_size_x, self.config.display_size_y)
+
+        # Convert, detect, vote, overlay, publish and display stages run on every frame, the stages used are
+        # selected by frame_pipeline_variant in the app config
+        self.frame_pipeline = create_frame_pipeline(
+            self.config, self.feedback_livestream_image_q, self.buffer_pool, self.overlay_renderer,
+            lambda: self.livestream_detections, self.display_pipeline, self.face_tracker, self.face_quality_gate,
+            self.face_detector
+        )
+
+        # Live camera by default, recorded sessions can be replayed instead (see frame_source in the app config)
+        self.frame_source = create_frame_source(self.config)
+        # Optional recorder, captures the incoming frames to disk for later replay
+        self.frame_recorder = create_frame_recorder(self.config)
+
+        # Frame pipeline metrics, exported through the system panel and the metrics HTTP server
+        self.metrics = pipeline_metrics.get_registry()
+        self.capture_meter = self.metrics.meter('capture_frames', 'Frames received from the camera')
+        self.frame_histogram = self.metrics.histogram('frame_processing_ms', 'Total time spent on a frame by the image processor')
+        self.metrics.gauge('image_queue_depth', 'Frames waiting to be displayed', self.feedback_livestream_image_q.qsize)
+
         # TODO: [debugger], set to True to printout live image properties parsed by the camera
         self.debug_printout_preview_image_properties = False
         # TODO: [debugger] set to True to preview live images parse by the camera
@@ -65,12 +116,12 @@ class ImageProcessor(threading.Thread):
         # Initialize and start status msg and faces detected updater
         self.poll_feedback_livestream_detections_q()
 
-        preview_cfg = rsid_py.PreviewConfig()
-        preview_cfg.camera_number = -1  # -1 means auto detect
-        preview = rsid_py.Preview(preview_cfg)
-        preview.start(self.on_image_available)
-        while True:
-            time.sleep(1)
+        on_image_available = self.on_image_available
+        if self.frame_recorder is not None:
+            on_image_available = self.frame_recorder.wrap(on_image_available)
+
+        self.frame_source.start(on_image_available)
+        self.frame_source.wait()
 
     def poll_feedback_livestream_detections_q(self):
         def _poll_feedback_livestream_detections_q():
@@ -171,56 +222,26 @@ class ImageProcessor(threading.Thread):
 
         return image
 
-    def create_tk_image_safely(self, cv2_image):
-        """
-        Thread-safe method to create Tkinter PhotoImage
-        Put the PIL Image in the queue instead of PhotoImage, let the GUI thread handle PhotoImage creation
-        """
-        try:
-            # Convert CV2 image to PIL Image
-            livestream_image = Image.fromarray(cv2_image)
-            livestream_image = livestream_image.resize((self.config.image_feedback_size_x, self.config.image_feedback_size_y))
-            
-            # Put the PIL Image directly in the queue - let the GUI handle PhotoImage creation
-            self.feedback_livestream_image_q.put(livestream_image)
-                
-        except Exception as e:
-            LOGGER.error(f"Error in create_tk_image_safely: {e}")
-
     def on_image_available(self, image):
         try:
+            frame_start_time = time.perf_counter()
+            self.capture_meter.mark()
+
             # Operations to prepare RGB image
             buffer = memoryview(image.get_buffer())
             arr = np.asarray(buffer, dtype=np.uint8)
             array2d = arr.reshape((image.height, image.width, -1))
 
-            if self.livestream_detections:
-                # Draw detection box around faces detected in the livestream onto the RGB image
-                # NOTE: The drawing of the detection box occurring will only happen
-                #   AFTER enrolment or authentication is triggered in face_processor.
-                #   In normal circumstances, there will not be any detected faces, so nothing will be drawn
-                for detection in self.livestream_detections:   # Processing
-                    ImageProcessor.draw_detection_box_on_image(detection, array2d)
-
-            fd_compatible_image = array2d
-            fd_compatible_image = cv2.cvtColor(fd_compatible_image, cv2.COLOR_BGR2RGB)
-
-            self.feedback_fd = FaceDetectionProcessor.detect_face(fd_compatible_image)
+            context = self.frame_pipeline.process(array2d, frame_start_time)
+            self.feedback_fd = context.feedback_fd
+            self.feedback_gesture = context.gesture_vote
+            self.frame_histogram.observe_since(frame_start_time)
 
-            if self.feedback_fd['face_detected'] is not None:
-                f = open('./write/feed_fd_temp.txt', 'w')
-                f.write(str(self.feedback_fd['face_detected']))
-                f.close()
-            else:
-                f = open('./write/feed_fd_temp.txt', 'w')
-                f.write(str(self.feedback_fd['face_detected']))
-                f.close()
+            if not self.is_debug_enabled():
+                return
 
             cv2_image = cv2.flip(array2d, 1)
 
-            # Use thread-safe method to create Tkinter PhotoImage
-            self.create_tk_image_safely(cv2_image)
-
             if self.debug_printout_preview_image_properties:
                 ImageProcessor.print_image_properties(cv2_image)
 
@@ -245,6 +266,13 @@ class ImageProcessor(threading.Thread):
             LOGGER.critical(traceback.format_exc())
             LOGGER.critical(f"-" * 60)
 
+    def is_debug_enabled(self):
+        return (
+            self.debug_printout_preview_image_properties
+            or self.debug_preview_camera_image_enabled
+            or self.debug_save_previewed_image
+        )
+
     @staticmethod
     def preview_camera_image(cv2_image):
         window_name = "Camera Image Previewer"
@@ -0,0 +1,209 @@
+import queue
+import threading
+import time
+
+import src.logger.custom_logger as custom_logger
+from src.utility import pipeline_metrics
+
+LOGGER = custom_logger.get_logger()
+
+
+class MatcherPool:
+    """
+    Matcher threads shared by the match pipelines of every camera.
+    Matching is host CPU work against the one shared gallery, a pool sized for the host serves all the cameras instead
+    of each camera running its own idle matchers.
+    """
+
+    def __init__(self, workers=1):
+        self.workers = workers
+        self.pending_q = queue.Queue()
+        self.threads = []
+        self.lock = threading.Lock()
+
+        self.metrics = pipeline_metrics.get_registry(scoped=False)
+        self.metrics.gauge('matcher_pool_queue_depth', 'Faceprints of every camera waiting for a matcher', self.pending_q.qsize)
+
+    def start(self):
+        # Started by the first camera, the others find it running
+        with self.lock:
+            if self.threads:
+                return
+            for index in range(self.workers):
+                thread = threading.Thread(target=self.run_matcher, name=f'matcher-{index}', daemon=True)
+                self.threads.append(thread)
+                thread.start()
+
+    def submit(self, match_pipeline, result):
+        self.pending_q.put((match_pipeline, result))
+
+    def run_matcher(self):
+        while True:
+            match_pipeline, result = self.pending_q.get()
+            match_pipeline.match_one(result)
+
+
+_matcher_pool = None
+_matcher_pool_lock = threading.Lock()
+
+
+def get_matcher_pool(workers=1):
+    """Matcher pool shared by every camera, sized by the first caller"""
+    global _matcher_pool
+    with _matcher_pool_lock:
+        if _matcher_pool is None:
+            _matcher_pool = MatcherPool(workers)
+        return _matcher_pool
+
+
+class MatchPipeline:
+    """
+    Second stage of the authentication: gallery matching and result display, off the device thread.
+
+    The device thread submits each extracted faceprint and is free for the next extraction straight away. Matcher
+    workers take the faceprints from a bounded queue, so a slow gallery holds the device back once max_pending
+    attempts are waiting instead of piling them up. Results are shown in submission order whatever worker finished
+    first: each stays on screen for display_seconds, or until the next result replaces it after min_display_seconds.
+    With a matcher_pool the faceprints are matched by the threads shared with the other cameras, max_pending still
+    bounds the attempts of this camera and results are still shown on its own presenter.
+    """
+
+    def __init__(
+            self, match, show_result, clear_result, max_pending=4, workers=1, display_seconds=1.0,
+            min_display_seconds=0.5, matcher_pool=None
+    ):
+        """
+        :param match: match(AuthResult) -> AuthResult with employee_id and score set, runs on a matcher worker
+        :param show_result: show_result(AuthResult), runs on the presenter thread
+        :param clear_result: clear_result(AuthResult) when a result display ends without a newer result to show
+        :param max_pending: attempts waiting for a matcher before submit() blocks
+        :param workers: matcher worker threads, unused with a matcher_pool
+        :param matcher_pool: MatcherPool shared with the other cameras, None for workers of this pipeline
+        """
+        self.match = match
+        self.show_result = show_result
+        self.clear_result = clear_result
+        self.workers = workers
+        self.display_seconds = display_seconds
+        self.min_display_seconds = min(min_display_seconds, display_seconds)
+        self.matcher_pool = matcher_pool
+
+        self.pending_q = queue.Queue(maxsize=max_pending)
+        # Attempts of this pipeline waiting in the shared matcher pool
+        self.pool_slots = threading.BoundedSemaphore(max_pending)
+        self.pool_queued = 0
+        # Matched results by sequence number, until their turn to be shown
+        self.matched = {}
+        self.matched_condition = threading.Condition()
+        self.next_sequence = 0
+        self.next_display_sequence = 0
+        self.stopped = False
+        self.threads = []
+
+        self.metrics = pipeline_metrics.get_registry()
+        self.submit_wait_histogram = self.metrics.histogram('match_submit_wait_ms', 'Time the device thread waited for room in the match queue')
+        self.queue_wait_histogram = self.metrics.histogram('match_queue_wait_ms', 'Time an extracted faceprint waited for a matcher')
+        self.latency_histogram = self.metrics.histogram('match_result_latency_ms', 'Time from extraction to the result being shown')
+        self.metrics.gauge('match_queue_depth', 'Extracted faceprints waiting for a matcher', self.get_queue_depth)
+        self.metrics.gauge('match_results_in_flight', 'Results submitted and not shown yet', self.get_in_flight)
+
+    def start(self):
+        if self.matcher_pool is not None:
+            self.matcher_pool.start()
+        else:
+            for index in range(self.workers):
+                self.threads.append(threading.Thread(target=self.run_matcher, name=f'matcher-{index}', daemon=True))
+        self.threads.append(threading.Thread(target=self.run_presenter, name='result-presenter', daemon=True))
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        with self.matched_condition:
+            self.stopped = True
+            self.matched_condition.notify_all()
+        if self.matcher_pool is not None:
+            return
+        for _ in range(self.workers):
+            try:
+                self.pending_q.put_nowait(None)
+            except queue.Full:
+                pass
+
+    def get_in_flight(self):
+        return self.next_sequence - self.next_display_sequence
+
+    def get_queue_depth(self):
+        return self.pool_queued if self.matcher_pool is not None else self.pending_q.qsize()
+
+    def submit(self, result):
+        """Hand an extracted result over to the matchers, blocks only while max_pending results are waiting"""
+        result.sequence = self.next_sequence
+        result.submitted_at = time.perf_counter()
+        self.next_sequence += 1
+        if self.matcher_pool is not None:
+            self.pool_slots.acquire()
+            with self.matched_condition:
+                self.pool_queued += 1
+            self.matcher_pool.submit(self, result)
+        else:
+            self.pending_q.put(result)
+        self.submit_wait_histogram.observe_since(result.submitted_at)
+
+    def run_matcher(self):
+        while True:
+            result = self.pending_q.get()
+            if result is None or self.stopped:
+                return
+            self.match_one(result)
+
+    def match_one(self, result):
+        """Match a submitted result and queue it for display, runs on a matcher thread"""
+        if self.matcher_pool is not None:
+            with self.matched_condition:
+                self.pool_queued -= 1
+            self.pool_slots.release()
+        if self.stopped:
+            return
+        self.queue_wait_histogram.observe_since(result.submitted_at)
+        # Rejected faces (spoof, pose, device error) go through unmatched, to be shown in their turn
+        if result.device_success:
+            try:
+                result = self.match(result)
+            except Exception as e:
+                # Shown as an error to retry, not as a face without a match
+                LOGGER.error(f'Faceprint matching failed: {e}')
+                result.error = e
+        with self.matched_condition:
+            self.matched[result.sequence] = result
+            self.matched_condition.notify_all()
+
+    def take_next_result(self, timeout):
+        """Next result in submission order, None if the timeout expired first"""
+        with self.matched_condition:
+            self.matched_condition.wait_for(lambda: self.next_display_sequence in self.matched or self.stopped, timeout)
+            result = self.matched.pop(self.next_display_sequence, None)
+            if result is not None:
+                self.next_display_sequence += 1
+            return result
+
+    def run_presenter(self):
+        displayed = None
+        shown_at = None
+        while not self.stopped:
+            timeout = None if displayed is None else max(shown_at + self.display_seconds - time.perf_counter(), 0)
+            result = self.take_next_result(timeout)
+            if self.stopped:
+                return
+            if result is None:
+                # Display time is over with no newer result
+                if displayed is not None:
+                    self.clear_result(displayed)
+                    displayed = None
+                continue
+            if displayed is not None:
+                # A newer result replaces the one on screen once it was readable
+                time.sleep(max(shown_at + self.min_display_seconds - time.perf_counter(), 0))
+            self.latency_histogram.observe_since(result.submitted_at)
+            self.show_result(result)
+            displayed = result
+            shown_at = time.perf_counter()
@@ -0,0 +1,186 @@
+import time
+from types import SimpleNamespace
+import numpy as np
+import cv2
+
+import src.utility.gui_feedback_color_utility as color_utility
+import src.logger.custom_logger as custom_logger
+from src.processor.face_detection_status import FaceDetectionStatus
+
+LOGGER = custom_logger.get_logger()
+
+
+class OverlayRenderer:
+    """
+    Draws the detection boxes onto live camera frames in place.
+
+    Replaces ImageProcessor.draw_detection_box_on_image() on the hot path:
+        1. Only the bounding box ROI is alpha-blended, the full frame is never copied
+        2. Status labels are pre-rendered once per (status, font scale) into sprites, already mirrored so they
+           read correctly once the frame is flipped for display
+        3. The scale factors from the camera's 1080x1920 face coordinates are computed once per frame resolution
+    """
+    # Resolution the rsid_py.FaceRect coordinates are reported in
+    FACE_COORDINATE_WIDTH = 1080.0
+    FACE_COORDINATE_HEIGHT = 1920.0
+
+    ALPHA = 0.3
+
+    # Font scales are rounded to this step so sprites can be reused across slightly different box sizes
+    FONT_SCALE_STEP = 0.05
+
+    STATUS_TEXT = {
+        FaceDetectionStatus.PENDING: "PROCESSING",
+        FaceDetectionStatus.REJECTED: "REJECTED",
+        FaceDetectionStatus.ACCEPTED: "ACCEPTED"
+    }
+
+    def __init__(self):
+        # {(image width, image height): (scale_x, scale_y)}
+        self.scale_factors = {}
+        # {(status, font scale): sprite image}
+        self.label_sprites = {}
+        # {status: solid color block}, grown whenever a larger box has to be blended
+        self.color_blocks = {}
+
+    def get_scale_factors(self, image):
+        image_height, image_width = image.shape[:2]
+        scale_factors = self.scale_factors.get((image_width, image_height))
+        if scale_factors is None:
+            scale_factors = (
+                image_width / OverlayRenderer.FACE_COORDINATE_WIDTH,
+                image_height / OverlayRenderer.FACE_COORDINATE_HEIGHT
+            )
+            self.scale_factors[(image_width, image_height)] = scale_factors
+        return scale_factors
+
+    def get_color_block(self, status, color, width, height):
+        color_block = self.color_blocks.get(status)
+        if color_block is None or color_block.shape[0] < height or color_block.shape[1] < width:
+            block_height = max(height, 0 if color_block is None else color_block.shape[0])
+            block_width = max(width, 0 if color_block is None else color_block.shape[1])
+            color_block = np.empty((block_height, block_width, 3), dtype=np.uint8)
+            color_block[:] = color
+            self.color_blocks[status] = color_block
+        return color_block[:height, :width]
+
+    def get_label_sprite(self, status, font_scale):
+        font_scale = max(OverlayRenderer.FONT_SCALE_STEP, round(font_scale / OverlayRenderer.FONT_SCALE_STEP) * OverlayRenderer.FONT_SCALE_STEP)
+        sprite_key = (status, round(font_scale, 2))
+        sprite = self.label_sprites.get(sprite_key)
+        if sprite is not None:
+            return sprite
+
+        text = OverlayRenderer.STATUS_TEXT.get(status, "UNKNOWN")
+        # Black text for in-progress detections, white otherwise
+        text_color = (0, 0, 0) if status is FaceDetectionStatus.PENDING else (255, 255, 255)
+        font = cv2.FONT_HERSHEY_SIMPLEX
+        font_thickness = max(2, int(font_scale * 2))
+
+        (text_width, text_height), _ = cv2.getTextSize(text, font, font_scale, font_thickness)
+        bg_padding = int(text_height * 0.3)
+
+        # Background is the detection box color, same as the box itself
+        sprite = np.empty((text_height + 2 * bg_padding, text_width + 2 * bg_padding, 3), dtype=np.uint8)
+        sprite[:] = color_utility.get_detection_border_feedback_color(status)
+        cv2.putText(
+            sprite, text, (bg_padding, bg_padding + text_height), font, font_scale, text_color, font_thickness, cv2.LINE_AA
+        )
+        # Pre-mirror the label, the whole frame is flipped again before it is displayed
+        sprite = np.ascontiguousarray(sprite[:, ::-1])
+
+        self.label_sprites[sprite_key] = sprite
+        LOGGER.debug(f'Label sprite cached: {sprite_key}, {sprite.shape[1]}x{sprite.shape[0]}')
+        return sprite
+
+    def draw(self, detections, image):
+        for detection in detections:
+            self.draw_detection(detection, image)
+        return image
+
+    def draw_detection(self, detection, image):
+        face = detection.get('face')
+        status = detection.get('status')
+        image_height, image_width = image.shape[:2]
+
+        scale_x, scale_y = self.get_scale_factors(image)
+        x = int(face.x * scale_x)
+        y = int(face.y * scale_y)
+        w = int(face.w * scale_y)
+        h = int(face.h * scale_y)
+
+        color = color_utility.get_detection_border_feedback_color(status)
+
+        # Blend the box area only, clipped to the frame
+        x1, y1 = max(x, 0), max(y, 0)
+        x2, y2 = min(x + w, image_width), min(y + h, image_height)
+        if x2 > x1 and y2 > y1:
+            roi = image[y1:y2, x1:x2]
+            color_block = self.get_color_block(status, color, x2 - x1, y2 - y1)
+            cv2.addWeighted(color_block, OverlayRenderer.ALPHA, roi, 1 - OverlayRenderer.ALPHA, 0, dst=roi)
+
+        thickness = max(3, int(min(w, h) * 0.015))
+        cv2.rectangle(image, (x, y), (x + w, y + h), color, thickness)
+
+        # Label centered above the box, or below it when there is no room at the top
+        sprite = self.get_label_sprite(status, min(w, h) / 200.0)
+        sprite_height, sprite_width = sprite.shape[:2]
+        sprite_x = x + (w - sprite_width) // 2
+        sprite_y = y - int(sprite_height * 1.2)
+        if sprite_y < 0:
+            sprite_y = y + h + int(sprite_height * 0.2)
+        self.paste_sprite(sprite, image, sprite_x, sprite_y)
+
+        return image
+
+    @staticmethod
+    def paste_sprite(sprite, image, x, y):
+        image_height, image_width = image.shape[:2]
+        sprite_height, sprite_width = sprite.shape[:2]
+
+        x1, y1 = max(x, 0), max(y, 0)
+        x2, y2 = min(x + sprite_width, image_width), min(y + sprite_height, image_height)
+        if x2 <= x1 or y2 <= y1:
+            return
+
+        # The label is mirrored, so the part that falls off the right edge is its left-most part and vice versa
+        sprite_x1 = sprite_width - (x2 - x)
+        sprite_x2 = sprite_width - (x1 - x)
+        image[y1:y2, x1:x2] = sprite[y1 - y:y2 - y, sprite_x1:sprite_x2]
+
+
+def main():
+    # Micro-benchmark of the previous full-frame overlay against the ROI renderer at 1, 3 and 5 faces
+    from src.processor.image_processor import ImageProcessor
+
+    frame = np.random.randint(0, 255, (1280, 720, 3), dtype=np.uint8)
+    statuses = [FaceDetectionStatus.PENDING, FaceDetectionStatus.ACCEPTED, FaceDetectionStatus.REJECTED]
+    iterations = 200
+    renderer = OverlayRenderer()
+
+    for face_count in (1, 3, 5):
+        detections = [
+            {
+                'face': SimpleNamespace(x=60 + i * 190, y=500 + (i % 2) * 400, w=180, h=220),
+                'status': statuses[i % len(statuses)]
+            } for i in range(face_count)
+        ]
+
+        image = frame.copy()
+        start_time = time.perf_counter()
+        for _ in range(iterations):
+            for detection in detections:
+                ImageProcessor.draw_detection_box_on_image(detection, image)
+        legacy_ms = (time.perf_counter() - start_time) * 1000 / iterations
+
+        image = frame.copy()
+        start_time = time.perf_counter()
+        for _ in range(iterations):
+            renderer.draw(detections, image)
+        renderer_ms = (time.perf_counter() - start_time) * 1000 / iterations
+
+        print(f'{face_count} face(s): full-frame overlay {legacy_ms:.3f} ms/frame, ROI overlay {renderer_ms:.3f} ms/frame')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+import importlib
+import os
+import threading
+
+import src.logger.custom_logger as custom_logger
+
+LOGGER = custom_logger.get_logger()
+
+# rsid_py implementations, selected by device_backend in the app config. The RSID_BACKEND environment variable
+# overrides it, e.g. RSID_BACKEND=simulated on a CI box
+BACKEND_DEVICE = 'device'
+BACKEND_SIMULATED = 'simulated'
+BACKEND_MODULES = {
+    BACKEND_DEVICE: 'rsid_py',
+    BACKEND_SIMULATED: 'src.simulator.rsid_py'
+}
+
+_backend = None
+_simulator_settings = None
+_module = None
+_lock = threading.Lock()
+
+
+def select(backend=None, simulator_settings=None):
+    """Choose the rsid_py implementation, before the first device call"""
+    global _backend, _simulator_settings, _module
+    with _lock:
+        backend = os.environ.get('RSID_BACKEND') or backend or BACKEND_DEVICE
+        if backend not in BACKEND_MODULES:
+            LOGGER.error(f'Unknown device backend "{backend}", using "{BACKEND_DEVICE}"')
+            backend = BACKEND_DEVICE
+        if _module is not None and backend != _backend:
+            LOGGER.warning(f'Device backend already loaded as "{_backend}", ignoring "{backend}"')
+            return
+        _backend = backend
+        _simulator_settings = simulator_settings
+
+
+def get_backend():
+    if _backend is None:
+        select()
+    return _backend
+
+
+def is_simulated():
+    return get_backend() == BACKEND_SIMULATED
+
+
+def get_rsid():
+    """The selected rsid_py module, imported on first use"""
+    global _module
+    backend = get_backend()
+    with _lock:
+        if _module is None:
+            _module = importlib.import_module(BACKEND_MODULES[backend])
+            if backend == BACKEND_SIMULATED:
+                _module.configure(**(_simulator_settings or {}))
+                LOGGER.warning('Running on the simulated F455 device')
+        return _module
+
+
+class _RsidModule:
+    """Stands for the rsid_py module in `rsid_py.X` expressions, resolved to the selected backend on first use"""
+
+    def __getattr__(self, name):
+        return getattr(get_rsid(), name)
+
+
+rsid_py = _RsidModule()
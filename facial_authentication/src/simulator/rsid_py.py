@@ -0,0 +1,495 @@
+"""
+Simulated rsid_py: the parts of the RealSenseID Python API used by the app, without an F455.
+
+A scripted scene has people stepping in front of the camera in turn, each for person_seconds with gap_seconds in
+between. Preview delivers synthetic frames of that scene (or replays a FrameRecorder recording), FaceAuthenticator
+extracts faceprints of the person present with the configured latency and status mix, and match_faceprints scores
+them so that known identities match their enrolled faceprints and unknown ones do not.
+Select it with "device_backend": "simulated" in the app config, settings go in "rsid_simulator".
+"""
+import argparse
+import enum
+import hashlib
+import random
+import threading
+import time
+import numpy as np
+import cv2
+
+import src.logger.custom_logger as custom_logger
+
+LOGGER = custom_logger.get_logger()
+
+SIMULATED_PORT = 'SIMULATED'
+
+# Length of the feature vectors, as in the extracted faceprints of the device
+FEATURES_SIZE = 259
+
+# Status enums, with the member names of the device so str(status) and the FaceDetectionMessage texts match
+Status = enum.Enum('Status', [
+    'Ok', 'Error', 'SerialError', 'SecurityError', 'VersionMismatch', 'CrcError', 'LicenseError', 'LicenseCheck',
+    'TooManySpoofs'
+])
+AuthenticateStatus = enum.Enum('AuthenticateStatus', [
+    'Success', 'NoFaceDetected', 'FaceDetected', 'LedFlowSuccess', 'FaceIsTooFarToTheTop', 'FaceIsTooFarToTheBottom',
+    'FaceIsTooFarToTheRight', 'FaceIsTooFarToTheLeft', 'FaceTiltIsTooUp', 'FaceTiltIsTooDown', 'FaceTiltIsTooRight',
+    'FaceTiltIsTooLeft', 'CameraStarted', 'CameraStopped', 'MaskDetectedInHighSecurity', 'Spoof', 'Forbidden',
+    'DeviceError', 'Failure', 'SerialOk', 'SerialError', 'SerialSecurityError', 'VersionMismatch', 'CrcError',
+    'Reserved1', 'Reserved2', 'Reserved3'
+])
+EnrollStatus = enum.Enum('EnrollStatus', [
+    'Success', 'NoFaceDetected', 'FaceDetected', 'LedFlowSuccess', 'FaceIsTooFarToTheTop', 'FaceIsTooFarToTheBottom',
+    'FaceIsTooFarToTheRight', 'FaceIsTooFarToTheLeft', 'FaceTiltIsTooUp', 'FaceTiltIsTooDown', 'FaceTiltIsTooRight',
+    'FaceTiltIsTooLeft', 'FaceIsNotFrontal', 'CameraStarted', 'CameraStopped', 'MultipleFacesDetected', 'Failure',
+    'DeviceError', 'EnrollWithMaskIsForbidden', 'Spoof', 'SerialOk', 'SerialError', 'SerialSecurityError',
+    'VersionMismatch', 'CrcError', 'Reserved1', 'Reserved2', 'Reserved3'
+])
+CameraRotation = enum.Enum('CameraRotation', ['Rotation_0_Deg', 'Rotation_180_Deg', 'Rotation_90_Deg', 'Rotation_270_Deg'])
+SecurityLevel = enum.Enum('SecurityLevel', ['High', 'Medium', 'Low'])
+AlgoFlow = enum.Enum('AlgoFlow', ['All', 'FaceDetectionOnly', 'SpoofOnly', 'RecognitionOnly'])
+FaceSelectionPolicy = enum.Enum('FaceSelectionPolicy', ['Single', 'All'])
+
+DEFAULT_SETTINGS = {
+    # Scene: people in turn in front of the camera, a share of them not enrolled
+    "known_identities": 20,
+    "unknown_rate": 0.1,
+    "person_seconds": 3.0,
+    "gap_seconds": 2.0,
+    # Device latencies, in seconds
+    "auth_seconds": 0.8,
+    "enroll_seconds": 2.5,
+    # Faceprint extraction from a photo (enroll_image_feature_extraction), upload of the image included
+    "enroll_image_seconds": 0.6,
+    # Time the device looks for a face before reporting NoFaceDetected
+    "no_face_timeout_seconds": 5.0,
+    # Host-side matching time per faceprint pair
+    "match_seconds": 0.0002,
+    # Outcome of the extractions with a face present, status member name -> weight
+    "auth_status_mix": {"Success": 0.85, "Spoof": 0.05, "FaceTiltIsTooUp": 0.05, "FaceIsTooFarToTheLeft": 0.05},
+    "enroll_status_mix": {"Success": 0.9, "FaceIsNotFrontal": 0.1},
+    # Capture noise of the extracted features (pose, lighting), drawn per extraction from this range
+    "capture_noise": [0.3, 0.3],
+    # Share of device commands failing with a dropped serial link (raises RuntimeError, as rsid_py does)
+    "serial_error_rate": 0.0,
+    # Preview: synthetic frames of the scene, or a FrameRecorder recording replayed in a loop
+    "preview_recording_path": None,
+    "preview_width": 540,
+    "preview_height": 960,
+    "preview_fps": 30,
+    "seed": 0
+}
+
+# Match score of identical faceprints, and score a match needs to succeed
+MAX_SCORE = 4000
+MATCH_SCORE_THRESHOLD = 2000
+
+_settings = dict(DEFAULT_SETTINGS)
+_scene = None
+_scene_lock = threading.Lock()
+
+
+def configure(**settings):
+    """Override DEFAULT_SETTINGS, before the first device or preview is created"""
+    global _scene
+    unknown = set(settings) - set(DEFAULT_SETTINGS)
+    if unknown:
+        LOGGER.warning(f'Unknown rsid_py simulator settings ignored: {sorted(unknown)}')
+    _settings.update({name: value for name, value in settings.items() if name in DEFAULT_SETTINGS and value is not None})
+    with _scene_lock:
+        _scene = None
+
+
+def get_scene():
+    """Scene shared by every simulated device and preview"""
+    global _scene
+    with _scene_lock:
+        if _scene is None:
+            _scene = SimulatedScene(_settings)
+        return _scene
+
+
+def identity_features(identity, noise=0.0, rng=None):
+    """Feature vector of an identity, with some capture noise"""
+    vector = np.random.default_rng(identity).standard_normal(FEATURES_SIZE)
+    if noise:
+        vector = vector + noise * (rng or np.random.default_rng()).standard_normal(FEATURES_SIZE)
+    vector *= 40.0 / np.sqrt(np.mean(vector * vector))
+    return np.clip(np.round(vector), -127, 127).astype(int).tolist()
+
+
+class SimulatedScene:
+    """Who is in front of the camera, as a function of time"""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.rng = random.Random(settings["seed"])
+        self.start_time = time.perf_counter()
+        self.period = settings["person_seconds"] + settings["gap_seconds"]
+        self.identities = {}
+
+    def get_identity(self, person_index):
+        """Identity of the n-th person, 0 to known_identities - 1 for enrolled people"""
+        if person_index not in self.identities:
+            rng = random.Random(self.settings["seed"] * 1000003 + person_index)
+            if rng.random() < self.settings["unknown_rate"]:
+                self.identities[person_index] = 1000000 + person_index
+            else:
+                self.identities[person_index] = rng.randrange(self.settings["known_identities"])
+        return self.identities[person_index]
+
+    def get_present_identity(self, now=None):
+        """Identity of the person in front of the camera, None if nobody is"""
+        elapsed = (now or time.perf_counter()) - self.start_time
+        person_index, offset = divmod(elapsed, self.period)
+        if offset >= self.settings["person_seconds"]:
+            return None
+        return self.get_identity(int(person_index))
+
+    def draw_status(self, mix, status_enum):
+        names = list(mix)
+        return getattr(status_enum, self.rng.choices(names, weights=[mix[name] for name in names])[0])
+
+
+class Faceprints:
+    """Faceprints stored on the host, as read from the DB"""
+
+    def __init__(self):
+        self.version = 0
+        self.features_type = 0
+        self.flags = 0
+        self.adaptive_descriptor_nomask = []
+        self.adaptive_descriptor_withmask = []
+        self.enroll_descriptor = []
+
+
+class ExtractedFaceprints:
+    """Faceprints extracted by the device for an authentication or an enrolment"""
+
+    def __init__(self, features, identity=None):
+        self.version = 7
+        self.features_type = 0
+        self.flags = 0
+        self.features = features
+        # Not in rsid_py, eases checking simulated runs
+        self.identity = identity
+
+
+class MatchResult:
+    def __init__(self, success, should_update, score):
+        self.success = success
+        self.should_update = should_update
+        self.score = score
+
+    def __repr__(self):
+        return f'MatchResult(success={self.success}, should_update={self.should_update}, score={self.score})'
+
+
+class FaceRect:
+    """Face box in the 1080x1920 coordinates of the device"""
+
+    def __init__(self, x, y, w, h):
+        self.x, self.y, self.w, self.h = x, y, w, h
+
+
+# Box of the person present, in device coordinates
+SCENE_FACE_RECT = (390, 560, 300, 400)
+
+
+class DeviceConfig:
+    def __init__(self):
+        self.camera_rotation = CameraRotation.Rotation_0_Deg
+        self.security_level = SecurityLevel.Medium
+        self.algo_flow = AlgoFlow.All
+        self.face_selection_policy = FaceSelectionPolicy.Single
+
+
+class FaceAuthenticator:
+    """Scripted device session, extractions follow the scene and the status mix of the settings"""
+
+    def __init__(self, port=None):
+        self.port = port
+        self.scene = get_scene()
+        self.settings = self.scene.settings
+        self.device_config = DeviceConfig()
+        self.cancel_event = threading.Event()
+        self.rng = np.random.default_rng(self.settings["seed"])
+        self.connected = True
+        LOGGER.debug(f'Simulated device session opened on {port}')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.disconnect()
+
+    def connect(self, port=None):
+        self.port = port or self.port
+        self.connected = True
+
+    def disconnect(self):
+        self.connected = False
+
+    def check_link(self):
+        if not self.connected:
+            raise RuntimeError('Not connected')
+        if self.scene.rng.random() < self.settings["serial_error_rate"]:
+            self.connected = False
+            raise RuntimeError('Simulated serial link failure')
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def wait_for_face(self, on_faces):
+        """Identity of the person present once the device found a face, None on timeout or cancel"""
+        deadline = time.perf_counter() + self.settings["no_face_timeout_seconds"]
+        while not self.cancel_event.is_set() and time.perf_counter() < deadline:
+            identity = self.scene.get_present_identity()
+            if identity is not None:
+                if on_faces is not None:
+                    on_faces([FaceRect(*SCENE_FACE_RECT)], int(time.time() * 1000))
+                return identity
+            self.cancel_event.wait(0.02)
+        return None
+
+    def extract(self, seconds, status_enum, mix, on_result, on_hint, on_faces, on_progress=None):
+        self.check_link()
+        self.cancel_event.clear()
+        identity = self.wait_for_face(on_faces)
+        if self.cancel_event.is_set():
+            return Status.Ok
+        if identity is None:
+            on_result(status_enum.NoFaceDetected, None)
+            return Status.Ok
+
+        if on_hint is not None:
+            on_hint(status_enum.FaceDetected)
+        steps = 4
+        for step in range(steps):
+            if self.cancel_event.wait(seconds / steps):
+                return Status.Ok
+            if on_progress is not None:
+                on_progress(step + 1)
+        status = self.scene.draw_status(mix, status_enum)
+        features = identity_features(identity, noise=self.rng.uniform(*self.settings["capture_noise"]), rng=self.rng)
+        on_result(status, ExtractedFaceprints(features, identity))
+        return Status.Ok
+
+    def extract_faceprints_for_auth(self, on_result, on_hint=None, on_faces=None):
+        return self.extract(
+            self.settings["auth_seconds"], AuthenticateStatus, self.settings["auth_status_mix"], on_result, on_hint, on_faces
+        )
+
+    def extract_faceprints_for_enroll(self, on_result, on_progress=None, on_hint=None, on_faces=None):
+        return self.extract(
+            self.settings["enroll_seconds"], EnrollStatus, self.settings["enroll_status_mix"], on_result, on_hint,
+            on_faces, on_progress
+        )
+
+    def enroll_image_feature_extraction(self, user_id, buffer, width, height):
+        """Faceprints of the face in a BGR photo, (EnrollStatus, ExtractedFaceprints or None)"""
+        self.check_link()
+        image = np.asarray(buffer, dtype=np.uint8).reshape(height, width, 3)
+        time.sleep(self.settings["enroll_image_seconds"])
+        identity = image_identity(image)
+        if identity is None:
+            return EnrollStatus.NoFaceDetected, None
+        status = self.scene.draw_status(self.settings["enroll_status_mix"], EnrollStatus)
+        if status != EnrollStatus.Success:
+            return status, None
+        features = identity_features(identity, noise=self.rng.uniform(*self.settings["capture_noise"]), rng=self.rng)
+        return status, ExtractedFaceprints(features, identity)
+
+    def match_faceprints(self, new_faceprints, existing_faceprints, updated_faceprints):
+        """Cosine similarity of the feature vectors scaled to MAX_SCORE, host-side like the device library"""
+        if self.settings["match_seconds"]:
+            time.sleep(self.settings["match_seconds"])
+        new_features = np.asarray(new_faceprints.features, dtype=np.float32)
+        existing_features = np.asarray(existing_faceprints.enroll_descriptor, dtype=np.float32)
+        norm = float(np.linalg.norm(new_features) * np.linalg.norm(existing_features))
+        score = int(MAX_SCORE * float(new_features @ existing_features) / norm) if norm else 0
+        return MatchResult(score >= MATCH_SCORE_THRESHOLD, False, score)
+
+    def remove_all_users(self):
+        self.check_link()
+        return Status.Ok
+
+    def query_device_config(self):
+        self.check_link()
+        return self.device_config
+
+    def set_device_config(self, device_config):
+        self.check_link()
+        self.device_config = device_config
+        return Status.Ok
+
+
+def image_identity(image):
+    """
+    Identity of the person in a photo, None if there is no face (a blank image).
+    Photos from face_photo() of the same seed are the same person whatever their noise, resizing or JPEG compression.
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    if gray.std() < 5:
+        return None
+    blocks = cv2.resize(gray, (PHOTO_BLOCKS, PHOTO_BLOCKS), interpolation=cv2.INTER_AREA) // 64
+    return int.from_bytes(hashlib.sha1(blocks.tobytes()).digest()[:4], 'big')
+
+
+# Photos are a grid of PHOTO_BLOCKS x PHOTO_BLOCKS flat blocks, one of 4 grey levels each
+PHOTO_BLOCKS = 8
+
+
+def face_photo(seed, rng=None, width=480, height=640):
+    """BGR photo of the person of the seed, with some per-shot noise"""
+    levels = np.random.default_rng(seed).integers(0, 4, (PHOTO_BLOCKS, PHOTO_BLOCKS)) * 64 + 32
+    image = cv2.resize(levels.astype(np.uint8), (width, height), interpolation=cv2.INTER_NEAREST)
+    noise = (rng or np.random.default_rng()).integers(-8, 9, image.shape)
+    image = np.clip(image.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+    return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+
+
+def generate_faceprint_records(employee_ids):
+    """DB faceprint records of simulated identities 0, 1, ... enrolled under the given employee IDs"""
+    records = []
+    for identity, employee_id in enumerate(employee_ids):
+        features = identity_features(identity)
+        records.append({
+            "employee_id": employee_id,
+            "version": 7,
+            "features_type": 0,
+            "flags": 0,
+            "adaptive_descriptor_nomask": features,
+            "adaptive_descriptor_withmask": [0] * FEATURES_SIZE,
+            "enroll_descriptor": features
+        })
+    return records
+
+
+class PreviewConfig:
+    def __init__(self):
+        self.camera_number = -1
+
+
+class PreviewImage:
+    """Preview frame, RGB like the device preview"""
+
+    def __init__(self, array, number):
+        self.array = array
+        self.number = number
+        self.height, self.width = array.shape[:2]
+
+    def get_buffer(self):
+        return self.array.reshape(-1)
+
+
+class Preview:
+    """Delivers frames on its own thread, like the device preview"""
+
+    def __init__(self, preview_config=None):
+        self.preview_config = preview_config or PreviewConfig()
+        self.scene = get_scene()
+        self.settings = self.scene.settings
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.frames = self.render_frames()
+
+    def render_frames(self):
+        """Synthetic frames without and with a face, rendered once"""
+        width, height = self.settings["preview_width"], self.settings["preview_height"]
+        empty = np.full((height, width, 3), 96, dtype=np.uint8)
+        cv2.rectangle(empty, (0, int(height * 0.75)), (width, height), (70, 70, 80), -1)
+        face = empty.copy()
+        x, y, w, h = SCENE_FACE_RECT
+        scale_x, scale_y = width / 1080.0, height / 1920.0
+        centre = (int((x + w / 2) * scale_x), int((y + h / 2) * scale_y))
+        cv2.ellipse(face, centre, (int(w / 2 * scale_x), int(h / 2 * scale_y)), 0, 0, 360, (224, 172, 140), -1)
+        for eye_x in (-0.2, 0.2):
+            eye = (centre[0] + int(eye_x * w * scale_x), centre[1] - int(0.1 * h * scale_y))
+            cv2.circle(face, eye, max(int(0.04 * w * scale_x), 1), (40, 40, 40), -1)
+        return {False: empty, True: face}
+
+    def start(self, on_image):
+        self.stop_event.clear()
+        if self.settings["preview_recording_path"]:
+            from src.processor.frame_source import FileFrameSource
+            self.thread = FileFrameSource(self.settings["preview_recording_path"], loop=True)
+            self.thread.start(on_image)
+            return
+        self.thread = threading.Thread(target=self.run, args=(on_image,), name='simulated-preview', daemon=True)
+        self.thread.start()
+
+    def run(self, on_image):
+        frame_seconds = 1.0 / self.settings["preview_fps"]
+        next_frame_time = time.perf_counter()
+        number = 0
+        while not self.stop_event.is_set():
+            face_present = self.scene.get_present_identity() is not None
+            on_image(PreviewImage(self.frames[face_present].copy(), number))
+            number += 1
+            next_frame_time += frame_seconds
+            delay = next_frame_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_frame_time = time.perf_counter()
+
+    def stop(self):
+        if isinstance(self.thread, threading.Thread):
+            self.stop_event.set()
+        elif self.thread is not None:
+            self.thread.stop()
+
+
+def main():
+    # Headless run of the simulated device: authentications against a generated gallery, and the preview rate
+    parser = argparse.ArgumentParser(description='Simulated F455 device')
+    parser.add_argument('--attempts', type=int, default=50)
+    parser.add_argument('--employees', type=int, default=20)
+    parser.add_argument('--time-scale', type=float, default=0.02, help='device latencies and scene timing multiplier')
+    parser.add_argument('--preview-seconds', type=float, default=2.0)
+    args = parser.parse_args()
+
+    configure(
+        known_identities=args.employees, person_seconds=3.0 * args.time_scale, gap_seconds=0.5 * args.time_scale,
+        auth_seconds=0.8 * args.time_scale, no_face_timeout_seconds=5.0 * args.time_scale
+    )
+    gallery = {}
+    for record in generate_faceprint_records([f'E{index:04d}' for index in range(args.employees)]):
+        faceprints = Faceprints()
+        faceprints.enroll_descriptor = record["enroll_descriptor"]
+        gallery[record["employee_id"]] = faceprints
+
+    outcomes = {}
+    correct = 0
+    start_time = time.perf_counter()
+    with FaceAuthenticator(SIMULATED_PORT) as authenticator:
+        for _ in range(args.attempts):
+            results = []
+            authenticator.extract_faceprints_for_auth(on_result=lambda status, faceprints: results.append((status, faceprints)))
+            status, faceprints = results[0]
+            outcome = status.name
+            if status == AuthenticateStatus.Success:
+                scores = {
+                    employee_id: authenticator.match_faceprints(faceprints, existing, Faceprints())
+                    for employee_id, existing in gallery.items()
+                }
+                employee_id, match_result = max(scores.items(), key=lambda item: item[1].score)
+                matched = employee_id if match_result.success else None
+                expected = f'E{faceprints.identity:04d}' if faceprints.identity < args.employees else None
+                correct += matched == expected
+                outcome = 'Matched' if matched else 'NoMatch'
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    elapsed = time.perf_counter() - start_time
+    print(f'{args.attempts} authentications in {elapsed:.2f}s: {outcomes}')
+    print(f'Matches identifying the right person (or nobody): {correct}/{outcomes.get("Matched", 0) + outcomes.get("NoMatch", 0)}')
+
+    frames = []
+    preview = Preview(PreviewConfig())
+    preview.start(lambda image: frames.append(image.number))
+    time.sleep(args.preview_seconds)
+    preview.stop()
+    print(f'Preview: {len(frames) / args.preview_seconds:.1f} frames/s of {preview.frames[True].shape[1]}x{preview.frames[True].shape[0]}')
+
+
+if __name__ == '__main__':
+    main()
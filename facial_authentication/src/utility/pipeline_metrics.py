@@ -0,0 +1,300 @@
+import contextlib
+import threading
+import time
+from collections import deque
+
+import src.logger.custom_logger as custom_logger
+
+LOGGER = custom_logger.get_logger()
+
+# Default histogram bucket upper bounds, in milliseconds
+DEFAULT_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+
+class Counter:
+    """Monotonically increasing count, e.g. frames dropped"""
+
+    def __init__(self, name, description=''):
+        self.name = name
+        self.description = description
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge:
+    """
+    Point-in-time value, e.g. queue depth.
+    Either set explicitly or backed by a callable that is only evaluated when a snapshot is taken.
+    """
+
+    def __init__(self, name, description='', value_func=None):
+        self.name = name
+        self.description = description
+        self.value = 0
+        self.value_func = value_func
+
+    def set(self, value):
+        self.value = value
+
+    def snapshot(self):
+        if self.value_func is not None:
+            try:
+                return self.value_func()
+            except Exception as e:
+                LOGGER.debug(f'Gauge "{self.name}" evaluation failed: {e}')
+                return None
+        return self.value
+
+
+class Meter:
+    """Event rate over a sliding window, e.g. frames per second"""
+
+    def __init__(self, name, description='', window_seconds=5.0, max_events=1024):
+        self.name = name
+        self.description = description
+        self.window_seconds = window_seconds
+        self.total = 0
+        self._timestamps = deque(maxlen=max_events)
+
+    def mark(self):
+        self._timestamps.append(time.monotonic())
+        self.total += 1
+
+    def rate(self):
+        timestamps = list(self._timestamps)
+        if len(timestamps) < 2:
+            return 0.0
+        window_start = time.monotonic() - self.window_seconds
+        recent = [t for t in timestamps if t >= window_start]
+        if len(recent) < 2:
+            return 0.0
+        elapsed = recent[-1] - recent[0]
+        return (len(recent) - 1) / elapsed if elapsed > 0 else 0.0
+
+    def snapshot(self):
+        return {
+            "rate": round(self.rate(), 2),
+            "total": self.total
+        }
+
+
+class Histogram:
+    """
+    Distribution of durations (milliseconds).
+    Keeps cumulative bucket counts for export and a bounded window of recent samples for percentiles.
+    """
+
+    def __init__(self, name, description='', buckets=DEFAULT_BUCKETS_MS, window=256):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * (len(self.buckets) + 1)  # Last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, value_ms):
+        with self._lock:
+            self.count += 1
+            self.sum += value_ms
+            if value_ms > self.max:
+                self.max = value_ms
+            self._recent.append(value_ms)
+            for i, bound in enumerate(self.buckets):
+                if value_ms <= bound:
+                    self.bucket_counts[i] += 1
+                    break
+            else:
+                self.bucket_counts[-1] += 1
+
+    def observe_since(self, start_time):
+        """Record the time elapsed since a time.perf_counter() start time"""
+        self.observe((time.perf_counter() - start_time) * 1000)
+
+    def percentile(self, percent):
+        recent = sorted(self._recent)
+        if not recent:
+            return 0.0
+        index = min(len(recent) - 1, int(round(percent / 100.0 * (len(recent) - 1))))
+        return recent[index]
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "mean_ms": round(self.sum / self.count, 3) if self.count else 0.0,
+            "p50_ms": round(self.percentile(50), 3),
+            "p95_ms": round(self.percentile(95), 3),
+            "max_ms": round(self.max, 3)
+        }
+
+
+class MetricsRegistry:
+    """
+    Holds every metric of the frame pipeline, metrics are created on first use and shared by name.
+    Feeding a metric is a couple of attribute updates, so it is safe to do on every frame.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.labels = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, metric_class, name, labels=None, **kwargs):
+        # Metrics with labels are kept apart from the unlabelled one of the same name, e.g. one per camera
+        key = name
+        if labels:
+            key = name + '{' + ','.join(f'{label}="{value}"' for label, value in sorted(labels.items())) + '}'
+        metric = self.metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self.metrics.get(key)
+                if metric is None:
+                    metric = metric_class(name, **kwargs)
+                    metric.labels = dict(labels or {})
+                    self.metrics[key] = metric
+        return metric
+
+    def counter(self, name, description='', labels=None):
+        return self._get_or_create(Counter, name, labels, description=description)
+
+    def gauge(self, name, description='', value_func=None, labels=None):
+        gauge = self._get_or_create(Gauge, name, labels, description=description)
+        if value_func is not None:
+            gauge.value_func = value_func
+        return gauge
+
+    def meter(self, name, description='', labels=None):
+        return self._get_or_create(Meter, name, labels, description=description)
+
+    def histogram(self, name, description='', labels=None):
+        return self._get_or_create(Histogram, name, labels, description=description)
+
+    def with_labels(self, **labels):
+        return LabelledRegistry(self, labels)
+
+    def set_label(self, key, value):
+        """Static labels attached to every export, e.g. the station ID"""
+        self.labels[key] = value
+
+    def snapshot(self):
+        return {
+            "labels": dict(self.labels),
+            "timestamp": time.time(),
+            "metrics": {name: metric.snapshot() for name, metric in list(self.metrics.items())}
+        }
+
+    def to_prometheus(self):
+        """Render every metric in the Prometheus text exposition format"""
+        label_str = ','.join(f'{key}="{value}"' for key, value in self.labels.items())
+        lines = []
+
+        described = set()
+        # Series of the same metric (one per camera) must be grouped under a single HELP and TYPE
+        for key, metric in sorted(self.metrics.items(), key=lambda item: (item[1].name, item[0])):
+            metric_name = f'facial_{metric.name}'
+            metric_label_str = ','.join(f'{label}="{value}"' for label, value in sorted(metric.labels.items()))
+
+            def _labels(extra=''):
+                joined = ','.join(part for part in (label_str, metric_label_str, extra) if part)
+                return f'{{{joined}}}' if joined else ''
+
+            describe = metric.name not in described
+            described.add(metric.name)
+            if metric.description and describe:
+                lines.append(f'# HELP {metric_name} {metric.description}')
+            if isinstance(metric, Counter):
+                if describe:
+                    lines.append(f'# TYPE {metric_name} counter')
+                lines.append(f'{metric_name}{_labels()} {metric.value}')
+            elif isinstance(metric, Gauge):
+                value = metric.snapshot()
+                if describe:
+                    lines.append(f'# TYPE {metric_name} gauge')
+                lines.append(f'{metric_name}{_labels()} {value if value is not None else "NaN"}')
+            elif isinstance(metric, Meter):
+                if describe:
+                    lines.append(f'# TYPE {metric_name}_per_second gauge')
+                lines.append(f'{metric_name}_per_second{_labels()} {metric.rate():.3f}')
+                if describe:
+                    lines.append(f'# TYPE {metric_name}_total counter')
+                lines.append(f'{metric_name}_total{_labels()} {metric.total}')
+            elif isinstance(metric, Histogram):
+                if describe:
+                    lines.append(f'# TYPE {metric_name} histogram')
+                cumulative = 0
+                for bound, bucket_count in zip(metric.buckets, metric.bucket_counts):
+                    cumulative += bucket_count
+                    bucket_labels = _labels('le="%s"' % bound)
+                    lines.append(f'{metric_name}_bucket{bucket_labels} {cumulative}')
+                cumulative += metric.bucket_counts[-1]
+                bucket_labels = _labels('le="+Inf"')
+                lines.append(f'{metric_name}_bucket{bucket_labels} {cumulative}')
+                lines.append(f'{metric_name}_sum{_labels()} {metric.sum:.3f}')
+                lines.append(f'{metric_name}_count{_labels()} {metric.count}')
+        return '\n'.join(lines) + '\n'
+
+
+class LabelledRegistry:
+    """View of a registry creating metrics that carry extra labels, e.g. the camera of a capture pipeline"""
+
+    def __init__(self, registry, labels):
+        self.registry = registry
+        self.labels = labels
+
+    def counter(self, name, description=''):
+        return self.registry.counter(name, description, labels=self.labels)
+
+    def gauge(self, name, description='', value_func=None):
+        return self.registry.gauge(name, description, value_func, labels=self.labels)
+
+    def meter(self, name, description=''):
+        return self.registry.meter(name, description, labels=self.labels)
+
+    def histogram(self, name, description=''):
+        return self.registry.histogram(name, description, labels=self.labels)
+
+    def with_labels(self, **labels):
+        return LabelledRegistry(self.registry, dict(self.labels, **labels))
+
+    def __getattr__(self, name):
+        # Exports and static labels are those of the whole registry
+        return getattr(self.registry, name)
+
+
+_registry = MetricsRegistry()
+_scope = threading.local()
+
+
+@contextlib.contextmanager
+def labelled(**labels):
+    """
+    Metrics created through get_registry() on this thread inside the block carry the labels.
+    Components create their metrics when constructed, so constructing a camera's processors in the block labels
+    all of their metrics with the camera. Without labels the block changes nothing.
+    """
+    previous = getattr(_scope, 'registry', None)
+    if labels:
+        _scope.registry = (previous or _registry).with_labels(**labels)
+    try:
+        yield get_registry()
+    finally:
+        _scope.registry = previous
+
+
+def get_registry(scoped=True):
+    """
+    Registry of the app, or its labelled view inside a labelled() block.
+    Components shared by every camera pass scoped=False so their metrics do not carry the labels of the first camera.
+    """
+    if not scoped:
+        return _registry
+    return getattr(_scope, 'registry', None) or _registry